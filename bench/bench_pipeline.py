@@ -0,0 +1,221 @@
+"""
+Benchmarks the whole annotation pipeline offline - replaying recorded UTA/seqrepo and ExAC responses (see
+`tempus.replay`) - across worker and chunk size settings, and compares the results against a baseline.
+
+`record` annotates the vcf once with live services (network access required) and records their responses to the
+fixtures directory. `run` replays them for the vcf and for synthetic vcfs scaled up by repeating its records (only
+recorded loci can be replayed), measuring records/sec and peak RSS of every setting in a fresh process, and the
+per-stage latency of a single in-process pass, and writes the results as json. `compare` reports the changes between
+two results files and fails on regressions beyond the tolerance.
+
+Usage:
+    bench_pipeline.py record <FIXTURES> [--vcf=<VCF>]
+    bench_pipeline.py run <FIXTURES> <RESULTS> [--vcf=<VCF>] [--scales=<LIST>] [--workers=<LIST>]
+                          [--chunk-sizes=<LIST>]
+    bench_pipeline.py compare <BASELINE> <RESULTS> [--tolerance=<P>]
+
+Options:
+    --vcf=<VCF>             input vcf [default: test/data/Challenge_data.vcf]
+    --scales=<LIST>         comma-separated number of times the vcf records are repeated [default: 1,10]
+    --workers=<LIST>        comma-separated numbers of workers [default: 1,2,4]
+    --chunk-sizes=<LIST>    comma-separated chunk sizes [default: 1,10,100]
+    --tolerance=<P>         max relative slowdown (records/sec, stage latency) or growth (peak RSS) [default: 0.1]
+"""
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from docopt import docopt
+
+from tempus.commands import _AnnotateOptions, handle_annotate
+from tempus.annotation import AlleleAnnotator, annotation_to_csv_row, VariantAnnotation
+from tempus.hgvs import HgvsMachinery
+from tempus.replay import ExacReplay, connect_data_provider
+from tempus.vcf import read_vcf, VcfVariantAnnotation, open_vcf, TEMPUS_REFERENCE__ASSEMBLY
+
+STAGES = ('parse', 'hgvs', 'exac', 'vcf', 'csv')
+
+
+def _options(fixtures: Path, record: bool = False) -> _AnnotateOptions:
+    return _AnnotateOptions(
+        mode='sync', exac_batch_size=0, exac_sites=None, exac_concurrency=1, exac_rate_limit=None, cache=None,
+        transcript_index=None, previous=None, fixtures=fixtures, record=record)
+
+
+def scale_vcf(vcf: Path, out: Path, scale: int) -> int:
+    """
+    :param vcf: input vcf.
+    :param out: output vcf, with the records of the input repeated `scale` times.
+    :param scale: number of times the records are repeated.
+    :return: number of records written.
+    """
+    lines = vcf.read_bytes().splitlines(keepends=True)
+    header = [line for line in lines if line.startswith(b'#')]
+    records = [line for line in lines if not line.startswith(b'#') and line.strip()]
+    out.write_bytes(b''.join(header + records * scale))
+    return len(records) * scale
+
+
+def stage_latencies(vcf: Path, fixtures: Path) -> Dict[str, Dict[str, float]]:
+    """
+    Annotates the vcf record by record, as `tempus.annotation.annotate_vcf` does, timing each stage.
+
+    :return: latency percentiles (ms) by stage.
+    """
+    exac_annotator = ExacReplay.from_fixtures(fixtures)
+    latencies: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    with open_vcf(vcf) as vcf_io:
+        header, records = read_vcf(vcf_io)
+        hgvs_machinery = HgvsMachinery.from_assembly(
+            TEMPUS_REFERENCE__ASSEMBLY[header.reference], data_provider=connect_data_provider(fixtures))
+        allele_annotator = AlleleAnnotator.from_machinery(hgvs_machinery)
+        while True:
+            started = time.perf_counter()
+            locus = next(records, None)
+            if locus is None:
+                break
+            parsed = time.perf_counter()
+            variant, hgvs_ann, variant_exac = allele_annotator.most_deleterious_allele(locus)
+            hgvs_done = time.perf_counter()
+            exac_ann, = exac_annotator([variant_exac])
+            exac_done = time.perf_counter()
+            vcf_ann = VcfVariantAnnotation.from_vcf_locus(locus, variant.alt_index)
+            vcf_done = time.perf_counter()
+            annotation_to_csv_row(VariantAnnotation(var=variant, vcf=vcf_ann, hgvs=hgvs_ann, exac=exac_ann))
+            csv_done = time.perf_counter()
+            for stage, (start, end) in zip(STAGES, (
+                    (started, parsed), (parsed, hgvs_done), (hgvs_done, exac_done), (exac_done, vcf_done),
+                    (vcf_done, csv_done))):
+                latencies[stage].append(1000 * (end - start))
+    return {
+        stage: {
+            'mean_ms': float(np.mean(values)),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'total_ms': float(np.sum(values))}
+        for stage, values in latencies.items()}
+
+
+def _timed_run(vcf: Path, fixtures: Path, workers: int, chunk_size: int, conn):
+    started = time.perf_counter()
+    handle_annotate(
+        in_vcf=vcf, out=Path(os.devnull), max_workers=workers, chunk_size=chunk_size, window=0, output_format='csv',
+        row_group_size=0, resume=False, options=_options(fixtures))
+    seconds = time.perf_counter() - started
+    # ru_maxrss is in kB on linux; the children are the (joined) workers
+    conn.send({
+        'seconds': seconds,
+        'peak_rss_main_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_worker_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024})
+
+
+def pipeline_run(vcf: Path, n_records: int, fixtures: Path, workers: int, chunk_size: int) -> Dict[str, Any]:
+    """
+    Annotates the vcf in a fresh process, so that its peak RSS is not inflated by earlier runs.
+
+    :return: throughput and peak RSS.
+    """
+    recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+    # not a daemon, as it starts a worker pool of its own
+    process = multiprocessing.get_context('spawn').Process(
+        target=_timed_run, args=(vcf, fixtures, workers, chunk_size, send_conn))
+    process.start()
+    result = recv_conn.recv()
+    process.join()
+    return {
+        'workers': workers,
+        'chunk_size': chunk_size,
+        'records': n_records,
+        'records_per_sec': n_records / result['seconds'],
+        **result}
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench(vcf: Path, fixtures: Path, scales: List[int], workers: List[int], chunk_sizes: List[int]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        'meta': {
+            'vcf': str(vcf),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'created': datetime.now(timezone.utc).isoformat()},
+        'stages': stage_latencies(vcf, fixtures),
+        'runs': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            scaled_vcf = Path(tmp_dir) / f'scale_{scale}.vcf'
+            n_records = scale_vcf(vcf, scaled_vcf, scale)
+            for n_workers in workers:
+                for chunk_size in chunk_sizes:
+                    run = {'scale': scale, **pipeline_run(scaled_vcf, n_records, fixtures, n_workers, chunk_size)}
+                    print(f'scale {scale:>4} workers {n_workers:>3} chunk size {chunk_size:>5}: '
+                          f'{run["records_per_sec"]:>9,.1f} records/s, peak RSS {run["peak_rss_main_mb"]:,.0f} MB '
+                          f'(+ {run["peak_rss_worker_mb"]:,.0f} MB per worker)', file=sys.stderr)
+                    results['runs'].append(run)
+    return results
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    :return: regressions beyond the tolerance (relative change).
+    """
+    regressions = []
+
+    def check(name: str, before: float, after: float, higher_is_better: bool):
+        change = after / before - 1 if before else 0.0
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        print(f'{name:<48} {before:>12,.2f} {after:>12,.2f} {change:>+8.1%}{"  REGRESSION" if regressed else ""}')
+        if regressed:
+            regressions.append(name)
+
+    for stage, latency in results['stages'].items():
+        if stage in baseline['stages']:
+            check(f'{stage} p50 ms', baseline['stages'][stage]['p50_ms'], latency['p50_ms'], higher_is_better=False)
+    baseline_runs = {(run['scale'], run['workers'], run['chunk_size']): run for run in baseline['runs']}
+    for run in results['runs']:
+        key = (run['scale'], run['workers'], run['chunk_size'])
+        if key in baseline_runs:
+            name = 'scale {} workers {} chunk size {}'.format(*key)
+            check(f'{name} records/s', baseline_runs[key]['records_per_sec'], run['records_per_sec'],
+                  higher_is_better=True)
+            check(f'{name} peak RSS MB', baseline_runs[key]['peak_rss_main_mb'], run['peak_rss_main_mb'],
+                  higher_is_better=False)
+    return regressions
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',')]
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    if args['record']:
+        handle_annotate(
+            in_vcf=Path(args['--vcf']), out=Path(os.devnull), max_workers=1, chunk_size=1, window=0,
+            output_format='csv', row_group_size=0, resume=False, options=_options(Path(args['<FIXTURES>']), True))
+    elif args['run']:
+        Path(args['<RESULTS>']).write_text(json.dumps(bench(
+            vcf=Path(args['--vcf']), fixtures=Path(args['<FIXTURES>']), scales=_int_list(args['--scales']),
+            workers=_int_list(args['--workers']), chunk_sizes=_int_list(args['--chunk-sizes'])), indent=2))
+    elif args['compare']:
+        regressions = compare(
+            json.loads(Path(args['<BASELINE>']).read_text()), json.loads(Path(args['<RESULTS>']).read_text()),
+            float(args['--tolerance']))
+        sys.exit(1 if regressions else 0)
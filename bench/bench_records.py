@@ -0,0 +1,93 @@
+"""
+Benchmarks the result records the workers ship to the main process: nested `VariantAnnotation` dataclasses (with hgvs
+`SequenceVariant` objects) against flat `CompactAnnotation` tuples - memory held per record once unpickled by the main
+process, pickled bytes per record, and the time to pickle, unpickle and turn them into CSV rows.
+
+Annotations are built offline from the records of a vcf, with hgvs variants parsed from synthetic (but realistic)
+strings.
+
+Usage:
+    bench_records.py [<VCF>] [--records=<N>]
+
+Options:
+    --records=<N>   number of records (the vcf records are repeated as needed) [default: 10000]
+"""
+import pickle
+import time
+import tracemalloc
+from itertools import cycle, islice
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from docopt import docopt
+from hgvs.parser import Parser
+
+from tempus import SimpleVariant, SequenceAlteration, FeatureVariant
+from tempus.annotation import VariantAnnotation, compact_annotations, annotation_to_csv_row
+from tempus.exac import ExacVariantAnnotation
+from tempus.hgvs import HgvsVariantAnnotation
+from tempus.vcf import VcfVariantAnnotation, open_vcf, read_vcf
+
+
+def synthetic_annotations(vcf: Path, n_records: int) -> List[VariantAnnotation]:
+    """
+    :return: annotations of the (repeated) vcf records, as the pipeline would produce them for genic SNVs.
+    """
+    hgvs_parser = Parser()
+    with open_vcf(vcf) as vcf_io:
+        _, records = read_vcf(vcf_io)
+        records = list(records)
+    annotations = []
+    for idx, record in enumerate(islice(cycle(records), n_records)):
+        variant = SimpleVariant(record.contig, record.pos, record.ref, record.alts[0], 1)
+        annotations.append(VariantAnnotation(
+            var=variant,
+            vcf=VcfVariantAnnotation.from_vcf_locus(record, 1),
+            hgvs=HgvsVariantAnnotation(
+                hgvs_c=hgvs_parser.parse_hgvs_variant(f'NM_{idx:06d}.1:c.{idx % 3000 + 1}A>T'),
+                hgvs_p=hgvs_parser.parse_hgvs_variant(f'NP_{idx:06d}.1:p.(Lys{idx % 1000 + 1}Ter)'),
+                feature_variant=FeatureVariant.MISSENSE,
+                hgvs_g=hgvs_parser.parse_hgvs_variant(f'NC_000001.10:g.{record.pos}A>T'),
+                sequence_alteration=SequenceAlteration.SUBSTITUTION,
+                gene=f'GENE{idx % 500}'),
+            exac=ExacVariantAnnotation(allele_frequency=idx % 100 / 100, consequences=['missense_variant'])))
+    return annotations
+
+
+def _seconds(fn: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def measure(annotations: List[Any]) -> Dict[str, float]:
+    """
+    :return: per record memory held once unpickled, pickled size, and timings.
+    """
+    n_records = len(annotations)
+    pickled = pickle.dumps(annotations, protocol=pickle.HIGHEST_PROTOCOL)
+    tracemalloc.start()
+    unpickled = pickle.loads(pickled)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'memory_bytes': memory / n_records,
+        'pickled_bytes': len(pickled) / n_records,
+        'pickle_us': 1e6 * _seconds(lambda: pickle.dumps(annotations, protocol=pickle.HIGHEST_PROTOCOL)) / n_records,
+        'unpickle_us': 1e6 * _seconds(lambda: pickle.loads(pickled)) / n_records,
+        'csv_row_us': 1e6 * _seconds(lambda: [annotation_to_csv_row(ann) for ann in unpickled]) / n_records}
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    full = synthetic_annotations(Path(args['<VCF>'] or 'test/data/Challenge_data.vcf'), int(args['--records']))
+    started = time.perf_counter()
+    compact = compact_annotations(full)
+    compact_us = 1e6 * (time.perf_counter() - started) / len(full)
+    results = {'VariantAnnotation': measure(full), 'CompactAnnotation': measure(compact)}
+    print(f'{"per record":<20} {"memory B":>10} {"pickled B":>10} {"pickle us":>10} {"unpickle us":>12} '
+          f'{"csv row us":>11}')
+    for name, result in results.items():
+        print(f'{name:<20} {result["memory_bytes"]:>10,.0f} {result["pickled_bytes"]:>10,.0f} '
+              f'{result["pickle_us"]:>10.2f} {result["unpickle_us"]:>12.2f} {result["csv_row_us"]:>11.2f}')
+    print(f'compacting: {compact_us:.2f} us per record')
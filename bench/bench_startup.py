@@ -0,0 +1,97 @@
+"""
+Benchmarks startup: the import time of the tempus modules and of the CLI (`--help` and argument errors, which import
+none of the annotation modules), and the time to bring up a pool of annotation workers by each start method - `fork`,
+`forkserver` (preloading the annotation modules once, in the background as `tempus annotate` does) and `spawn`.
+
+Every measurement runs in a fresh interpreter, best of `--repeat`.
+
+Usage:
+    bench_startup.py [--repeat=<N>] [--workers=<N>]
+
+Options:
+    --repeat=<N>    number of times each measurement is repeated [default: 5]
+    --workers=<N>   number of workers of the pools [default: 4]
+"""
+import multiprocessing
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from docopt import docopt
+
+_IMPORTS = ('tempus', 'tempus.vcf', 'tempus.annotation', 'tempus.commands')
+
+_COMMANDS = {
+    'tempus --help': ['-m', 'tempus', '--help'],
+    'tempus (argument error)': ['-m', 'tempus', 'annotate', 'in.vcf', 'out.csv', '--format=xls']}
+
+# imports the annotation modules and brings up a pool the way `tempus annotate` does, with workers importing them
+# (unless they inherit them) in place of the worker setup, which needs the UTA database
+_POOL = """
+import time
+started = time.perf_counter()
+import multiprocessing, sys
+from concurrent.futures import ProcessPoolExecutor
+from tempus.parallel import forkserver_context
+method, workers = sys.argv[1], int(sys.argv[2])
+mp_context = forkserver_context(start=method == 'forkserver-early') if method.startswith('forkserver') else \\
+    multiprocessing.get_context(method)
+import tempus.commands
+ready = mp_context.Barrier(workers + 1)
+with ProcessPoolExecutor(
+        workers, mp_context=mp_context, initializer=exec,
+        initargs=('import tempus.commands; ready.wait()', {'ready': ready})) as pool:
+    pool.submit(int)
+    ready.wait()
+    print(time.perf_counter() - started)
+"""
+
+
+def _best_seconds(args: List[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def import_seconds(repeat: int) -> Dict[str, float]:
+    """
+    :return: import time of each module, less the interpreter startup.
+    """
+    interpreter = _best_seconds(['-c', 'pass'], repeat)
+    return {module: _best_seconds(['-c', f'import {module}'], repeat) - interpreter for module in _IMPORTS}
+
+
+def command_seconds(repeat: int) -> Dict[str, float]:
+    """
+    :return: wall time of each CLI invocation.
+    """
+    return {name: _best_seconds(args, repeat) for name, args in _COMMANDS.items()}
+
+
+def pool_seconds(workers: int, repeat: int) -> Dict[str, float]:
+    """
+    :return: time from importing the annotation modules to all workers of a pool having them imported as well, by start
+        method - 'forkserver-early' starting the server (and its imports) before the main process imports them.
+    """
+    return {
+        method: min(
+            float(subprocess.run(
+                [sys.executable, '-c', _POOL, method, str(workers)], capture_output=True, text=True,
+                check=True).stdout)
+            for _ in range(repeat))
+        for method in multiprocessing.get_all_start_methods() + ['forkserver-early']}
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    repeat, workers = int(args['--repeat']), int(args['--workers'])
+    for name, seconds in import_seconds(repeat).items():
+        print(f'{"import " + name:<36} {1000 * seconds:>9,.1f} ms')
+    for name, seconds in command_seconds(repeat).items():
+        print(f'{name:<36} {1000 * seconds:>9,.1f} ms')
+    for method, seconds in pool_seconds(workers, repeat).items():
+        print(f'{f"{workers} workers ({method})":<36} {1000 * seconds:>9,.1f} ms')
@@ -0,0 +1,77 @@
+"""
+Benchmarks the columnar vcf reader against PyVCF on the fields used for annotation.
+
+Usage:
+    bench_vcf_reader.py [<VCF>] [--repeat=<N>]
+
+Options:
+    --repeat=<N>    number of timed passes over the vcf, the best is reported [default: 3]
+"""
+import pickle
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from docopt import docopt
+from vcf import Reader
+
+from tempus.vcf import open_vcf, read_vcf, read_depth_allele, samples_containing_allele
+
+
+def _pyvcf_pass(vcf_path: Path) -> List[Tuple[int, int, List[str]]]:
+    with open_vcf(vcf_path) as vcf_io:
+        return [
+            (record.INFO['DP'],
+             sum(call.data.DPR[allele_index] for call in record.samples),
+             [call.sample for call in record.samples
+              if any(int(gt_allele) == allele_index for gt_allele in call.gt_alleles)])
+            for record in Reader(vcf_io) for allele_index in range(len(record.ALT) + 1)]
+
+
+def _columnar_pass(vcf_path: Path) -> List[Tuple[int, int, List[str]]]:
+    with open_vcf(vcf_path) as vcf_io:
+        _, records = read_vcf(vcf_io)
+        return [
+            (record.read_depth, read_depth_allele(record, allele_index),
+             samples_containing_allele(record, allele_index))
+            for record in records for allele_index in range(len(record.alts) + 1)]
+
+
+def _best_of(repeat: int, fn: Callable, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def _pickled_size(records: Iterable) -> int:
+    return len(pickle.dumps(list(records), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def bench(vcf_path: Path, repeat: int) -> Dict[str, float]:
+    assert _pyvcf_pass(vcf_path) == _columnar_pass(vcf_path)
+    with open_vcf(vcf_path) as vcf_io:
+        n_records = sum(1 for line in vcf_io if not line.startswith('#'))
+    with open_vcf(vcf_path) as vcf_io:
+        pyvcf_size = _pickled_size(Reader(vcf_io))
+    with open_vcf(vcf_path) as vcf_io:
+        columnar_size = _pickled_size(read_vcf(vcf_io)[1])
+    pyvcf_secs = _best_of(repeat, _pyvcf_pass, vcf_path)
+    columnar_secs = _best_of(repeat, _columnar_pass, vcf_path)
+    return {
+        'records': n_records,
+        'pyvcf_records_per_sec': n_records / pyvcf_secs,
+        'columnar_records_per_sec': n_records / columnar_secs,
+        'speedup': pyvcf_secs / columnar_secs,
+        'pyvcf_pickled_bytes_per_record': pyvcf_size / n_records,
+        'columnar_pickled_bytes_per_record': columnar_size / n_records,
+    }
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    results = bench(Path(args['<VCF>'] or 'test/data/Challenge_data.vcf'), int(args['--repeat']))
+    for key, value in results.items():
+        print(f'{key:>36}: {value:,.1f}')
@@ -0,0 +1,100 @@
+"""
+Benchmarks the per-site vcf annotation (parsing the calls, read depths and carriers of every allele) as the number of
+samples grows.
+
+Usage:
+    bench_vcf_samples.py [--samples=<N>] [--sites=<N>] [--alts=<N>] [--missing=<P>] [--seed=<N>]
+
+Options:
+    --samples=<N>   comma-separated sample counts to benchmark [default: 10,100,1000,10000]
+    --sites=<N>     number of sites per sample count [default: 200]
+    --alts=<N>      number of ALT alleles per site [default: 3]
+    --missing=<P>   fraction of missing genotype calls [default: 0.05]
+    --seed=<N>      random seed [default: 0]
+"""
+import io
+import random
+import time
+from typing import Callable, Dict, List
+
+from docopt import docopt
+from vcf import Reader
+
+from tempus.vcf import VcfVariantAnnotation, read_vcf
+
+_HEADER = (
+    '##fileformat=VCFv4.1\n'
+    '##reference=/data/human_g1k_v37.fasta\n'
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth at the locus">\n'
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+    '##FORMAT=<ID=DPR,Number=R,Type=Integer,Description="Number of observation for each allele">\n'
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{samples}\n')
+
+
+def synthetic_vcf(n_samples: int, n_sites: int, n_alts: int, missing: float, seed: int) -> str:
+    """
+    :return: vcf text with diploid GT and DPR calls.
+    """
+    rng = random.Random(seed)
+
+    def call() -> str:
+        if rng.random() < missing:
+            return './.:.'
+        gt = '/'.join(str(rng.randint(0, n_alts)) for _ in range(2))
+        return f'{gt}:{",".join(str(rng.randint(0, 50)) for _ in range(n_alts + 1))}'
+
+    lines = [_HEADER.format(samples='\t'.join(f'S{idx}' for idx in range(n_samples)))]
+    for site in range(n_sites):
+        calls = '\t'.join(call() for _ in range(n_samples))
+        lines.append(
+            f'1\t{1000 + site}\t.\tA\t{",".join("CGT"[:n_alts])}\t.\t.\tDP={n_samples * 25}\tGT:DPR\t{calls}\n')
+    return ''.join(lines)
+
+
+def _pyvcf_site_annotations(vcf_text: str) -> int:
+    # the original per-call path: PyVCF call objects, one pass over the samples per allele
+    n_annotations = 0
+    for record in Reader(io.StringIO(vcf_text)):
+        read_depth_ref = sum(call.data.DPR[0] for call in record.samples if call.data.DPR)
+        for allele_index in range(1, len(record.ALT) + 1):
+            read_depth_alt = sum(call.data.DPR[allele_index] for call in record.samples if call.data.DPR)
+            containing_samples = [
+                call.sample for call in record.samples
+                if any(gt_allele is not None and int(gt_allele) == allele_index for gt_allele in call.gt_alleles)]
+            n_annotations += bool((read_depth_ref, read_depth_alt, containing_samples))
+    return n_annotations
+
+
+def _columnar_site_annotations(vcf_text: str) -> int:
+    _, records = read_vcf(io.StringIO(vcf_text))
+    return sum(len(VcfVariantAnnotation.from_vcf_site(record)) - 1 for record in records)
+
+
+def _sites_per_sec(fn: Callable[[str], int], vcf_text: str, n_sites: int) -> float:
+    started = time.perf_counter()
+    fn(vcf_text)
+    return n_sites / (time.perf_counter() - started)
+
+
+def bench(sample_counts: List[int], n_sites: int, n_alts: int, missing: float, seed: int) -> List[Dict[str, float]]:
+    results = []
+    for n_samples in sample_counts:
+        vcf_text = synthetic_vcf(n_samples, n_sites, n_alts, missing, seed)
+        pyvcf = _sites_per_sec(_pyvcf_site_annotations, vcf_text, n_sites)
+        columnar = _sites_per_sec(_columnar_site_annotations, vcf_text, n_sites)
+        results.append({
+            'samples': n_samples,
+            'pyvcf_sites_per_sec': pyvcf,
+            'columnar_sites_per_sec': columnar,
+            'speedup': columnar / pyvcf})
+    return results
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    sample_counts = [int(count) for count in args['--samples'].split(',')]
+    print(f'{"samples":>8} {"pyvcf sites/s":>14} {"columnar sites/s":>17} {"speedup":>8}')
+    for result in bench(sample_counts, int(args['--sites']), int(args['--alts']), float(args['--missing']),
+                        int(args['--seed'])):
+        print(f'{result["samples"]:>8} {result["pyvcf_sites_per_sec"]:>14,.1f} '
+              f'{result["columnar_sites_per_sec"]:>17,.1f} {result["speedup"]:>8.1f}')
@@ -11,12 +11,14 @@ setup(
     entry_points={'console_scripts': ['tempus = tempus.__main__:cli']},
     zip_safe=True,
     install_requires=[
+        'biopython',
         'docopt-ng==0.7.2',
-        'flatten-dict==0.1.0',
         'hgvs==1.3.0.post0',
         'more-itertools==7.2.0',
+        'numpy>=1.16',
         'pyvcf==0.6.8',
     ],
+    extras_require={'arrow': ['pyarrow>=1.0'], 'tabix': ['pysam>=0.15']},
     tests_require=['pytest'],
     python_requires='>=3.7.0'
 )
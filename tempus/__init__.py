@@ -1,8 +1,10 @@
 """
 Model classes and constants.
 """
+import importlib
+import importlib.util
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Any, Optional
 
 from enum import Enum, unique, IntEnum
 
@@ -79,3 +81,10 @@ class FeatureVariant(Enum):
 
     def __str__(self):
         return self.slug
+
+
+def __getattr__(name: str) -> Any:
+    # submodules are imported on first access (PEP 562), so that `import tempus` costs the model classes only
+    if not name.startswith('_') and importlib.util.find_spec(f'{__name__}.{name}'):
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
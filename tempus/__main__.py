@@ -1,59 +1,216 @@
 """
 Usage:
-    tempus annotate <VCF> <CSV> [--workers=<N>] [--chunk-size=<N>]
+    tempus annotate <VCF> <OUT> [--workers=<N>] [--chunk-size=<N>] [--window=<N>] [--exac-batch-size=<N>]
+                    [--cache=<PATH>] [--cache-size=<N>] [--exac-sites=<DIR>] [--mode=<MODE>]
+                    [--exac-concurrency=<N>] [--exac-rate-limit=<N>] [--transcript-index=<NPZ>]
+                    [--format=<FMT>] [--row-group-size=<N>] [--previous=<CSV>] [--resume]
+                    [--fixtures=<DIR> [--record]] [--profile=<JSON>] [--reference=<PATH>] [--uta=<SQLITE>]
+                    [--region=<REGION>...] [--regions=<BED>] [--by-contig] [--schedule=<SCHEDULE>]
+                    [--cost-model=<JSON>] [--start-method=<METHOD>] [-v]
+    tempus annotate-cohort <OUT_DIR> <VCFS>... [--workers=<N>] [--chunk-size=<N>] [--window=<N>]
+                    [--exac-batch-size=<N>] [--cache=<PATH>] [--cache-size=<N>] [--exac-sites=<DIR>] [--mode=<MODE>]
+                    [--transcript-index=<NPZ>] [--format=<FMT>] [--row-group-size=<N>] [--reference=<PATH>]
+                    [--uta=<SQLITE>] [--start-method=<METHOD>] [-v]
+    tempus index-exac <SITES_VCF> <DIR> [-v]
+    tempus index-transcripts <NPZ> [<VCF>] [--uta=<SQLITE>] [-v]
+    tempus export-uta <SQLITE> [<VCF>] [--genes=<GENES>] [-v]
     tempus -h | --help
 
 Arguments:
-    VCF                 input variant call format file
-    CSV                 output comma-separated file
+    VCF                 input variant call format file (optionally gzipped/bgzipped), '-' for stdin
+    OUT                 output file (see --format), '-' for stdout
+    OUT_DIR             output directory, holding an output file (see --format) named after each input vcf
+    VCFS                input variant call format files (optionally gzipped/bgzipped) of a cohort, annotated together
+                        - every distinct allele once
+    SITES_VCF           ExAC/gnomAD sites vcf (optionally gzipped)
+    DIR                 offline ExAC sites index directory
+    NPZ                 transcript index file
+    CSV                 CSV output of a previous run
+    SQLITE              UTA snapshot file
 
 Options:
     -h --help           show help
+    -v --verbose        log progress and statistics
     --workers=<N>       number of workers [default: 1]
-    --chunk-size=<N>    number of vcf records to process by each worker [default: 1]
+    --chunk-size=<N>    number of vcf records (distinct alleles for annotate-cohort) to process by each worker
+                        [default: 1]
+    --window=<N>        max number of chunks in flight (submitted, but not yet written), 0 for twice the number of
+                        workers [default: 0]
+    --exac-batch-size=<N>
+                        number of variants per ExAC bulk request, 0 uses the non-bulk API [default: 0]
+    --cache=<PATH>      persistent annotation cache (sqlite), shared across runs and workers
+    --cache-size=<N>    max number of entries kept in the annotation cache [default: 1000000]
+    --exac-sites=<DIR>  annotate allele frequencies offline from a sites index (see `tempus index-exac`)
+    --mode=<MODE>       execution mode: 'sync' worker processes, 'async' worker processes overlapping ExAC requests
+                        with hgvs work, or 'threads' - worker threads of a single process, each with its own UTA/seqrepo
+                        handles, sharing the read-only indices [default: sync]
+    --exac-concurrency=<N>
+                        max number of concurrent ExAC requests per worker in async mode [default: 8]
+    --exac-rate-limit=<N>
+                        max number of ExAC requests per second per worker in async mode, 0 for no limit [default: 0]
+    --transcript-index=<NPZ>
+                        answer transcript overlap queries from a preloaded index (see `tempus index-transcripts`)
+    --format=<FMT>      output format: 'csv', 'parquet'/'arrow' (IPC file) with typed and list columns, which
+                        require pyarrow, or 'vcf' - the input vcf with annotation INFO keys, bgzipped and (unless
+                        written to stdout) tabix indexed, which requires pysam [default: csv]
+    --row-group-size=<N>
+                        number of annotations per parquet row group/arrow record batch [default: 10000]
+    --previous=<CSV>    reuse the annotations of (biallelic) records found in a previous output - only new or changed
+                        records are annotated from scratch
+    --resume            checkpoint every completed chunk (csv and vcf output), and continue an interrupted run from
+                        its last checkpoint
+    --fixtures=<DIR>    replay recorded UTA/seqrepo and ExAC responses from DIR instead of querying the services, for
+                        offline runs and benchmarks
+    --record            query the services and record their responses to the --fixtures DIR (single worker only)
+    --profile=<JSON>    time the annotation stages of all workers and write their call counts, latency percentiles and
+                        error counts as json to JSON, '-' for stderr
+    --reference=<PATH>  read reference sequence windows from a local, uncompressed FASTA file (sequences named by
+                        accession or contig) or seqrepo directory
+    --uta=<SQLITE>      query transcripts from a local UTA snapshot (see `tempus export-uta`) instead of the UTA
+                        database
+    --region=<REGION>   annotate the records starting within a region ('contig', 'contig:start' or 'contig:start-end',
+                        1-based and inclusive) only - may be repeated; requires a bgzipped, tabix-indexed VCF and pysam
+    --regions=<BED>     annotate the records starting within the regions of a BED file only (as --region)
+    --by-contig         cut chunks at contig boundaries, so that no chunk spans contigs (always the case for regions)
+    --schedule=<SCHEDULE>
+                        chunking: 'fixed' chunks of --chunk-size records, or 'guided' - chunks of about a share of the
+                        estimated remaining cost (variant types, and transcripts overlapping each record as far as the
+                        transcript index or UTA snapshot tell), at least --chunk-size records each, which shrink
+                        towards the end of the run (uncompressed or bgzipped vcf files only) [default: fixed]
+    --cost-model=<JSON> refine the cost estimates of guided chunks with the durations measured by previous runs, and
+                        save them for the next
+    --start-method=<METHOD>
+                        how worker processes start: 'forkserver' - forked from a server process which imported the
+                        annotation modules once, 'fork' or 'spawn' [default: forkserver]
+    --genes=<GENES>     export the transcripts of a gene panel only - comma-separated HGNC symbols, or a file listing
+                        one symbol per line
 """
-from concurrent.futures.process import ProcessPoolExecutor
+import importlib.util
+import logging
+import multiprocessing
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Iterable
+from typing import Any, Dict
 
-from docopt import docopt
+from docopt import docopt, DocoptExit
 
-from tempus.annotation import write_annotations_to_csv, annotate_vcf
-from tempus.vcf import split_vcf
+# the annotation modules (see `tempus.commands`) are imported once the arguments are validated, so that `--help` and
+# argument errors return right away
 
 
-def _annotate_vcf(in_vcf: Path):
-    annotations = annotate_vcf(in_vcf)
-    with NamedTemporaryFile(mode='w', suffix='.csv', delete=False) as out_csv_io:
-        write_annotations_to_csv(annotations, out_csv_io)
-    return Path(out_csv_io.name)
-
-
-def _merge_csv(in_csvs: Iterable[Path], out_csv: Path):
-    with out_csv.open('w') as out_io:
-        for idx, in_csv in enumerate(in_csvs):
-            with in_csv.open() as in_io:
-                next(in_io) if idx > 0 else None
-                out_io.writelines(in_io)
-            in_csv.unlink()
-
-
-def _handle_annotate(in_vcf: Path, out_csv: Path, max_workers: int, chunk_size: int):
-    vcf_splits = split_vcf(in_vcf, chunk_size)
-    with ProcessPoolExecutor(max_workers=max_workers) as proc_pool:
-        tmp_csvs = proc_pool.map(_annotate_vcf, vcf_splits)
-    _merge_csv(tmp_csvs, out_csv)
+def _start_forkserver(args: Dict[str, Any]):
+    if args['--start-method'] == 'forkserver' and args['--mode'] != 'threads':
+        # the forkserver imports the annotation modules while the main process does the same
+        from tempus.parallel import forkserver_context
+        forkserver_context(start=True)
 
 
 def cli():
     args = docopt(__doc__)
-    if args['annotate']:
-        _handle_annotate(
-            in_vcf=Path(args['<VCF>']),
-            out_csv=Path(args['<CSV>']),
+    if args['--verbose']:
+        logging.basicConfig(level=logging.INFO)
+    if args['annotate'] or args['annotate-cohort']:
+        if args['--format'] not in ('csv', 'parquet', 'arrow', 'vcf'):
+            raise DocoptExit(f'unknown format: {args["--format"]}')
+        if args['--start-method'] not in multiprocessing.get_all_start_methods():
+            raise DocoptExit(f'unsupported start method: {args["--start-method"]}')
+    if args['annotate-cohort']:
+        if args['--format'] == 'vcf' and not importlib.util.find_spec('pysam'):
+            raise DocoptExit('indexing vcf output requires pysam')
+        if args['--mode'] not in ('sync', 'threads'):
+            raise DocoptExit(f'annotate-cohort runs in sync or threads mode only, not {args["--mode"]}')
+        from tempus.cohort import output_paths
+        try:
+            output_paths([Path(vcf) for vcf in args['<VCFS>']], Path(args['<OUT_DIR>']), '')
+        except ValueError as e:
+            raise DocoptExit(str(e))
+        _start_forkserver(args)
+        from tempus.commands import annotate_options, handle_annotate_cohort
+        handle_annotate_cohort(
+            in_vcfs=[Path(vcf) for vcf in args['<VCFS>']],
+            out_dir=Path(args['<OUT_DIR>']),
+            max_workers=int(args['--workers']),
+            chunk_size=int(args['--chunk-size']),
+            window=int(args['--window']),
+            output_format=args['--format'],
+            row_group_size=int(args['--row-group-size']),
+            options=annotate_options(args))
+    elif args['annotate']:
+        if args['--format'] == 'vcf' and args['<OUT>'] != '-' and not importlib.util.find_spec('pysam'):
+            raise DocoptExit('indexing vcf output requires pysam')
+        if args['--resume'] and (args['<OUT>'] == '-' or args['--format'] not in ('csv', 'vcf')):
+            raise DocoptExit('--resume applies to csv and vcf output files only')
+        if args['--resume']:
+            from tempus.checkpoint import Checkpoint
+            checkpoint = Checkpoint.load(Checkpoint.path_for(Path(args['<OUT>'])))
+            if checkpoint:
+                try:
+                    checkpoint.check_output(Path(args['<OUT>']))
+                except ValueError as e:
+                    raise DocoptExit(str(e))
+        if args['--previous'] and args['<OUT>'] != '-' and Path(args['--previous']).resolve() == Path(
+                args['<OUT>']).resolve():
+            raise DocoptExit('--previous must not be the output, which is overwritten')
+        if args['--record'] and int(args['--workers']) != 1:
+            raise DocoptExit('--record requires a single worker')
+        regions = []
+        if args['--region'] or args['--regions']:
+            from tempus.vcf import Region, read_bed, is_tabix_indexed
+            try:
+                regions = [Region.parse(region) for region in args['--region']] + (
+                    read_bed(Path(args['--regions'])) if args['--regions'] else [])
+            except ValueError as e:
+                raise DocoptExit(str(e))
+        if regions:
+            if not importlib.util.find_spec('pysam'):
+                raise DocoptExit('region queries require pysam')
+            if args['<VCF>'] == '-' or not is_tabix_indexed(Path(args['<VCF>'])):
+                raise DocoptExit('region queries require a bgzipped, tabix-indexed VCF file')
+        if args['--schedule'] not in ('fixed', 'guided'):
+            raise DocoptExit(f'unknown schedule: {args["--schedule"]}')
+        if args['--schedule'] == 'guided':
+            if args['<VCF>'] == '-' or regions:
+                raise DocoptExit('guided scheduling applies to whole vcf files only (no stdin, no regions)')
+            from tempus.vcf import vcf_compression
+            if vcf_compression(Path(args['<VCF>'])) == 'gzip':
+                raise DocoptExit('guided scheduling requires an uncompressed or bgzipped vcf - please bgzip it')
+        if args['--fixtures'] and args['--uta']:
+            raise DocoptExit('--fixtures replays recorded UTA responses, which excludes --uta')
+        if args['--fixtures'] and args['--mode'] == 'async':
+            raise DocoptExit('async mode queries the ExAC REST API, which is not replayed')
+        if args['--mode'] not in ('sync', 'async', 'threads'):
+            raise DocoptExit(f'unknown mode: {args["--mode"]}')
+        if args['--mode'] == 'async' and (args['--exac-sites'] or int(args['--exac-batch-size'])):
+            raise DocoptExit('async mode applies to the non-bulk ExAC REST API only')
+        _start_forkserver(args)
+        from tempus.commands import annotate_options, handle_annotate
+        handle_annotate(
+            in_vcf=Path(args['<VCF>']) if args['<VCF>'] != '-' else None,
+            out=Path(args['<OUT>']) if args['<OUT>'] != '-' else None,
             max_workers=int(args['--workers']),
-            chunk_size=int(args['--chunk-size']))
+            chunk_size=int(args['--chunk-size']),
+            window=int(args['--window']),
+            output_format=args['--format'],
+            row_group_size=int(args['--row-group-size']),
+            resume=args['--resume'],
+            options=annotate_options(args),
+            profile_out=args['--profile'],
+            regions=regions,
+            by_contig=args['--by-contig'],
+            schedule=args['--schedule'],
+            cost_model=Path(args['--cost-model']) if args['--cost-model'] else None)
+    elif args['index-exac']:
+        from tempus.exac_sites import ExacSitesIndex
+        ExacSitesIndex.build(sites_vcf=Path(args['<SITES_VCF>']), index_dir=Path(args['<DIR>']))
+    elif args['index-transcripts']:
+        from tempus.commands import handle_index_transcripts
+        handle_index_transcripts(
+            out_npz=Path(args['<NPZ>']), in_vcf=Path(args['<VCF>']) if args['<VCF>'] else None,
+            uta_snapshot=Path(args['--uta']) if args['--uta'] else None)
+    elif args['export-uta']:
+        from tempus.commands import handle_export_uta
+        handle_export_uta(
+            out_sqlite=Path(args['<SQLITE>']), in_vcf=Path(args['<VCF>']) if args['<VCF>'] else None,
+            genes=args['--genes'])
 
 
 if __name__ == '__main__':
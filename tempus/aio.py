@@ -0,0 +1,202 @@
+"""
+Asyncio-based annotation pipeline - overlaps ExAC REST requests with hgvs work.
+
+hgvs normalization and transcript projection stay on the event loop thread (seqrepo is not thread-safe), while ExAC
+requests run on a pool of keep-alive connections with bounded concurrency, retries and rate limiting.
+"""
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Optional, Deque, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tempus import SimpleVariant
+from tempus.annotation import VariantAnnotation, PreviousAnnotations, AlleleAnnotator
+from tempus.cache import AnnotationCache
+from tempus.exac import API_BASE_URL, ExacVariantAnnotation, exac_variant_id
+from tempus.hgvs import HgvsMachinery, HgvsVariantAnnotation
+from tempus.vcf import TEMPUS_REFERENCE__ASSEMBLY, VcfVariantAnnotation, VcfShard, StreamVcfShard, VcfRecord, \
+    open_vcf, read_vcf, RegionVcfShard
+
+_RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+
+
+@dataclass
+class _RateLimiter:
+    """
+    Spaces out acquisitions so that at most `rate` happen per second.
+    """
+    rate: float
+    _next: float = field(default=0., init=False)
+
+    async def acquire(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next)
+        self._next = slot + 1. / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+@dataclass
+class AsyncExacClient:
+    """
+    Concurrent client for the ExAC (non-bulk) REST API.
+
+    :param concurrency: max number of requests in flight (and size of the keep-alive connection pool).
+    :param retries: number of retries of failed requests (connection errors, 429 and 5xx responses).
+    :param backoff: seconds to wait before the first retry, doubled for each following retry.
+    :param rate_limit: max number of requests per second, unlimited if None.
+    """
+    api_base_url: str = API_BASE_URL
+    concurrency: int = 8
+    retries: int = 3
+    backoff: float = 0.5
+    rate_limit: Optional[float] = None
+    session: requests.Session = field(default_factory=requests.Session, repr=False)
+
+    def __post_init__(self):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='exac')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._rate_limiter = _RateLimiter(self.rate_limit) if self.rate_limit else None
+
+    def _get(self, variant: SimpleVariant) -> requests.Response:
+        return self.session.get(url=f'{self.api_base_url}/variant/{exac_variant_id(variant)}')
+
+    async def annotate(self, variant: SimpleVariant) -> ExacVariantAnnotation:
+        """
+        :param variant: 5p-normalized (left shuffled) simple variant. [base coordinate system]
+        :return: variant annotation
+        """
+        loop = asyncio.get_running_loop()
+        # the client outlives event loops, whereas semaphores are bound to one
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                if self._rate_limiter:
+                    await self._rate_limiter.acquire()
+                try:
+                    response = await loop.run_in_executor(self._executor, self._get, variant)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self.retries:
+                        raise
+                else:
+                    if response.status_code not in _RETRY_STATUS_CODES or attempt == self.retries:
+                        response.raise_for_status()
+                        return ExacVariantAnnotation.from_variant_data(response.json())
+                logging.info(f'retrying ExAC request for {exac_variant_id(variant)} (attempt {attempt + 1})')
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+async def _annotate_exac(exac_client: AsyncExacClient, variant: SimpleVariant,
+                         cache: Optional[AnnotationCache]) -> ExacVariantAnnotation:
+    exac_ann = await exac_client.annotate(variant)
+    if cache:
+        cache.put_many('exac', exac_client.api_base_url, ((variant, exac_ann),))
+    return exac_ann
+
+
+async def _completed(exac_ann: ExacVariantAnnotation) -> ExacVariantAnnotation:
+    return exac_ann
+
+
+async def annotate_records_async(
+        hgvs_machinery: HgvsMachinery, records: Iterable[VcfRecord], exac_client: AsyncExacClient, window: int = 1000,
+        cache: Optional[AnnotationCache] = None,
+        previous: Optional[PreviousAnnotations] = None) -> AsyncIterator[VariantAnnotation]:
+    """
+    Annotates vcf records, keeping up to `window` records awaiting their ExAC annotation.
+
+    :param hgvs_machinery: instance of hgvs machinery.
+    :param records: vcf records for loci.
+    :param exac_client: concurrent ExAC client.
+    :param window: max number of annotations held back while waiting on ExAC.
+    :param cache: optional persistent cache of hgvs and ExAC annotations.
+    :param previous: annotations of a previous run, reused instead of annotating the records again.
+    :return: variant annotations in the order of records.
+    """
+    allele_annotator = AlleleAnnotator.from_machinery(hgvs_machinery, cache)
+    pending: Deque[Tuple[VcfRecord, SimpleVariant, HgvsVariantAnnotation, asyncio.Task]] = deque()
+
+    def pop() -> VariantAnnotation:
+        locus, variant, hgvs_ann, exac_task = pending.popleft()
+        return VariantAnnotation(
+            var=variant,
+            vcf=VcfVariantAnnotation.from_vcf_locus(locus, variant.alt_index),
+            hgvs=hgvs_ann,
+            exac=exac_task.result())
+
+    try:
+        for locus in records:
+            reused = previous.reuse(locus) if previous else None
+            if reused:
+                pending.append((locus, reused.var, reused.hgvs, asyncio.ensure_future(_completed(reused.exac))))
+            else:
+                variant, hgvs_ann, variant_exac = allele_annotator.most_deleterious_allele(locus)
+                exac_ann, = cache.get_many('exac', exac_client.api_base_url, (variant_exac,)) if cache else (None,)
+                exac_coro = _completed(exac_ann) if exac_ann else _annotate_exac(exac_client, variant_exac, cache)
+                pending.append((locus, variant, hgvs_ann, asyncio.ensure_future(exac_coro)))
+            # let the ExAC tasks make progress in between blocking hgvs work
+            await asyncio.sleep(0)
+            while pending and (pending[0][-1].done() or len(pending) > window):
+                await pending[0][-1]
+                yield pop()
+        while pending:
+            await pending[0][-1]
+            yield pop()
+    finally:
+        # on failure (or when closed early), the ExAC requests still in flight are cancelled and waited for
+        exac_tasks = [exac_task for *_, exac_task in pending]
+        for exac_task in exac_tasks:
+            exac_task.cancel()
+        await asyncio.gather(*exac_tasks, return_exceptions=True)
+
+
+def annotate_vcf_async(vcf: Union[Path, VcfShard, StreamVcfShard, RegionVcfShard],
+                       exac_client: AsyncExacClient, window: int = 1000, cache: Optional[AnnotationCache] = None,
+                       hgvs_machinery: Optional[HgvsMachinery] = None,
+                       previous: Optional[PreviousAnnotations] = None) -> Iterable[VariantAnnotation]:
+    """
+    Annotates a given VCF file, overlapping ExAC requests with hgvs work on an event loop of its own.
+
+    :param vcf: path of the (optionally gzipped/bgzipped) vcf file, or a shard of one (or of a stream).
+    :param exac_client: concurrent ExAC client.
+    :param window: max number of annotations held back while waiting on ExAC.
+    :param cache: optional persistent cache of hgvs and ExAC annotations.
+    :param hgvs_machinery: hgvs machinery to reuse (set up from the vcf header by default).
+    :param previous: annotations of a previous run, reused instead of annotating the records again.
+    :return: variant annotations in the order of the vcf records.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        with open_vcf(vcf) as vcf_io:
+            header, records = read_vcf(vcf_io)
+            hgvs_machinery = hgvs_machinery or HgvsMachinery.from_assembly(
+                assembly=TEMPUS_REFERENCE__ASSEMBLY[header.reference])
+            annotations = annotate_records_async(
+                hgvs_machinery, records, exac_client, window, cache, previous).__aiter__()
+            while True:
+                try:
+                    yield loop.run_until_complete(annotations.__anext__())
+                except StopAsyncIteration:
+                    break
+        if cache:
+            cache.flush_stats()
+    finally:
+        # closes the annotations of a consumer that stopped early, cancelling their ExAC requests
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
@@ -1,20 +1,26 @@
 """
 Top-level annotation functions and serialization utils.
 """
+import ast
 import csv
-from dataclasses import dataclass, asdict
+import math
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, Dict, Any, TextIO
+from functools import partial, lru_cache
+from typing import Iterable, Dict, Any, TextIO, Sequence, List, Tuple, Optional, Union, Callable, BinaryIO, NamedTuple
 
-from flatten_dict import flatten
+from hgvs.parser import Parser
 from hgvs.sequencevariant import SequenceVariant
-from vcf import Reader
-from vcf.model import _Record
+from more_itertools import chunked
 
 from tempus import FeatureVariant, SequenceAlteration, SimpleVariant
-from tempus.exac import ExacVariantAnnotation
+from tempus.cache import AnnotationCache
+from tempus.exac import ExacVariantAnnotation, ExacAnnotator, annotate_simple_variants, API_BASE_URL
 from tempus.hgvs import HgvsVariantAnnotation, HgvsMachinery
-from tempus.vcf import simple_variants_from_record, TEMPUS_REFERENCE__ASSEMBLY, VcfVariantAnnotation
+from tempus.profiling import PROFILE
+from tempus.snv import is_snv
+from tempus.vcf import simple_variants_from_record, TEMPUS_REFERENCE__ASSEMBLY, VcfVariantAnnotation, VcfShard, \
+    StreamVcfShard, VcfRecord, BgzfStreamWriter, open_vcf, read_vcf, RegionVcfShard
 
 
 @dataclass(frozen=True)
@@ -35,71 +41,469 @@ class VariantAnnotation:
     exac: ExacVariantAnnotation
 
     @classmethod
-    def from_vcf_locus(cls, hgvs_machinery: HgvsMachinery, locus: _Record) -> 'VariantAnnotation':
+    def from_vcf_locus(cls, hgvs_machinery: HgvsMachinery, locus: VcfRecord) -> 'VariantAnnotation':
         """
         :param hgvs_machinery: instance of hgvs machinery.
         :param locus: vcf record for locus.
         :return: variant annotation.
         """
+        annotation, = cls.from_vcf_loci(
+            AlleleAnnotator.from_machinery(hgvs_machinery), (locus,), annotate_simple_variants)
+        return annotation
+
+    @classmethod
+    def from_vcf_loci(cls, allele_annotator: 'AlleleAnnotator', loci: Sequence[VcfRecord],
+                      exac_annotator: ExacAnnotator) -> List['VariantAnnotation']:
+        """
+        Annotates a batch of loci, resolving the ExAC annotations of the whole batch with a single annotator call.
+
+        :param allele_annotator: hgvs annotator of the locus alleles.
+        :param loci: vcf records for loci.
+        :param exac_annotator: batch ExAC annotator.
+        :return: variant annotations in the order of loci.
+        """
+        alleles = []
+        for locus in loci:
+            with PROFILE.stage('annotation.hgvs'):
+                alleles.append(allele_annotator.most_deleterious_allele(locus))
+        with PROFILE.stage('annotation.exac'):
+            exac_anns = exac_annotator([variant_exac for _, _, variant_exac in alleles])
+        annotations = []
+        for locus, (variant, hgvs_ann, _), exac_ann in zip(loci, alleles, exac_anns):
+            with PROFILE.stage('annotation.vcf'):
+                vcf_ann = VcfVariantAnnotation.from_vcf_locus(locus, variant.alt_index)
+            annotations.append(cls(var=variant, vcf=vcf_ann, hgvs=hgvs_ann, exac=exac_ann))
+        return annotations
+
+
+def allele_impact(hgvs_ann: HgvsVariantAnnotation) -> int:
+    """
+    :param hgvs_ann: hgvs annotation of an allele.
+    :return: impact of the allele on its feature, -1 if it is not within a feature.
+    """
+    return hgvs_ann.feature_variant.impact if hgvs_ann.feature_variant else -1
+
+
+def normalize_5p(hgvs_machinery: HgvsMachinery, variant: SimpleVariant) -> SimpleVariant:
+    """
+    :param hgvs_machinery: instance of hgvs machinery.
+    :param variant: allele variant.
+    :return: 5'-normalized form of the allele.
+    """
+    with PROFILE.stage('hgvs.normalize_5p'):
+        hgvs_g = hgvs_machinery.hgvs_from_simple_variant(variant, vtype='g')
+        return hgvs_machinery.simple_variant_from_hgvs(hgvs_machinery.normalizer_5p.normalize(hgvs_g))
+
+
+@dataclass(frozen=True)
+class AlleleAnnotator:
+    """
+    Annotates the alleles of loci with an instance of hgvs machinery, memoized by an optional cache.
+
+    Set up once per machinery (and cache) and reused for every locus annotated with it.
+    """
+    hgvs_machinery: HgvsMachinery
+    annotate_hgvs: Callable[[SimpleVariant], HgvsVariantAnnotation]
+    normalize_5p: Callable[[SimpleVariant], SimpleVariant]
+
+    @classmethod
+    def from_machinery(cls, hgvs_machinery: HgvsMachinery, cache: Optional[AnnotationCache] = None) \
+            -> 'AlleleAnnotator':
+        """
+        :param hgvs_machinery: instance of hgvs machinery.
+        :param cache: optional cache of hgvs annotations.
+        :return: allele annotator.
+        """
+        annotate_hgvs = partial(HgvsVariantAnnotation.from_simple_variant, hgvs_machinery)
+        normalize = partial(normalize_5p, hgvs_machinery)
+        if cache:
+            annotate_hgvs = cache.memoize('hgvs', hgvs_machinery.data_version, annotate_hgvs)
+            normalize = cache.memoize('hgvs_5p', hgvs_machinery.data_version, normalize)
+        return cls(hgvs_machinery=hgvs_machinery, annotate_hgvs=annotate_hgvs, normalize_5p=normalize)
+
+    def exac_variant(self, variant: SimpleVariant) -> SimpleVariant:
+        """
+        :param variant: allele variant.
+        :return: 5'-normalized form of the allele (for ExAC).
+        """
+        # substitutions cannot shuffle
+        if self.hgvs_machinery.snv_fast_path and is_snv(variant.ref, variant.alt):
+            return SimpleVariant(contig=variant.contig, pos=variant.pos, ref=variant.ref, alt=variant.alt)
+        return self.normalize_5p(variant)
+
+    def most_deleterious_allele(self, locus: VcfRecord) -> Tuple[SimpleVariant, HgvsVariantAnnotation, SimpleVariant]:
+        """
+        :param locus: vcf record for locus.
+        :return: most deleterious allele variant, its hgvs annotation and its 5'-normalized form (for ExAC).
+        """
         # generate simple variants for each allele
         variants = simple_variants_from_record(locus)
 
         # use hgvs to assess impact of each allele | pick the most deleterious allele
         variant, hgvs_ann = max(
-            ((variant, HgvsVariantAnnotation.from_simple_variant(hgvs_machinery, variant)) for variant in variants),
-            key=lambda var_hgvs: var_hgvs[1].feature_variant.impact if var_hgvs[1].feature_variant else -1)
+            ((variant, self.annotate_hgvs(variant)) for variant in variants),
+            key=lambda var_hgvs: allele_impact(var_hgvs[1]))
 
         # use a 5'-normalized variant for ExAC
-        variant_exac = hgvs_machinery.simple_variant_from_hgvs(hgvs_machinery.normalizer_5p.normalize(hgvs_ann.hgvs_g))
-
-        return cls(
-            var=variant,
-            vcf=VcfVariantAnnotation.from_vcf_locus(locus, variant.alt_index),
-            hgvs=hgvs_ann,
-            exac=ExacVariantAnnotation.from_simple_variant(variant_exac))
+        return variant, hgvs_ann, self.exac_variant(variant)
 
 
-def annotate_vcf(vcf_path: Path) -> Iterable[VariantAnnotation]:
+def annotate_vcf(vcf: Union[Path, VcfShard, StreamVcfShard, RegionVcfShard],
+                 exac_annotator: ExacAnnotator = annotate_simple_variants, exac_batch_size: int = 1,
+                 cache: Optional[AnnotationCache] = None, exac_data_version: str = API_BASE_URL,
+                 hgvs_machinery: Optional[HgvsMachinery] = None,
+                 previous: Optional['PreviousAnnotations'] = None) -> Iterable[VariantAnnotation]:
     """
     Annotates a given VCF file.
 
-    :param vcf_path: path of the vcf file.
+    :param vcf: path of the (optionally gzipped/bgzipped) vcf file, or a shard of one (or of a stream).
+    :param exac_annotator: batch ExAC annotator (defaults to the non-bulk API).
+    :param exac_batch_size: number of records whose ExAC annotations are resolved together.
+    :param cache: optional persistent cache of hgvs and ExAC annotations.
+    :param exac_data_version: identifies the data behind `exac_annotator` within the cache.
+    :param hgvs_machinery: hgvs machinery to reuse (set up from the vcf header by default).
+    :param previous: annotations of a previous run, reused instead of annotating the records again.
     :return: variant annotations.
     """
-    with vcf_path.open() as vcf_io:
-        reader = Reader(vcf_io)
-        hgvs_machinery = HgvsMachinery.from_assembly(assembly=TEMPUS_REFERENCE__ASSEMBLY[reader.metadata['reference']])
-        yield from (VariantAnnotation.from_vcf_locus(hgvs_machinery, record) for record in reader)
+    with open_vcf(vcf) as vcf_io:
+        header, records = read_vcf(vcf_io)
+        hgvs_machinery = hgvs_machinery or HgvsMachinery.from_assembly(
+            assembly=TEMPUS_REFERENCE__ASSEMBLY[header.reference])
+        allele_annotator = AlleleAnnotator.from_machinery(hgvs_machinery, cache)
+        if cache:
+            exac_annotator = cache.memoize_batch('exac', exac_data_version, exac_annotator)
+        for loci in chunked(records, exac_batch_size):
+            reused = [previous.reuse(locus) for locus in loci] if previous else [None] * len(loci)
+            fresh_loci = [locus for locus, ann in zip(loci, reused) if ann is None]
+            fresh = iter(VariantAnnotation.from_vcf_loci(
+                allele_annotator, fresh_loci, exac_annotator) if fresh_loci else ())
+            yield from (next(fresh) if ann is None else ann for ann in reused)
+        if cache:
+            cache.flush_stats()
+
+
+# enum members by code - stored by compact annotations instead of the members themselves
+_SEQUENCE_ALTERATIONS: Tuple[SequenceAlteration, ...] = tuple(SequenceAlteration)
+_FEATURE_VARIANTS: Tuple[FeatureVariant, ...] = tuple(FeatureVariant)
+_SEQUENCE_ALTERATION_CODES: Dict[SequenceAlteration, int] = {
+    member: code for code, member in enumerate(_SEQUENCE_ALTERATIONS)}
+_FEATURE_VARIANT_CODES: Dict[FeatureVariant, int] = {member: code for code, member in enumerate(_FEATURE_VARIANTS)}
+
+
+def _str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+class CompactAnnotation(NamedTuple):
+    """
+    Flat, tuple-backed form of a `VariantAnnotation`, with the CSV columns as fields - hgvs variants as strings, enum
+    members as codes, lists as tuples.
+
+    A `VariantAnnotation` holds four nested dataclasses (each with an instance dict) and several hgvs `SequenceVariant`
+    object graphs; this holds a single tuple of plain values, which is a fraction of the memory and cheap to pickle
+    between processes. Annotations are compacted by the workers, and held and written in this form.
+    """
+    # variant fields
+    var_contig: str
+    var_pos: int
+    var_ref: str
+    var_alt: str
+    var_alt_index: Optional[int]
+    # vcf fields
+    vcf_read_depth_site: Optional[int]
+    vcf_read_depth_alt: int
+    vcf_perc_reads_alt: float
+    vcf_containing_samples: Tuple[str, ...]
+    # hgvs fields
+    hgvs_sequence_alteration: Optional[int]
+    hgvs_feature_variant: Optional[int]
+    hgvs_hgvs_g: Optional[str]
+    hgvs_hgvs_c: Optional[str]
+    hgvs_hgvs_p: Optional[str]
+    hgvs_gene: Optional[str]
+    # exac fields
+    exac_allele_frequency: Optional[float]
+    exac_consequences: Tuple[str, ...]
+
+    @classmethod
+    def from_annotation(cls, ann: Union[VariantAnnotation, 'CompactAnnotation']) -> 'CompactAnnotation':
+        """
+        :param ann: variant annotation (compact ones are returned as they are).
+        :return: compact variant annotation.
+        """
+        if isinstance(ann, CompactAnnotation):
+            return ann
+        var, vcf, hgvs, exac = ann.var, ann.vcf, ann.hgvs, ann.exac
+        return cls(
+            var.contig, var.pos, var.ref, var.alt, var.alt_index,
+            None if vcf.read_depth_site is None else int(vcf.read_depth_site), int(vcf.read_depth_alt),
+            float(vcf.perc_reads_alt), tuple(vcf.containing_samples),
+            _SEQUENCE_ALTERATION_CODES.get(hgvs.sequence_alteration), _FEATURE_VARIANT_CODES.get(hgvs.feature_variant),
+            _str(hgvs.hgvs_g), _str(hgvs.hgvs_c), _str(hgvs.hgvs_p), hgvs.gene,
+            exac.allele_frequency, tuple(exac.consequences))
+
+    @property
+    def sequence_alteration(self) -> Optional[SequenceAlteration]:
+        code = self.hgvs_sequence_alteration
+        return None if code is None else _SEQUENCE_ALTERATIONS[code]
+
+    @property
+    def feature_variant(self) -> Optional[FeatureVariant]:
+        code = self.hgvs_feature_variant
+        return None if code is None else _FEATURE_VARIANTS[code]
+
+    def csv_row(self) -> Dict[str, Any]:
+        """
+        :return: flat CSV row keyed by `CSV_FIELDNAMES`.
+        """
+        row = self._asdict()
+        row['vcf_perc_reads_alt'] = round(self.vcf_perc_reads_alt, 2)
+        row['vcf_containing_samples'] = list(self.vcf_containing_samples)
+        row['hgvs_sequence_alteration'] = _str(self.sequence_alteration)
+        row['hgvs_feature_variant'] = _str(self.feature_variant)
+        # allele frequencies are kept at full precision - rare alleles would round to 0, and `--previous` reuses them
+        row['exac_consequences'] = list(self.exac_consequences)
+        return row
+
+
+CSV_FIELDNAMES: Tuple[str, ...] = CompactAnnotation._fields
+
+
+def compact_annotations(annotations: Iterable[Union[VariantAnnotation, CompactAnnotation]]) \
+        -> List[CompactAnnotation]:
+    """
+    :param annotations: variant annotations.
+    :return: compact variant annotations.
+    """
+    return [CompactAnnotation.from_annotation(ann) for ann in annotations]
+
+
+def annotation_to_csv_row(ann: Union[VariantAnnotation, CompactAnnotation]) -> Dict[str, Any]:
+    """
+    :param ann: variant annotation.
+    :return: flat CSV row keyed by `CSV_FIELDNAMES`.
+    """
+    return CompactAnnotation.from_annotation(ann).csv_row()
 
 
-def write_annotations_to_csv(annotations: Iterable[VariantAnnotation], out_io: TextIO):
+class CsvAnnotationWriter:
+    """
+    Incremental CSV writer - writes the header upfront and flushes after every batch of annotations.
+    """
+
+    def __init__(self, out_io: TextIO, write_header: bool = True):
+        """
+        :param out_io: text output stream.
+        :param write_header: False when appending to a previously written output.
+        """
+        self._out_io = out_io
+        self._writer = csv.DictWriter(out_io, fieldnames=CSV_FIELDNAMES)
+        if write_header:
+            self._writer.writeheader()
+
+    def write(self, annotations: Iterable[Union[VariantAnnotation, CompactAnnotation]]):
+        self._writer.writerows(map(annotation_to_csv_row, annotations))
+        self._out_io.flush()
+
+    def flush(self):
+        self._out_io.flush()
+
+
+def write_annotations_to_csv(annotations: Iterable[Union[VariantAnnotation, CompactAnnotation]], out_io: TextIO):
     """
     Writes variant annotations to CSV.
 
     :param annotations: variant annotations
     :param out_io: open stream.
     """
+    CsvAnnotationWriter(out_io).write(annotations)
+
+
+#
+# annotated vcf output
+#
+
+# INFO key, number, type, description, value getter
+_VCF_INFO_FIELDS: Tuple[Tuple[str, str, str, str, Callable[[CompactAnnotation], Any]], ...] = (
+    ('TEMPUS_ALT_INDEX', '1', 'Integer', 'Index of the most deleterious ALT allele, which the other TEMPUS_ keys '
+                                         'describe', lambda ann: ann.var_alt_index),
+    ('TEMPUS_READ_DEPTH_ALT', '1', 'Integer', 'Read depth of the ALT allele summed across samples',
+     lambda ann: ann.vcf_read_depth_alt),
+    ('TEMPUS_PERC_READS_ALT', '1', 'Float', 'Ratio of ALT to REF read depth', lambda ann: ann.vcf_perc_reads_alt),
+    ('TEMPUS_CONTAINING_SAMPLES', '.', 'String', 'Samples whose genotype calls contain the ALT allele',
+     lambda ann: ann.vcf_containing_samples),
+    ('TEMPUS_SEQUENCE_ALTERATION', '1', 'String', 'Sequence alteration (Sequence Ontology)',
+     lambda ann: ann.sequence_alteration),
+    ('TEMPUS_FEATURE_VARIANT', '1', 'String', 'Most deleterious feature variant (Sequence Ontology)',
+     lambda ann: ann.feature_variant),
+    ('TEMPUS_HGVS_G', '1', 'String', 'HGVS genomic variant', lambda ann: ann.hgvs_hgvs_g),
+    ('TEMPUS_HGVS_C', '1', 'String', 'HGVS coding variant', lambda ann: ann.hgvs_hgvs_c),
+    ('TEMPUS_HGVS_P', '1', 'String', 'HGVS protein variant', lambda ann: ann.hgvs_hgvs_p),
+    ('TEMPUS_GENE', '1', 'String', 'Gene symbol', lambda ann: ann.hgvs_gene),
+    ('TEMPUS_EXAC_AF', '1', 'Float', 'ExAC allele frequency', lambda ann: ann.exac_allele_frequency),
+    ('TEMPUS_EXAC_CONSEQUENCES', '.', 'String', 'ExAC (VEP) consequences', lambda ann: ann.exac_consequences),
+)
+
+# characters with special meaning in INFO values (VCF 4.3 percent encoding)
+_VCF_INFO_ESCAPES = str.maketrans({
+    '%': '%25', ':': '%3A', ';': '%3B', '=': '%3D', ',': '%2C', ' ': '%20', '\t': '%09', '\n': '%0A', '\r': '%0D'})
+
+
+def _vcf_info_value(value: Any) -> Optional[str]:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    elif isinstance(value, (list, tuple)):
+        return ','.join(str(item).translate(_VCF_INFO_ESCAPES) for item in value) or None
+    elif isinstance(value, float):
+        return f'{value:.6g}'
+    else:
+        return str(value).translate(_VCF_INFO_ESCAPES)
+
+
+def vcf_header_with_annotations(header: Sequence[bytes]) -> List[bytes]:
+    """
+    :param header: vcf header lines.
+    :return: header lines declaring the INFO keys of variant annotations (ahead of the #CHROM line).
+    """
+    info_lines = [
+        f'##INFO=<ID={key},Number={number},Type={type_},Description="{description}">\n'.encode()
+        for key, number, type_, description, _ in _VCF_INFO_FIELDS]
+    return [line for line in header if not line.startswith(b'#CHROM')] + info_lines + [
+        line for line in header if line.startswith(b'#CHROM')]
+
+
+def annotate_vcf_record(record: bytes, ann: Union[VariantAnnotation, CompactAnnotation]) -> bytes:
+    """
+    :param record: vcf record line.
+    :param ann: variant annotation of the record.
+    :return: record line with the annotation added to its INFO column.
+    """
+    ann = CompactAnnotation.from_annotation(ann)
+    fields = record.rstrip(b'\r\n').split(b'\t', 8)
+    info = ';'.join(
+        f'{key}={value}' for key, _, _, _, get in _VCF_INFO_FIELDS
+        for value in (_vcf_info_value(get(ann)),) if value is not None).encode()
+    fields[7] = info if fields[7] == b'.' else b';'.join((fields[7], info))
+    return b'\t'.join(fields) + b'\n'
+
+
+class VcfAnnotationWriter:
+    """
+    Incremental annotated vcf writer - the input records, in order, with their annotations added as INFO keys.
+    Output is block gzip (bgzip) compressed, hence can be tabix indexed.
+    """
+
+    def __init__(self, out_io: BinaryIO, header: Sequence[bytes], write_header: bool = True):
+        """
+        :param out_io: binary output stream.
+        :param header: header lines of the input vcf.
+        :param write_header: False when appending to a previously written output.
+        """
+        self._writer = BgzfStreamWriter(out_io)
+        if write_header:
+            self._writer.write(b''.join(vcf_header_with_annotations(header)))
+
+    def write(self, records: Iterable[bytes], annotations: Iterable[Union[VariantAnnotation, CompactAnnotation]]):
+        """
+        :param records: vcf record lines.
+        :param annotations: variant annotations of the records (in the same order).
+        """
+        records = (record for record in records if record.strip())
+        self._writer.write(b''.join(map(annotate_vcf_record, records, annotations)))
+
+    def flush(self):
+        """
+        Completes the current BGZF block, so that the output written so far ends on a block boundary.
+        """
+        self._writer.flush()
+
+    def close(self):
+        # the BGZF end-of-file marker
+        self._writer.close()
+
+    def __enter__(self) -> 'VcfAnnotationWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def tabix_index_vcf(vcf_path: Path) -> Path:
+    """
+    Indexes a sorted, bgzip compressed vcf file - requires the optional `pysam` dependency.
+
+    :param vcf_path: bgzip compressed vcf file.
+    :return: path of the tabix index.
+    """
+    import pysam
+    index_path = vcf_path.with_name(vcf_path.name + '.tbi')
+    pysam.tabix_index(str(vcf_path), preset='vcf', force=True, index=str(index_path))
+    return index_path
+
+
+#
+# previous output
+#
+
+@lru_cache(maxsize=None)
+def _hgvs_parser() -> Parser:
+    # building the grammar is expensive, hence once per process
+    return Parser()
+
+
+@dataclass(frozen=True)
+class PreviousAnnotations:
+    """
+    Rows of a previous CSV output, keyed by the chrom-pos-ref-alt of their variant.
+
+    Only biallelic records are reused - for these the key identifies the record, whereas the row of a multiallelic
+    record only tells the most deleterious of its alleles. The vcf fields are recomputed from the current record.
+    """
+    rows: Dict[Tuple[str, int, str, str], Dict[str, str]] = field(repr=False)
+
+    @classmethod
+    def from_csv(cls, csv_path: Path) -> 'PreviousAnnotations':
+        """
+        :param csv_path: CSV output of a previous run.
+        :return: previous annotations.
+        """
+        with csv_path.open() as csv_io:
+            return cls(rows={
+                (row['var_contig'], int(row['var_pos']), row['var_ref'], row['var_alt']): row
+                for row in csv.DictReader(csv_io) if row['var_alt_index'] == '1'})
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def reuse(self, locus: VcfRecord) -> Optional[VariantAnnotation]:
+        """
+        :param locus: vcf record for locus.
+        :return: annotation of the locus rebuilt from its previous row, None if there is none.
+        """
+        if len(locus.alts) != 1:
+            return None
+        row = self.rows.get((locus.contig, locus.pos, locus.ref, locus.alts[0]))
+        if row is None:
+            return None
+
+        def hgvs_variant(value: str) -> Optional[SequenceVariant]:
+            return _hgvs_parser().parse_hgvs_variant(value) if value else None
+
+        return VariantAnnotation(
+            var=SimpleVariant(contig=locus.contig, pos=locus.pos, ref=locus.ref, alt=locus.alts[0], alt_index=1),
+            vcf=VcfVariantAnnotation.from_vcf_locus(locus, 1),
+            hgvs=HgvsVariantAnnotation(
+                hgvs_c=hgvs_variant(row['hgvs_hgvs_c']),
+                hgvs_p=hgvs_variant(row['hgvs_hgvs_p']),
+                feature_variant=_FEATURE_VARIANT_BY_SLUG[row['hgvs_feature_variant']]
+                if row['hgvs_feature_variant'] else None,
+                hgvs_g=hgvs_variant(row['hgvs_hgvs_g']),
+                sequence_alteration=_SEQUENCE_ALTERATION_BY_SLUG[row['hgvs_sequence_alteration']],
+                gene=row['hgvs_gene'] or None),
+            exac=ExacVariantAnnotation(
+                allele_frequency=float(row['exac_allele_frequency']) if row['exac_allele_frequency'] else None,
+                consequences=ast.literal_eval(row['exac_consequences']) if row['exac_consequences'] else []))
+
 
-    def coerce(value: Any) -> Any:
-        if isinstance(value, (SequenceAlteration, FeatureVariant, SequenceVariant)):
-            return str(value)
-        elif isinstance(value, float):
-            return round(value, 2)
-        else:
-            return value
-
-    def to_dict(ann: VariantAnnotation) -> Dict[str, Any]:
-        flat = flatten(asdict(ann), reducer=lambda key_a, key_b: key_b if key_a is None else '_'.join((key_a, key_b)))
-        return {key: coerce(value) for key, value in flat.items()}
-
-    writer = csv.DictWriter(out_io, fieldnames=(
-        # variant fields
-        'var_contig', 'var_pos', 'var_ref', 'var_alt', 'var_alt_index',
-        # vcf fields
-        'vcf_read_depth_site', 'vcf_read_depth_alt', 'vcf_perc_reads_alt', 'vcf_containing_samples',
-        # hgvs fields
-        'hgvs_sequence_alteration', 'hgvs_feature_variant', 'hgvs_hgvs_g', 'hgvs_hgvs_c', 'hgvs_hgvs_p', 'hgvs_gene',
-        # exac fields
-        'exac_allele_frequency', 'exac_consequences'))
-    writer.writeheader()
-    writer.writerows(map(to_dict, annotations))
+_FEATURE_VARIANT_BY_SLUG: Dict[str, FeatureVariant] = {member.slug: member for member in FeatureVariant}
+_SEQUENCE_ALTERATION_BY_SLUG: Dict[str, SequenceAlteration] = {member.slug: member for member in SequenceAlteration}
@@ -0,0 +1,197 @@
+"""
+Persistent on-disk annotation cache - keyed by simple variant, namespace (annotation source) and data version.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from tempus import SimpleVariant
+
+T = TypeVar('T')
+
+_SCHEMA = """
+create table if not exists annotation (
+    id integer primary key,
+    namespace text not null,
+    version text not null,
+    contig text not null,
+    pos integer not null,
+    ref text not null,
+    alt text not null,
+    value blob not null,
+    accessed real not null,
+    unique (namespace, version, contig, pos, ref, alt));
+create index if not exists annotation_accessed on annotation (accessed);
+create table if not exists stats (
+    namespace text primary key,
+    hits integer not null default 0,
+    misses integer not null default 0);
+"""
+
+
+@dataclass
+class AnnotationCache:
+    """
+    SQLite-backed cache of annotation results with least-recently-used eviction.
+
+    Safe to share between processes and threads - each thread lazily opens its own connection and the database runs in
+    WAL mode.
+    Values are pickled, hence should be plain (frozen) dataclasses.
+    """
+    path: Path
+    max_entries: int = 1_000_000
+    evict_every: int = 1000
+    hits: Counter = field(default_factory=Counter, repr=False)
+    misses: Counter = field(default_factory=Counter, repr=False)
+    _local: threading.local = field(default_factory=threading.local, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _puts: int = field(default=0, init=False, repr=False)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # connections must not be shared with forked children, nor (sqlite3 objects) with other threads
+        local = self._local
+        if getattr(local, 'connection', None) is None or local.pid != os.getpid():
+            local.connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+            local.connection.execute('pragma journal_mode=wal')
+            local.connection.execute('pragma synchronous=normal')
+            local.connection.executescript(_SCHEMA)
+            local.pid = os.getpid()
+        return local.connection
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # connections are per process (and thread), hence never pickled
+        state = dict(self.__dict__)
+        del state['_local'], state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state, _local=threading.local(), _lock=threading.Lock())
+
+    def get_many(self, namespace: str, version: str, variants: Sequence[SimpleVariant]) -> List[Optional[Any]]:
+        """
+        :param namespace: annotation source (e.g. 'hgvs', 'exac').
+        :param version: version of the data behind the annotation source.
+        :param variants: simple variants.
+        :return: cached values in the order of variants (None for misses).
+        """
+        values: List[Optional[Any]] = []
+        hit_ids: List[Tuple[float, int]] = []
+        now = time.time()
+        for variant in variants:
+            row = self.connection.execute(
+                'select id, value from annotation '
+                'where namespace=? and version=? and contig=? and pos=? and ref=? and alt=?',
+                (namespace, version, variant.contig, variant.pos, variant.ref, variant.alt)).fetchone()
+            if row is None:
+                values.append(None)
+            else:
+                hit_ids.append((now, row[0]))
+                values.append(pickle.loads(row[1]))
+        self.connection.executemany('update annotation set accessed=? where id=?', hit_ids)
+        with self._lock:
+            self.hits[namespace] += len(hit_ids)
+            self.misses[namespace] += len(variants) - len(hit_ids)
+        return values
+
+    def put_many(self, namespace: str, version: str, items: Iterable[Tuple[SimpleVariant, Any]]):
+        """
+        :param namespace: annotation source (e.g. 'hgvs', 'exac').
+        :param version: version of the data behind the annotation source.
+        :param items: pairs of simple variants and their values.
+        """
+        now = time.time()
+        rows = [
+            (namespace, version, variant.contig, variant.pos, variant.ref, variant.alt,
+             pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now)
+            for variant, value in items]
+        self.connection.executemany(
+            'insert or replace into annotation (namespace, version, contig, pos, ref, alt, value, accessed) '
+            'values (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        with self._lock:
+            self._puts += len(rows)
+            evict = self._puts >= self.evict_every
+            if evict:
+                self._puts = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Evicts least recently used entries beyond `max_entries`.
+        """
+        count, = self.connection.execute('select count(*) from annotation').fetchone()
+        if count > self.max_entries:
+            self.connection.execute(
+                'delete from annotation where id in (select id from annotation order by accessed, id limit ?)',
+                (count - self.max_entries,))
+            logging.info(f'evicted {count - self.max_entries} entries from annotation cache {self.path}')
+
+    def memoize(self, namespace: str, version: str, compute: Callable[[SimpleVariant], T]) -> Callable[
+            [SimpleVariant], T]:
+        """
+        :param namespace: annotation source (e.g. 'hgvs', 'exac').
+        :param version: version of the data behind the annotation source.
+        :param compute: single variant annotator.
+        :return: single variant annotator backed by the cache.
+        """
+
+        def memoized(variant: SimpleVariant) -> T:
+            value, = self.get_many(namespace, version, (variant,))
+            if value is None:
+                value = compute(variant)
+                self.put_many(namespace, version, ((variant, value),))
+            return value
+
+        return memoized
+
+    def memoize_batch(self, namespace: str, version: str, compute: Callable[[Sequence[SimpleVariant]], List[T]]) -> \
+            Callable[[Sequence[SimpleVariant]], List[T]]:
+        """
+        :param namespace: annotation source (e.g. 'hgvs', 'exac').
+        :param version: version of the data behind the annotation source.
+        :param compute: batch annotator (order preserving).
+        :return: batch annotator backed by the cache, which only passes on the cache misses.
+        """
+
+        def memoized(variants: Sequence[SimpleVariant]) -> List[T]:
+            values = self.get_many(namespace, version, variants)
+            missing = [idx for idx, value in enumerate(values) if value is None]
+            if missing:
+                computed = compute([variants[idx] for idx in missing])
+                for idx, value in zip(missing, computed):
+                    values[idx] = value
+                self.put_many(namespace, version, ((variants[idx], values[idx]) for idx in missing))
+            return values
+
+        return memoized
+
+    def flush_stats(self):
+        """
+        Adds this instance's hit/miss counters to the cumulative counters persisted in the cache.
+        """
+        with self._lock:
+            hits, misses = Counter(self.hits), Counter(self.misses)
+            self.hits.clear()
+            self.misses.clear()
+        for namespace in hits.keys() | misses.keys():
+            self.connection.execute(
+                'insert into stats (namespace, hits, misses) values (?, ?, ?) on conflict (namespace) '
+                'do update set hits=hits + excluded.hits, misses=misses + excluded.misses',
+                (namespace, hits[namespace], misses[namespace]))
+            logging.info(f'annotation cache {namespace}: {hits[namespace]} hits, {misses[namespace]} misses')
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: cumulative hit/miss counters per namespace.
+        """
+        return {
+            namespace: {'hits': hits, 'misses': misses}
+            for namespace, hits, misses in self.connection.execute('select namespace, hits, misses from stats')}
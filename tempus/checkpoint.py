@@ -0,0 +1,68 @@
+"""
+Checkpoints of annotation runs - how far the output got, so that an interrupted run can pick up where it stopped.
+"""
+import json
+import os
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """
+    Progress of an annotation run, saved next to its output after every completed chunk.
+
+        vcf :: input vcf ('-' for stdin).
+        output_format :: format of the output.
+        records :: number of vcf records whose annotations have been written.
+        out_bytes :: size of the output after the last completed chunk (anything beyond is partial).
+        regions :: regions the input was restricted to (comma-separated), if any.
+    """
+    vcf: str
+    output_format: str
+    records: int
+    out_bytes: int
+    regions: Optional[str] = None
+
+    @staticmethod
+    def path_for(out: Path) -> Path:
+        """
+        :param out: output of an annotation run.
+        :return: path of its checkpoint sidecar.
+        """
+        return out.with_name(out.name + '.checkpoint')
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['Checkpoint']:
+        """
+        :param path: checkpoint file.
+        :return: checkpoint, None if there is none.
+        """
+        if not path.exists():
+            return None
+        with path.open() as checkpoint_io:
+            return cls(**json.load(checkpoint_io))
+
+    def check_output(self, out: Path):
+        """
+        :param out: output the checkpoint was saved for.
+        :raises ValueError: unless the output holds (at least) everything written up to the checkpoint.
+        """
+        if not out.exists():
+            raise ValueError(f'cannot resume: the output {out} of the checkpoint is missing')
+        if out.stat().st_size < self.out_bytes:
+            raise ValueError(
+                f'cannot resume: the output {out} has {out.stat().st_size} bytes, less than the {self.out_bytes} '
+                f'written up to the checkpoint')
+
+    def save(self, path: Path):
+        """
+        Replaces the checkpoint file atomically, hence an interruption leaves either the old or the new checkpoint.
+
+        :param path: checkpoint file.
+        """
+        tmp_path = path.with_name(path.name + '.tmp')
+        with tmp_path.open('w') as checkpoint_io:
+            json.dump(asdict(self), checkpoint_io)
+        os.replace(str(tmp_path), str(path))
@@ -0,0 +1,154 @@
+"""
+Cohort annotation - many vcfs (e.g. the tumor/normal pairs of a panel) annotated together, every distinct allele once.
+
+Panel vcfs share most of their loci, hence annotating them one by one repeats the same hgvs and ExAC work for every
+file. The cohort is scanned upfront for its distinct loci and alleles instead:
+
+    1. the hgvs annotations of every distinct allele (regardless of the locus it was called at),
+    2. the most deleterious allele of every distinct locus (as `AlleleAnnotator.most_deleterious_allele` picks it),
+    3. the ExAC annotations of every distinct most deleterious allele,
+
+and the annotations are then joined back to the records of each vcf, along with the annotations drawn from the
+record itself (read depths, containing samples).
+"""
+from dataclasses import dataclass, replace
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from tempus import SimpleVariant
+from tempus.annotation import VariantAnnotation, AlleleAnnotator, allele_impact
+from tempus.cache import AnnotationCache
+from tempus.exac import ExacAnnotator, ExacVariantAnnotation, API_BASE_URL
+from tempus.hgvs import HgvsMachinery, HgvsVariantAnnotation
+from tempus.profiling import PROFILE
+from tempus.vcf import VcfShard, VcfVariantAnnotation, open_vcf, read_vcf, Locus, scan_loci, locus_alleles
+
+
+def allele_key(variant: SimpleVariant) -> SimpleVariant:
+    """
+    :param variant: simple variant.
+    :return: the variant regardless of the locus it was called at (i.e. without alt index).
+    """
+    return replace(variant, alt_index=None) if variant.alt_index is not None else variant
+
+
+@dataclass(frozen=True)
+class CohortVariants:
+    """
+    Distinct loci of a cohort of vcfs.
+    """
+    vcfs: Tuple[Path, ...]
+    loci: Tuple[Locus, ...]
+    n_records: int
+
+    @classmethod
+    def from_vcfs(cls, vcfs: Sequence[Path]) -> 'CohortVariants':
+        """
+        :param vcfs: (optionally gzipped/bgzipped) vcf files.
+        :return: distinct loci of the vcfs, in order of first appearance.
+        """
+        loci: Dict[Locus, None] = {}
+        n_records = 0
+        with PROFILE.stage('cohort.scan'):
+            for vcf in vcfs:
+                for locus in scan_loci(vcf):
+                    loci[locus] = None
+                    n_records += 1
+        return cls(vcfs=tuple(vcfs), loci=tuple(loci), n_records=n_records)
+
+    @property
+    def alleles(self) -> List[SimpleVariant]:
+        """
+        :return: distinct alleles of the loci (without alt index), in order of first appearance.
+        """
+        return list(dict.fromkeys(allele_key(variant) for locus in self.loci for variant in locus_alleles(locus)))
+
+
+def output_paths(vcfs: Sequence[Path], out_dir: Path, suffix: str) -> List[Path]:
+    """
+    :param vcfs: vcf files.
+    :param out_dir: output directory.
+    :param suffix: suffix of the output files, e.g. '.csv'.
+    :return: output file of each vcf, named after it.
+    """
+    names = []
+    for vcf in vcfs:
+        name = vcf.name
+        for extension in ('.gz', '.bgz', '.vcf'):
+            name = name[:-len(extension)] if name.endswith(extension) else name
+        names.append(name + suffix)
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'vcfs with the same name would share their output: {", ".join(duplicates)}')
+    return [out_dir / name for name in names]
+
+
+def annotate_alleles(hgvs_machinery: HgvsMachinery, variants: Sequence[SimpleVariant],
+                     cache: Optional[AnnotationCache] = None) -> List[HgvsVariantAnnotation]:
+    """
+    :param hgvs_machinery: instance of hgvs machinery.
+    :param variants: distinct alleles.
+    :param cache: optional cache of hgvs annotations.
+    :return: hgvs annotations in the order of variants.
+    """
+    annotate_hgvs = partial(HgvsVariantAnnotation.from_simple_variant, hgvs_machinery)
+    if cache:
+        annotate_hgvs = cache.memoize('hgvs', hgvs_machinery.data_version, annotate_hgvs)
+    hgvs_machinery.prefetch_transcripts(variants)
+    with PROFILE.stage('annotation.hgvs'):
+        return [annotate_hgvs(variant) for variant in variants]
+
+
+def most_deleterious_alleles(loci: Sequence[Locus], hgvs_anns: Mapping[SimpleVariant, HgvsVariantAnnotation]) \
+        -> Dict[Locus, SimpleVariant]:
+    """
+    :param loci: distinct loci.
+    :param hgvs_anns: hgvs annotations of (at least) the alleles of the loci, by allele key.
+    :return: most deleterious allele (with alt index) of each locus - the first of equally deleterious ones.
+    """
+    return {
+        locus: max(locus_alleles(locus), key=lambda variant: allele_impact(hgvs_anns[allele_key(variant)]))
+        for locus in loci}
+
+
+def annotate_exac(hgvs_machinery: HgvsMachinery, variants: Sequence[SimpleVariant], exac_annotator: ExacAnnotator,
+                  cache: Optional[AnnotationCache] = None, exac_data_version: str = API_BASE_URL) \
+        -> List[ExacVariantAnnotation]:
+    """
+    :param hgvs_machinery: instance of hgvs machinery.
+    :param variants: distinct alleles.
+    :param exac_annotator: batch ExAC annotator, called once for all alleles.
+    :param cache: optional cache of hgvs and ExAC annotations.
+    :param exac_data_version: identifies the data behind `exac_annotator` within the cache.
+    :return: ExAC annotations in the order of variants.
+    """
+    allele_annotator = AlleleAnnotator.from_machinery(hgvs_machinery, cache)
+    if cache:
+        exac_annotator = cache.memoize_batch('exac', exac_data_version, exac_annotator)
+    with PROFILE.stage('annotation.hgvs'):
+        variants_exac = [allele_annotator.exac_variant(variant) for variant in variants]
+    with PROFILE.stage('annotation.exac'):
+        return exac_annotator(variants_exac)
+
+
+def join_annotations(vcf: Union[Path, VcfShard], alleles: Mapping[Locus, SimpleVariant],
+                     hgvs_anns: Mapping[SimpleVariant, HgvsVariantAnnotation],
+                     exac_anns: Mapping[SimpleVariant, ExacVariantAnnotation]) -> List[VariantAnnotation]:
+    """
+    :param vcf: vcf file (or shard of one) of the cohort.
+    :param alleles: most deleterious allele of each locus.
+    :param hgvs_anns: hgvs annotations by allele key.
+    :param exac_anns: ExAC annotations of the most deleterious alleles, by allele key.
+    :return: variant annotations of the vcf records, as `annotate_vcf` produces them.
+    """
+    annotations = []
+    with open_vcf(vcf) as vcf_io:
+        _, records = read_vcf(vcf_io)
+        for record in records:
+            variant = alleles[(record.contig, record.pos, record.ref, record.alts)]
+            with PROFILE.stage('annotation.vcf'):
+                vcf_ann = VcfVariantAnnotation.from_vcf_locus(record, variant.alt_index)
+            annotations.append(VariantAnnotation(
+                var=variant, vcf=vcf_ann, hgvs=hgvs_anns[allele_key(variant)], exac=exac_anns[allele_key(variant)]))
+    return annotations
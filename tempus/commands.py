@@ -0,0 +1,419 @@
+"""
+Handlers of the `tempus` commands (see `tempus.__main__`).
+
+They are kept apart from the command line parsing, so that `--help` and argument errors need none of the heavy imports
+(hgvs, PyVCF, numpy, requests) that annotation does.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from bioutils.assemblies import make_ac_name_map
+from hgvs.dataproviders import uta
+from hgvs.dataproviders.interface import Interface
+from more_itertools import chunked
+
+from tempus import Assembly, SimpleVariant
+from tempus.aio import AsyncExacClient, annotate_vcf_async
+from tempus.annotation import annotate_vcf, CsvAnnotationWriter, VariantAnnotation, VcfAnnotationWriter, \
+    tabix_index_vcf, PreviousAnnotations, CompactAnnotation, compact_annotations
+from tempus.cache import AnnotationCache
+from tempus.checkpoint import Checkpoint
+from tempus.cohort import CohortVariants, annotate_alleles, annotate_exac, most_deleterious_alleles, allele_key, \
+    join_annotations, output_paths
+from tempus.exac import ExacBulkClient, API_BASE_URL, annotate_simple_variants, ExacAnnotator, ExacVariantAnnotation
+from tempus.exac_sites import ExacSitesIndex
+from tempus.hgvs import HgvsMachinery, TranscriptIndex, ASSEMBLY__HGVS_ASSEMBLY_NAME, HgvsVariantAnnotation
+from tempus.parallel import imap_ordered, forkserver_context
+from tempus.profiling import PROFILE, Profile
+from tempus.replay import ExacReplay, connect_data_provider
+from tempus.scheduling import CostModel, RecordFeatures, guided_shards, FEATURES
+from tempus.uta_snapshot import UtaSnapshot, export_uta_snapshot
+from tempus.vcf import shard_vcf, assembly_from_vcf, contigs_from_vcf, VcfShard, StreamVcfShard, shard_vcf_stream, \
+    assembly_from_header, read_vcf_header, RegionVcfShard, Region, shard_vcf_regions, scan_loci, \
+    locus_alleles, vcf_compression
+
+
+@dataclass(frozen=True)
+class _AnnotateOptions:
+    mode: str
+    exac_batch_size: int
+    exac_sites: Optional[Path]
+    exac_concurrency: int
+    exac_rate_limit: Optional[float]
+    cache: Optional[AnnotationCache]
+    transcript_index: Optional[Path]
+    previous: Optional[Path]
+    fixtures: Optional[Path] = None
+    record: bool = False
+    profile: bool = False
+    reference: Optional[Path] = None
+    uta: Optional[Path] = None
+    start_method: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class _WorkerContext:
+    """
+    Per-process (per-thread in threads mode) state, set up once by the pool initializer and reused for every chunk.
+    """
+    hgvs_machinery: HgvsMachinery
+    exac_annotator: ExacAnnotator
+    exac_data_version: str
+    async_exac_client: Optional[AsyncExacClient]
+    previous: Optional[PreviousAnnotations]
+
+
+@dataclass(frozen=True)
+class _SharedResources:
+    """
+    Read-only state loaded once per process - in threads mode, shared by all threads.
+    """
+    transcript_index: Optional[TranscriptIndex]
+    exac_sites_index: Optional[ExacSitesIndex]
+    previous: Optional[PreviousAnnotations]
+
+    @classmethod
+    def load(cls, options: _AnnotateOptions) -> '_SharedResources':
+        return cls(
+            transcript_index=TranscriptIndex.load(options.transcript_index) if options.transcript_index else None,
+            exac_sites_index=ExacSitesIndex.open(options.exac_sites) if options.exac_sites else None,
+            previous=PreviousAnnotations.from_csv(options.previous) if options.previous else None)
+
+
+_worker_context: Optional[_WorkerContext] = None
+# worker contexts of threads mode - data provider (UTA connection, seqrepo) handles are not thread-safe
+_thread_context = threading.local()
+
+
+def _exac_annotator(options: _AnnotateOptions, shared: _SharedResources) -> Tuple[ExacAnnotator, str]:
+    if options.fixtures:
+        exac_replay = ExacReplay.from_fixtures(options.fixtures, record=options.record)
+        return exac_replay.annotate_batch, exac_replay.data_version
+    elif shared.exac_sites_index:
+        return shared.exac_sites_index.annotate_batch, shared.exac_sites_index.data_version
+    elif options.exac_batch_size > 0:
+        return ExacBulkClient(batch_size=options.exac_batch_size).annotate_batch, API_BASE_URL
+    else:
+        return annotate_simple_variants, API_BASE_URL
+
+
+def _data_provider(options: _AnnotateOptions) -> Optional[Interface]:
+    if options.fixtures:
+        return connect_data_provider(options.fixtures, options.record)
+    elif options.uta:
+        return UtaSnapshot(options.uta)
+    return None
+
+
+def _init_worker(assembly: Assembly, options: _AnnotateOptions, shared: Optional[_SharedResources] = None):
+    global _worker_context
+    started = time.perf_counter()
+    PROFILE.enabled = options.profile
+    with PROFILE.stage('worker.setup'):
+        shared = shared or _SharedResources.load(options)
+        exac_annotator, exac_data_version = _exac_annotator(options, shared)
+        context = _WorkerContext(
+            hgvs_machinery=HgvsMachinery.from_assembly(
+                assembly, transcript_index=shared.transcript_index,
+                data_provider=_data_provider(options),
+                local_reference=options.reference),
+            exac_annotator=exac_annotator,
+            exac_data_version=exac_data_version,
+            async_exac_client=AsyncExacClient(
+                concurrency=options.exac_concurrency,
+                rate_limit=options.exac_rate_limit) if options.mode == 'async' else None,
+            previous=shared.previous)
+    if options.mode == 'threads':
+        _thread_context.context = context
+    else:
+        _worker_context = context
+    logging.info(f'worker {os.getpid()}/{threading.get_ident()} set up in {time.perf_counter() - started:.3f}s')
+
+
+def _context() -> _WorkerContext:
+    return getattr(_thread_context, 'context', None) or _worker_context
+
+
+def _worker_pool(max_workers: int, assembly: Assembly, options: _AnnotateOptions) -> Executor:
+    if options.mode == 'threads':
+        # threads share the process (and its profile), their own data provider handles aside
+        return ThreadPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker,
+            initargs=(assembly, options, _SharedResources.load(options)))
+    mp_context = forkserver_context() if options.start_method == 'forkserver' else multiprocessing.get_context(
+        options.start_method)
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=mp_context, initializer=_init_worker, initargs=(assembly, options))
+
+
+def _annotate_vcf(vcf_shard: Union[VcfShard, StreamVcfShard, RegionVcfShard], options: _AnnotateOptions) \
+        -> List[VariantAnnotation]:
+    context = _context()
+    # the transcripts of the whole chunk in a few bulk queries, rather than a few per variant
+    context.hgvs_machinery.prefetch_transcripts(
+        variant for locus in scan_loci(vcf_shard) for variant in locus_alleles(locus))
+    if context.async_exac_client:
+        annotations = annotate_vcf_async(
+            vcf_shard, context.async_exac_client, cache=options.cache, hgvs_machinery=context.hgvs_machinery,
+            previous=context.previous)
+    else:
+        annotations = annotate_vcf(
+            vcf_shard, exac_annotator=context.exac_annotator, exac_batch_size=max(options.exac_batch_size, 1),
+            cache=options.cache, exac_data_version=context.exac_data_version, hgvs_machinery=context.hgvs_machinery,
+            previous=context.previous)
+    annotations = list(annotations)
+    if context.hgvs_machinery.sequence_fetcher:
+        context.hgvs_machinery.sequence_fetcher.log_stats()
+    return annotations
+
+
+def _annotate_vcf_task(vcf_shard: Union[VcfShard, StreamVcfShard, RegionVcfShard], options: _AnnotateOptions,
+                       profiled: bool = False) -> Tuple[List[CompactAnnotation], float, Optional[Profile]]:
+    started = time.perf_counter()
+    annotations = _annotate_vcf(vcf_shard, options)
+    # compact, so that chunks pickle cheaply and take little memory while they wait for their turn to be written
+    with PROFILE.stage('annotation.compact'):
+        annotations = compact_annotations(annotations)
+    # ships the duration (for the cost model) and the worker's stage statistics of every chunk to the main process
+    return annotations, time.perf_counter() - started, PROFILE.drain() if profiled else None
+
+
+def _annotate_alleles(variants: List[SimpleVariant], options: _AnnotateOptions) -> List[HgvsVariantAnnotation]:
+    return annotate_alleles(_context().hgvs_machinery, variants, cache=options.cache)
+
+
+def _annotate_alleles_exac(variants: List[SimpleVariant], options: _AnnotateOptions) -> List[ExacVariantAnnotation]:
+    context = _context()
+    return annotate_exac(
+        context.hgvs_machinery, variants, context.exac_annotator, cache=options.cache,
+        exac_data_version=context.exac_data_version)
+
+
+@contextmanager
+def _open_annotation_writer(out: Optional[Path], output_format: str, row_group_size: int,
+                            vcf_header: Sequence[bytes], append: bool = False):
+    if output_format == 'csv':
+        with (out.open('a' if append else 'w') if out else open(sys.stdout.fileno(), 'w', closefd=False)) as out_io:
+            yield CsvAnnotationWriter(out_io, write_header=not append)
+    elif output_format == 'vcf':
+        with (out.open('ab' if append else 'wb') if out else open(sys.stdout.fileno(), 'wb', closefd=False)) \
+                as out_io, VcfAnnotationWriter(out_io, vcf_header, write_header=not append) as writer:
+            yield writer
+        if out:
+            tabix_index_vcf(out)
+    else:
+        # optional dependency, hence imported only when asked for
+        from tempus.arrow import ArrowAnnotationWriter
+        import pyarrow as pa
+        with (out.open('wb') if out else open(sys.stdout.fileno(), 'wb', closefd=False)) as out_io, \
+                ArrowAnnotationWriter(pa.PythonFile(out_io, mode='w'), output_format, row_group_size) as writer:
+            yield writer
+
+
+def _transcript_probe(options: _AnnotateOptions, assembly: Assembly) \
+        -> Tuple[Optional[TranscriptIndex], Dict[str, str]]:
+    # transcript counts for the cost estimates, from the transcript index or UTA snapshot at hand (if any)
+    assembly_name = ASSEMBLY__HGVS_ASSEMBLY_NAME[assembly]
+    contig__accession = {contig: alt_ac for alt_ac, contig in make_ac_name_map(assembly_name).items()}
+    if options.transcript_index:
+        return TranscriptIndex.load(options.transcript_index), contig__accession
+    elif options.uta:
+        return TranscriptIndex.from_data_provider(
+            UtaSnapshot(options.uta), assembly_name=assembly_name, alt_aln_method='splign',
+            alt_acs=sorted(set(contig__accession.values()))), contig__accession
+    return None, contig__accession
+
+
+def _write_profile_report(profile_out: str, report: Dict[str, Any]):
+    if profile_out == '-':
+        json.dump(report, sys.stderr, indent=2)
+    else:
+        Path(profile_out).write_text(json.dumps(report, indent=2))
+
+
+def handle_annotate(in_vcf: Optional[Path], out: Optional[Path], max_workers: int, chunk_size: int, window: int,
+                     output_format: str, row_group_size: int, resume: bool, options: _AnnotateOptions,
+                     profile_out: Optional[str] = None, regions: Optional[List[Region]] = None,
+                     by_contig: bool = False, schedule: str = 'fixed', cost_model: Optional[Path] = None):
+    started = time.perf_counter()
+    PROFILE.enabled = options.profile
+    checkpoint_path = Checkpoint.path_for(out) if resume else None
+    checkpoint = Checkpoint.load(checkpoint_path) if resume else None
+    regions_key = ','.join(map(str, regions)) if regions else None
+    if checkpoint:
+        if (checkpoint.vcf, checkpoint.output_format, checkpoint.regions) != (
+                str(in_vcf or '-'), output_format, regions_key):
+            raise ValueError(f'checkpoint {checkpoint_path} belongs to another run: {checkpoint}')
+        checkpoint.check_output(out)
+        # drop whatever was written after the last completed chunk
+        with out.open('r+b') as out_io:
+            out_io.truncate(checkpoint.out_bytes)
+        logging.info(f'resuming after {checkpoint.records} records')
+    n_records = n_records_skipped = checkpoint.records if checkpoint else 0
+
+    model, shard_features = None, {}
+    if schedule == 'guided':
+        if not in_vcf or regions:
+            raise ValueError('guided scheduling applies to whole vcf files only')
+        if vcf_compression(in_vcf) == 'gzip':
+            raise ValueError('guided scheduling requires an uncompressed or bgzipped vcf - please bgzip it')
+        header = read_vcf_header(in_vcf)
+        model = CostModel.load(cost_model) if cost_model and cost_model.exists() else CostModel()
+        with PROFILE.stage('schedule.scan'):
+            records = RecordFeatures.scan(in_vcf, *_transcript_probe(options, assembly_from_header(header)), n_records)
+        logging.info(f'estimated cost of {len(records)} records: {model.cost(records.features.sum(axis=0)):.1f}s')
+
+        def guided() -> Iterator[VcfShard]:
+            for vcf_shard, features in guided_shards(records, model, max_workers, chunk_size, by_contig=by_contig):
+                shard_features[vcf_shard] = features
+                yield vcf_shard
+
+        vcf_shards = guided()
+    elif regions:
+        header, vcf_shards = read_vcf_header(in_vcf), shard_vcf_regions(in_vcf, regions, chunk_size, n_records)
+    elif in_vcf:
+        header, vcf_shards = read_vcf_header(in_vcf), shard_vcf(in_vcf, chunk_size, n_records, by_contig=by_contig)
+    else:
+        header, vcf_shards = shard_vcf_stream(sys.stdin.buffer, chunk_size, n_records, by_contig=by_contig)
+    pool = _worker_pool(max_workers, assembly_from_header(header), options)
+    profiled_workers = options.profile and options.mode != 'threads'
+    chunk_seconds = []
+    with pool, _open_annotation_writer(out, output_format, row_group_size, header, append=bool(checkpoint)) as writer:
+        # chunks are written in order as soon as they complete, with at most `window` of them held in memory
+        for vcf_shard, (annotations, seconds, worker_profile) in imap_ordered(
+                pool, partial(_annotate_vcf_task, options=options, profiled=profiled_workers), vcf_shards,
+                window or 2 * max_workers):
+            chunk_seconds.append(seconds)
+            if worker_profile:
+                PROFILE.merge(worker_profile)
+            if model:
+                model.observe(shard_features.pop(vcf_shard), seconds)
+            with PROFILE.stage('output.write'):
+                if isinstance(writer, VcfAnnotationWriter):
+                    writer.write(vcf_shard.read_records(), annotations)
+                else:
+                    writer.write(annotations)
+            n_records += vcf_shard.n_records
+            if resume:
+                writer.flush()
+                Checkpoint(vcf=str(in_vcf or '-'), output_format=output_format, records=n_records,
+                           out_bytes=out.stat().st_size, regions=regions_key).save(checkpoint_path)
+    if resume:
+        # the output is complete
+        checkpoint_path.unlink()
+    if chunk_seconds:
+        logging.info(f'{len(chunk_seconds)} chunks, {sum(chunk_seconds) / len(chunk_seconds):.3f}s on average, '
+                     f'{max(chunk_seconds):.3f}s at most')
+    if model:
+        logging.info(f'cost model: {dict(zip(FEATURES, model.weights.round(6).tolist()))}')
+        if cost_model:
+            model.save(cost_model)
+    if options.cache:
+        logging.info(f'annotation cache totals: {options.cache.stats()}')
+    if options.profile:
+        _write_profile_report(profile_out, {
+            'records': n_records - n_records_skipped,
+            'workers': max_workers,
+            'chunk_size': chunk_size,
+            'wall_s': round(time.perf_counter() - started, 6),
+            'chunks': {
+                'count': len(chunk_seconds),
+                'mean_s': round(sum(chunk_seconds) / len(chunk_seconds), 6) if chunk_seconds else 0.0,
+                'max_s': round(max(chunk_seconds, default=0.0), 6)},
+            'stages': PROFILE.report(),
+            'counters': dict(sorted(PROFILE.counters.items()))})
+
+
+# output file suffix by format
+_FORMAT__SUFFIX: Dict[str, str] = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow', 'vcf': '.vcf.gz'}
+# number of records joined with their annotations at a time
+_JOIN_CHUNK_SIZE = 10000
+
+
+def handle_annotate_cohort(in_vcfs: List[Path], out_dir: Path, max_workers: int, chunk_size: int, window: int,
+                            output_format: str, row_group_size: int, options: _AnnotateOptions):
+    outs = output_paths(in_vcfs, out_dir, _FORMAT__SUFFIX[output_format])
+    assemblies = {assembly_from_vcf(in_vcf) for in_vcf in in_vcfs}
+    if len(assemblies) != 1:
+        raise ValueError(f'the vcfs of a cohort must share their reference assembly: {assemblies}')
+    cohort = CohortVariants.from_vcfs(in_vcfs)
+    alleles = cohort.alleles
+    logging.info(f'{cohort.n_records} records of {len(in_vcfs)} vcfs: {len(cohort.loci)} distinct loci, '
+                 f'{len(alleles)} distinct alleles')
+
+    window = window or 2 * max_workers
+    with _worker_pool(max_workers, assemblies.pop(), options) as pool:
+        hgvs_anns: Dict[SimpleVariant, HgvsVariantAnnotation] = {}
+        for variants, anns in imap_ordered(
+                pool, partial(_annotate_alleles, options=options), chunked(alleles, chunk_size), window):
+            hgvs_anns.update(zip(variants, anns))
+        most_deleterious = most_deleterious_alleles(cohort.loci, hgvs_anns)
+        exac_alleles = list(dict.fromkeys(allele_key(variant) for variant in most_deleterious.values()))
+        logging.info(f'{len(exac_alleles)} distinct most deleterious alleles')
+        exac_anns: Dict[SimpleVariant, ExacVariantAnnotation] = {}
+        for variants, anns in imap_ordered(
+                pool, partial(_annotate_alleles_exac, options=options), chunked(exac_alleles, chunk_size), window):
+            exac_anns.update(zip(variants, anns))
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for in_vcf, out in zip(in_vcfs, outs):
+        with _open_annotation_writer(out, output_format, row_group_size, read_vcf_header(in_vcf)) as writer:
+            for vcf_shard in shard_vcf(in_vcf, _JOIN_CHUNK_SIZE):
+                annotations = join_annotations(vcf_shard, most_deleterious, hgvs_anns, exac_anns)
+                with PROFILE.stage('output.write'):
+                    if isinstance(writer, VcfAnnotationWriter):
+                        writer.write(vcf_shard.read_records(), annotations)
+                    else:
+                        writer.write(annotations)
+        logging.info(f'annotated {in_vcf} to {out}')
+    if options.cache:
+        logging.info(f'annotation cache totals: {options.cache.stats()}')
+
+
+def handle_index_transcripts(out_npz: Path, in_vcf: Optional[Path], uta_snapshot: Optional[Path]):
+    hgvs_machinery = HgvsMachinery.from_assembly(
+        assembly_from_vcf(in_vcf) if in_vcf else Assembly.GRCH37,
+        data_provider=UtaSnapshot(uta_snapshot) if uta_snapshot else None)
+    hgvs_machinery = hgvs_machinery.preload_transcripts(contigs_from_vcf(in_vcf) if in_vcf else None)
+    hgvs_machinery.transcript_index.save(out_npz)
+
+
+def handle_export_uta(out_sqlite: Path, in_vcf: Optional[Path], genes: Optional[str]):
+    if genes and Path(genes).is_file():
+        genes = [line.strip() for line in Path(genes).read_text().splitlines() if line.strip()]
+    elif genes:
+        genes = [gene.strip() for gene in genes.split(',') if gene.strip()]
+    export_uta_snapshot(
+        uta.connect(), out_sqlite,
+        assembly_name=ASSEMBLY__HGVS_ASSEMBLY_NAME[assembly_from_vcf(in_vcf) if in_vcf else Assembly.GRCH37],
+        contigs=contigs_from_vcf(in_vcf) if in_vcf else None, genes=genes or None)
+
+
+def annotate_options(args: Dict[str, Any]) -> _AnnotateOptions:
+    return _AnnotateOptions(
+        mode=args['--mode'],
+        exac_batch_size=int(args['--exac-batch-size']),
+        exac_sites=Path(args['--exac-sites']) if args['--exac-sites'] else None,
+        exac_concurrency=int(args['--exac-concurrency']),
+        exac_rate_limit=float(args['--exac-rate-limit']) or None,
+        cache=AnnotationCache(Path(args['--cache']), int(args['--cache-size'])) if args['--cache'] else None,
+        transcript_index=Path(args['--transcript-index']) if args['--transcript-index'] else None,
+        previous=Path(args['--previous']) if args['--previous'] else None,
+        fixtures=Path(args['--fixtures']) if args['--fixtures'] else None,
+        record=args['--record'],
+        profile=bool(args['--profile']),
+        reference=Path(args['--reference']) if args['--reference'] else None,
+        uta=Path(args['--uta']) if args['--uta'] else None,
+        start_method=args['--start-method'])
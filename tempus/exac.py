@@ -1,14 +1,26 @@
 """
-ExAC-based annotation functions - using the non-bulk REST API.
+ExAC-based annotation functions - using the single-variant and the bulk REST APIs.
 """
-from dataclasses import dataclass
-from typing import Optional, List
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional, List, Callable, Sequence, Dict, Any, Iterable, Iterator
 
 import requests
+from more_itertools import chunked
 
 from tempus import SimpleVariant
+from tempus.profiling import PROFILE
 
-API_BASE_URL = 'http://exac.hms.harvard.edu/rest/'
+API_BASE_URL = 'http://exac.hms.harvard.edu/rest'
+
+
+def exac_variant_id(variant: SimpleVariant) -> str:
+    """
+    :param variant: simple variant.
+    :return: ExAC variant identifier (chrom-pos-ref-alt).
+    """
+    return f'{variant.contig}-{variant.pos}-{variant.ref}-{variant.alt}'
 
 
 @dataclass(frozen=True)
@@ -16,6 +28,16 @@ class ExacVariantAnnotation:
     allele_frequency: Optional[float]
     consequences: List[str]
 
+    @classmethod
+    def from_variant_data(cls, data: Dict[str, Any]) -> 'ExacVariantAnnotation':
+        """
+        :param data: variant document as served by the ExAC REST API.
+        :return: variant annotation
+        """
+        return cls(
+            allele_frequency=(data.get('variant') or {}).get('allele_freq'),
+            consequences=list((data.get('consequence') or {}).keys()))
+
     @classmethod
     def from_simple_variant(cls, variant: SimpleVariant) -> 'ExacVariantAnnotation':
         """
@@ -24,11 +46,67 @@ class ExacVariantAnnotation:
         :param variant: 5p-normalized (left shuffled) simple variant. [base coordinate system]
         :return: variant annotation
         """
-        var = f'{variant.contig}-{variant.pos}-{variant.ref}-{variant.alt}'
-        response = requests.get(url=f'{API_BASE_URL}/variant/{var}')
-        response.raise_for_status()
+        with PROFILE.stage('exac.request'):
+            response = requests.get(url=f'{API_BASE_URL}/variant/{exac_variant_id(variant)}')
+            response.raise_for_status()
+        return cls.from_variant_data(response.json())
+
+
+ExacAnnotator = Callable[[Sequence[SimpleVariant]], List[ExacVariantAnnotation]]
+"""
+Annotates a batch of 5p-normalized simple variants, preserving order.
+"""
+
+
+def annotate_simple_variants(variants: Sequence[SimpleVariant]) -> List[ExacVariantAnnotation]:
+    """
+    Annotates variants one request at a time (non-bulk API).
+
+    :param variants: 5p-normalized simple variants.
+    :return: variant annotations in the order of variants.
+    """
+    return [ExacVariantAnnotation.from_simple_variant(variant) for variant in variants]
+
+
+@dataclass
+class ExacBulkClient:
+    """
+    Client for the ExAC bulk variant endpoint (``/rest/bulk/variant``).
+
+    Keeps a single keep-alive session and records the latency of every batch request.
+    """
+    api_base_url: str = API_BASE_URL
+    batch_size: int = 100
+    session: requests.Session = field(default_factory=requests.Session, repr=False)
+    batch_latencies: List[float] = field(default_factory=list, repr=False)
+
+    def annotate_batch(self, variants: Sequence[SimpleVariant]) -> List[ExacVariantAnnotation]:
+        """
+        Annotates variants using a single bulk request.
+
+        :param variants: 5p-normalized simple variants.
+        :return: variant annotations in the order of variants.
+        """
+        if not variants:
+            return []
+        var_ids = [exac_variant_id(variant) for variant in variants]
+        started = time.perf_counter()
+        # the endpoint expects a json list of unique variant ids and responds with a mapping keyed by them
+        with PROFILE.stage('exac.bulk_request'):
+            response = self.session.post(url=f'{self.api_base_url}/bulk/variant', json=list(dict.fromkeys(var_ids)))
+            response.raise_for_status()
         data = response.json()
+        latency = time.perf_counter() - started
+        self.batch_latencies.append(latency)
+        logging.info(f'ExAC bulk request for {len(var_ids)} variants took {latency:.3f}s')
+        return [ExacVariantAnnotation.from_variant_data(data.get(var_id) or {}) for var_id in var_ids]
 
-        return cls(
-            allele_frequency=data.get('variant', {}).get('allele_freq'),
-            consequences=list((data.get('consequence') or {}).keys()))
+    def annotate(self, variants: Iterable[SimpleVariant]) -> Iterator[ExacVariantAnnotation]:
+        """
+        Annotates variants in batches of `batch_size`.
+
+        :param variants: 5p-normalized simple variants.
+        :return: variant annotations in the order of variants.
+        """
+        for batch in chunked(variants, self.batch_size):
+            yield from self.annotate_batch(batch)
@@ -0,0 +1,268 @@
+"""
+Offline ExAC-based annotation - a memory-mapped index built from a local ExAC/gnomAD sites VCF.
+
+The index directory holds a `meta.json` and, for each contig, sorted position arrays plus packed allele, allele
+frequency and consequence columns. Allele frequencies and consequences mirror what the ExAC REST API serves:
+
+    allele_frequency :: AC_Adj / AN_Adj (falls back onto AF when the adjusted counts are absent).
+    consequences :: distinct most severe consequences of the allele's VEP annotations, most severe first.
+"""
+import gzip
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, TextIO
+
+import numpy as np
+
+from tempus import SimpleVariant
+from tempus.exac import ExacVariantAnnotation
+
+INDEX_FORMAT_VERSION = 1
+
+# VEP consequences ordered by severity (as used by the ExAC browser)
+CSQ_ORDER: Tuple[str, ...] = (
+    'transcript_ablation', 'splice_acceptor_variant', 'splice_donor_variant', 'stop_gained', 'frameshift_variant',
+    'stop_lost', 'start_lost', 'initiator_codon_variant', 'transcript_amplification', 'inframe_insertion',
+    'inframe_deletion', 'missense_variant', 'protein_altering_variant', 'splice_region_variant',
+    'incomplete_terminal_codon_variant', 'stop_retained_variant', 'synonymous_variant', 'coding_sequence_variant',
+    'mature_miRNA_variant', '5_prime_UTR_variant', '3_prime_UTR_variant', 'non_coding_transcript_exon_variant',
+    'non_coding_exon_variant', 'intron_variant', 'NMD_transcript_variant', 'non_coding_transcript_variant',
+    'nc_transcript_variant', 'upstream_gene_variant', 'downstream_gene_variant', 'TFBS_ablation',
+    'TFBS_amplification', 'TF_binding_site_variant', 'regulatory_region_ablation', 'regulatory_region_amplification',
+    'feature_elongation', 'regulatory_region_variant', 'feature_truncation', 'intergenic_variant')
+
+_CSQ_RANK: Dict[str, int] = {csq: rank for rank, csq in enumerate(CSQ_ORDER)}
+
+
+def minimal_representation(pos: int, ref: str, alt: str) -> Tuple[int, str, str]:
+    """
+    Trims alleles of shared suffixes and prefixes, the same way the ExAC browser keys its variants.
+
+    :param pos: position of the first ref base.
+    :param ref: reference allele.
+    :param alt: alternate allele.
+    :return: minimal (pos, ref, alt).
+    """
+    while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+        ref, alt = ref[:-1], alt[:-1]
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref, alt, pos = ref[1:], alt[1:], pos + 1
+    return pos, ref, alt
+
+
+def worst_consequence(consequence: str) -> str:
+    """
+    :param consequence: '&'-delimited VEP consequence terms.
+    :return: the most severe term.
+    """
+    return min(consequence.split('&'), key=lambda csq: _CSQ_RANK.get(csq, len(CSQ_ORDER)))
+
+
+def _open_text(path: Path) -> TextIO:
+    with path.open('rb') as raw_io:
+        is_gzip = raw_io.read(2) == b'\x1f\x8b'
+    return gzip.open(str(path), 'rt') if is_gzip else path.open()
+
+
+def _csq_fields(header_line: str) -> List[str]:
+    return header_line.split('Format: ', 1)[1].split('"', 1)[0].split('|')
+
+
+def _parse_info(info: str) -> Dict[str, str]:
+    return dict(item.split('=', 1) if '=' in item else (item, '') for item in info.split(';'))
+
+
+def _allele_frequencies(info: Dict[str, str], n_alts: int) -> List[Optional[float]]:
+    if 'AC_Adj' in info and 'AN_Adj' in info:
+        allele_num = int(info['AN_Adj'])
+        return [int(ac) / allele_num if allele_num else None for ac in info['AC_Adj'].split(',')]
+    if 'AF' in info:
+        return [None if af == '.' else float(af) for af in info['AF'].split(',')]
+    return [None] * n_alts
+
+
+def _allele_consequences(info: Dict[str, str], csq_fields: List[str], n_alts: int) -> List[List[str]]:
+    consequences: List[set] = [set() for _ in range(n_alts)]
+    if csq_fields and info.get('CSQ'):
+        allele_num_idx = csq_fields.index('ALLELE_NUM') if 'ALLELE_NUM' in csq_fields else None
+        csq_idx = csq_fields.index('Consequence')
+        for annotation in info['CSQ'].split(','):
+            values = annotation.split('|')
+            allele_idx = int(values[allele_num_idx]) - 1 if allele_num_idx is not None else 0
+            if 0 <= allele_idx < n_alts and values[csq_idx]:
+                consequences[allele_idx].add(worst_consequence(values[csq_idx]))
+    return [sorted(csqs, key=lambda csq: _CSQ_RANK.get(csq, len(CSQ_ORDER))) for csqs in consequences]
+
+
+@dataclass
+class _ContigColumns:
+    pos: List[int] = field(default_factory=list)
+    allele_frequency: List[float] = field(default_factory=list)
+    alleles: List[bytes] = field(default_factory=list)
+    consequences: List[bytes] = field(default_factory=list)
+
+    def save(self, index_dir: Path, contig: str):
+        order = np.argsort(np.asarray(self.pos, dtype=np.int64), kind='stable')
+        alleles = [self.alleles[idx] for idx in order]
+        consequences = [self.consequences[idx] for idx in order]
+        np.save(index_dir / f'{contig}.pos.npy', np.asarray(self.pos, dtype=np.int32)[order])
+        np.save(index_dir / f'{contig}.af.npy', np.asarray(self.allele_frequency, dtype=np.float64)[order])
+        np.save(index_dir / f'{contig}.allele_offsets.npy', _offsets(alleles))
+        np.save(index_dir / f'{contig}.alleles.npy', np.frombuffer(b''.join(alleles), dtype=np.uint8))
+        np.save(index_dir / f'{contig}.csq_offsets.npy', _offsets(consequences))
+        np.save(index_dir / f'{contig}.csq.npy', np.frombuffer(b''.join(consequences), dtype=np.uint8))
+
+
+def _offsets(values: List[bytes]) -> np.ndarray:
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    return offsets
+
+
+def _allele_key(ref: str, alt: str) -> bytes:
+    return f'{ref}\t{alt}'.encode()
+
+
+@dataclass(frozen=True)
+class _ContigIndex:
+    pos: np.ndarray
+    allele_frequency: np.ndarray
+    allele_offsets: np.ndarray
+    alleles: np.ndarray
+    csq_offsets: np.ndarray
+    csq: np.ndarray
+
+    @classmethod
+    def load(cls, index_dir: Path, contig: str) -> '_ContigIndex':
+        def load(column: str) -> np.ndarray:
+            return np.load(index_dir / f'{contig}.{column}.npy', mmap_mode='r')
+
+        return cls(
+            pos=load('pos'), allele_frequency=load('af'), allele_offsets=load('allele_offsets'),
+            alleles=load('alleles'), csq_offsets=load('csq_offsets'), csq=load('csq'))
+
+    def find(self, pos: int, ref: str, alt: str) -> Optional[int]:
+        key = _allele_key(ref, alt)
+        for idx in range(np.searchsorted(self.pos, pos, 'left'), np.searchsorted(self.pos, pos, 'right')):
+            if self.alleles[self.allele_offsets[idx]:self.allele_offsets[idx + 1]].tobytes() == key:
+                return idx
+        return None
+
+
+@dataclass
+class ExacSitesIndex:
+    """
+    Memory-mapped, offline stand-in for the ExAC REST API.
+    """
+    index_dir: Path
+    meta: Dict = field(repr=False)
+    _contigs: Dict[str, Optional[_ContigIndex]] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def open(cls, index_dir: Path) -> 'ExacSitesIndex':
+        """
+        :param index_dir: directory of an index built by `ExacSitesIndex.build`.
+        :return: index.
+        """
+        with (index_dir / 'meta.json').open() as meta_io:
+            meta = json.load(meta_io)
+        if meta['format_version'] != INDEX_FORMAT_VERSION:
+            raise ValueError(f'unsupported sites index format {meta["format_version"]} in {index_dir}')
+        return cls(index_dir=index_dir, meta=meta)
+
+    @classmethod
+    def build(cls, sites_vcf: Path, index_dir: Path) -> 'ExacSitesIndex':
+        """
+        Reads a (gzipped) ExAC/gnomAD sites VCF once and writes its index.
+
+        :param sites_vcf: sites vcf, sorted by contig.
+        :param index_dir: output directory.
+        :return: index.
+        """
+        index_dir.mkdir(parents=True, exist_ok=True)
+        csq_terms: Dict[str, int] = {}
+        csq_fields: List[str] = []
+        contigs: List[str] = []
+        columns: Optional[_ContigColumns] = None
+        n_alleles = 0
+        with _open_text(sites_vcf) as sites_io:
+            for line in sites_io:
+                if line.startswith('##INFO=<ID=CSQ,'):
+                    csq_fields = _csq_fields(line)
+                if line.startswith('#'):
+                    continue
+                contig, pos, _, ref, alts, _, _, info = line.rstrip('\n').split('\t', 8)[:8]
+                if not contigs or contigs[-1] != contig:
+                    if contig in contigs:
+                        raise ValueError(f'sites vcf {sites_vcf} is not sorted by contig ({contig})')
+                    if columns is not None:
+                        columns.save(index_dir, contigs[-1])
+                    contigs.append(contig)
+                    columns = _ContigColumns()
+                alts = alts.split(',')
+                info = _parse_info(info)
+                allele_frequencies = _allele_frequencies(info, len(alts))
+                allele_consequences = _allele_consequences(info, csq_fields, len(alts))
+                for alt, allele_frequency, consequences in zip(alts, allele_frequencies, allele_consequences):
+                    if alt == '*':
+                        continue
+                    min_pos, min_ref, min_alt = minimal_representation(int(pos), ref, alt)
+                    columns.pos.append(min_pos)
+                    columns.allele_frequency.append(np.nan if allele_frequency is None else allele_frequency)
+                    columns.alleles.append(_allele_key(min_ref, min_alt))
+                    columns.consequences.append(
+                        bytes(csq_terms.setdefault(csq, len(csq_terms)) for csq in consequences))
+                    n_alleles += 1
+        if columns is not None:
+            columns.save(index_dir, contigs[-1])
+
+        stat = sites_vcf.stat()
+        meta = {
+            'format_version': INDEX_FORMAT_VERSION,
+            'source': sites_vcf.name,
+            'source_size': stat.st_size,
+            'source_mtime': int(stat.st_mtime),
+            'contigs': contigs,
+            'consequence_terms': sorted(csq_terms, key=csq_terms.get),
+        }
+        with (index_dir / 'meta.json').open('w') as meta_io:
+            json.dump(meta, meta_io, indent=2)
+        logging.info(f'indexed {n_alleles} alleles on {len(contigs)} contigs from {sites_vcf}')
+        return cls(index_dir=index_dir, meta=meta)
+
+    @property
+    def data_version(self) -> str:
+        """
+        :return: identifies the sites data (e.g. within an annotation cache).
+        """
+        return f'sites:{self.meta["source"]}:{self.meta["source_size"]}:{self.meta["source_mtime"]}'
+
+    def _contig(self, contig: str) -> Optional[_ContigIndex]:
+        if contig not in self._contigs:
+            self._contigs[contig] = _ContigIndex.load(self.index_dir, contig) \
+                if contig in self.meta['contigs'] else None
+        return self._contigs[contig]
+
+    def annotate(self, variant: SimpleVariant) -> ExacVariantAnnotation:
+        """
+        :param variant: 5p-normalized (left shuffled) simple variant. [base coordinate system]
+        :return: variant annotation (empty if the variant is absent, same as the REST API).
+        """
+        contig = self._contig(variant.contig)
+        idx = contig.find(variant.pos, variant.ref, variant.alt) if contig is not None else None
+        if idx is None:
+            return ExacVariantAnnotation(allele_frequency=None, consequences=[])
+        allele_frequency = float(contig.allele_frequency[idx])
+        terms = self.meta['consequence_terms']
+        return ExacVariantAnnotation(
+            allele_frequency=None if np.isnan(allele_frequency) else allele_frequency,
+            consequences=[terms[code] for code in contig.csq[contig.csq_offsets[idx]:contig.csq_offsets[idx + 1]]])
+
+    def annotate_batch(self, variants: Sequence[SimpleVariant]) -> List[ExacVariantAnnotation]:
+        """
+        :param variants: 5p-normalized simple variants.
+        :return: variant annotations in the order of variants.
+        """
+        return [self.annotate(variant) for variant in variants]
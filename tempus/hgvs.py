@@ -1,21 +1,33 @@
 """
 Convenience functions for working with `biocommons/hgvs` package and HGVS-based annotation functions.
 """
+import json
 import logging
-from dataclasses import dataclass, field
-from typing import Dict, Optional
+from copy import copy
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Dict, Optional, Iterable, List, Set, Tuple
 
+import hgvs
+import numpy as np
 from bioutils.sequences import reverse_complement
 from hgvs.assemblymapper import AssemblyMapper
 from hgvs.dataproviders import uta
-from hgvs.edit import NARefAlt, Dup, Inv
-from hgvs.exceptions import HGVSError
-from hgvs.location import Interval, SimplePosition
+from hgvs.dataproviders.interface import Interface
+from hgvs.edit import NARefAlt, Dup, Inv, AARefAlt, AASub
+from hgvs.enums import Datum
+from hgvs.exceptions import HGVSError, HGVSInvalidVariantError
+from hgvs.location import Interval, SimplePosition, BaseOffsetPosition, BaseOffsetInterval, AAPosition
 from hgvs.normalizer import Normalizer
 from hgvs.posedit import PosEdit
 from hgvs.sequencevariant import SequenceVariant
+from hgvs.validator import SEQ_ERROR_MSG
 
 from tempus import Assembly, SimpleVariant, SequenceAlteration, FeatureVariant
+from tempus.prefetch import TranscriptPrefetcher
+from tempus.profiling import PROFILE
+from tempus.sequences import WindowedSequenceFetcher, open_local_sequences
+from tempus.snv import TranscriptModels, TranscriptModel, SnvConsequence, is_snv
 
 #
 # hgvs utility code
@@ -26,6 +38,114 @@ ASSEMBLY__HGVS_ASSEMBLY_NAME: Dict[Assembly, str] = {
 }
 
 
+_UTA_TX_SPANS_SQL = """
+    select tx_ac, min(start_i) as start_i, max(end_i) as end_i
+    from exon_set ES
+    join exon E on ES.exon_set_id=E.exon_set_id
+    where alt_ac=%s and alt_aln_method=%s
+    group by tx_ac, alt_ac, alt_strand, alt_aln_method
+    """
+
+
+@dataclass(frozen=True)
+class TranscriptIndex:
+    """
+    In-memory stand-in for `AssemblyMapper.relevant_transcripts`.
+
+    Holds the genomic spans of transcripts per contig accession as NumPy arrays sorted by start, along with the
+    longest span, which bounds the binary search for transcripts containing a given region.
+    """
+    assembly_name: str
+    alt_aln_method: str
+    starts: Dict[str, np.ndarray] = field(repr=False)
+    ends: Dict[str, np.ndarray] = field(repr=False)
+    tx_acs: Dict[str, np.ndarray] = field(repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, '_max_spans', {
+            alt_ac: int((self.ends[alt_ac] - starts).max()) if len(starts) else 0
+            for alt_ac, starts in self.starts.items()})
+
+    @classmethod
+    def from_data_provider(cls, hdp: Interface, assembly_name: str, alt_aln_method: str,
+                           alt_acs: Iterable[str]) -> 'TranscriptIndex':
+        """
+        Fetches transcript spans of given contigs from a UTA data provider - one query per contig (or from the
+        provider's own `get_tx_spans`, see `tempus.uta_snapshot.UtaSnapshot`).
+
+        :param hdp: UTA data provider.
+        :param assembly_name: assembly name.
+        :param alt_aln_method: alignment method.
+        :param alt_acs: contig accessions.
+        :return: transcript index.
+        """
+        starts, ends, tx_acs = {}, {}, {}
+        for alt_ac in alt_acs:
+            rows = hdp.get_tx_spans(alt_ac, alt_aln_method) if hasattr(hdp, 'get_tx_spans') else hdp._fetchall(
+                _UTA_TX_SPANS_SQL, [alt_ac, alt_aln_method])
+            rows = sorted(rows, key=lambda row: row['start_i'])
+            starts[alt_ac] = np.array([row['start_i'] for row in rows], dtype=np.int64)
+            ends[alt_ac] = np.array([row['end_i'] for row in rows], dtype=np.int64)
+            tx_acs[alt_ac] = np.array([row['tx_ac'] for row in rows], dtype=str)
+            logging.info(f'indexed {len(rows)} transcripts on {alt_ac}')
+        return cls(assembly_name=assembly_name, alt_aln_method=alt_aln_method, starts=starts, ends=ends, tx_acs=tx_acs)
+
+    @classmethod
+    def load(cls, path: Path) -> 'TranscriptIndex':
+        """
+        :param path: file written by `TranscriptIndex.save`.
+        :return: transcript index.
+        """
+        with np.load(str(path)) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            return cls(
+                assembly_name=meta['assembly_name'], alt_aln_method=meta['alt_aln_method'],
+                starts={alt_ac: arrays[f'{alt_ac}/starts'] for alt_ac in meta['alt_acs']},
+                ends={alt_ac: arrays[f'{alt_ac}/ends'] for alt_ac in meta['alt_acs']},
+                tx_acs={alt_ac: arrays[f'{alt_ac}/tx_acs'] for alt_ac in meta['alt_acs']})
+
+    def save(self, path: Path):
+        """
+        :param path: output (.npz) file.
+        """
+        meta = {
+            'assembly_name': self.assembly_name, 'alt_aln_method': self.alt_aln_method, 'alt_acs': list(self.starts)}
+        with path.open('wb') as out_io:
+            np.savez(out_io, meta=json.dumps(meta), **{
+                f'{alt_ac}/{column}': arrays[alt_ac]
+                for column, arrays in (('starts', self.starts), ('ends', self.ends), ('tx_acs', self.tx_acs))
+                for alt_ac in self.starts})
+
+    def __contains__(self, alt_ac: str) -> bool:
+        return alt_ac in self.starts
+
+    def relevant_transcripts(self, var_g: SequenceVariant) -> List[str]:
+        """
+        Same selection as `AssemblyMapper.relevant_transcripts` - transcripts whose span contains the variant.
+
+        :param var_g: genomic hgvs variant.
+        :return: transcript accessions.
+        """
+        start, end = var_g.posedit.pos.start.base, var_g.posedit.pos.end.base
+        starts, ends = self.starts[var_g.ac], self.ends[var_g.ac]
+        lo = np.searchsorted(starts, end - self._max_spans[var_g.ac], 'left')
+        hi = np.searchsorted(starts, start, 'left')
+        return self.tx_acs[var_g.ac][lo:hi][ends[lo:hi] >= end].tolist()
+
+    def count_coding_transcripts(self, alt_ac: str, positions: np.ndarray) -> np.ndarray:
+        """
+        :param alt_ac: contig accession.
+        :param positions: positions on the contig.
+        :return: number of coding transcripts whose span contains each position (0 for contigs not indexed).
+        """
+        if alt_ac not in self:
+            return np.zeros(len(positions), dtype=np.int64)
+        coding = np.array([is_transcript_coding(tx_ac) for tx_ac in self.tx_acs[alt_ac]], dtype=bool)
+        starts, ends = self.starts[alt_ac][coding], np.sort(self.ends[alt_ac][coding])
+        # spans started before a position, less those also ended before it
+        return np.searchsorted(starts, positions, 'left') - np.searchsorted(ends, positions, 'left')
+
+
 @dataclass(frozen=True)
 class HgvsMachinery:
     assembly_mapper: AssemblyMapper
@@ -33,18 +153,46 @@ class HgvsMachinery:
     normalizer_5p: Normalizer
     accession__contig: Dict[str, str] = field(repr=False)
     contig__accession: Dict[str, str] = field(repr=False)
+    data_version: str
+    transcript_index: Optional[TranscriptIndex] = field(default=None, repr=False)
+    transcript_models: Optional[TranscriptModels] = field(default=None, repr=False)
+    sequence_fetcher: Optional[WindowedSequenceFetcher] = field(default=None, repr=False)
+    prefetcher: Optional[TranscriptPrefetcher] = field(default=None, repr=False)
 
     @classmethod
-    def from_assembly(cls, assembly: Assembly, alt_aln_method: str = 'splign') -> 'HgvsMachinery':
+    def from_assembly(cls, assembly: Assembly, alt_aln_method: str = 'splign',
+                      transcript_index: Optional[TranscriptIndex] = None,
+                      data_provider: Optional[Interface] = None, snv_fast_path: bool = True,
+                      sequence_cache: bool = True, local_reference: Optional[Path] = None,
+                      prefetch: bool = True) -> 'HgvsMachinery':
         """
         Initializes `biocommons/hgvs` machinery with Universal Transcript Archive (UTA) data provider.
 
         :param alt_aln_method: alignment method (default 'splign').
         :param assembly: determines the assembly build.
+        :param transcript_index: optional preloaded transcript index (see `HgvsMachinery.preload_transcripts`).
+        :param data_provider: data provider to use instead of connecting to UTA (e.g. replaying recorded responses).
+        :param snv_fast_path: classify substitutions using local transcript models (see `tempus.snv`) where possible.
+        :param sequence_cache: serve reference sequence fetches from cached windows (see `tempus.sequences`).
+        :param local_reference: uncompressed FASTA file (named by accession or contig) or seqrepo directory to read the
+                                reference windows from, instead of the data provider's sequence fetcher.
+        :param prefetch: bulk load the data of the transcripts a chunk of variants overlaps (see `tempus.prefetch`),
+                         with a UTA database connection (rather than a snapshot or recorded responses).
         """
-        data_provider = uta.connect()
+        data_provider = data_provider or uta.connect()
         assembly_name = ASSEMBLY__HGVS_ASSEMBLY_NAME[assembly]
+        if transcript_index and (transcript_index.assembly_name, transcript_index.alt_aln_method) != (
+                assembly_name, alt_aln_method):
+            raise ValueError(f'transcript index does not match {assembly_name}/{alt_aln_method}: {transcript_index}')
         accession__contig = data_provider.get_assembly_map(assembly_name=assembly_name)
+        sequence_fetcher = None
+        if sequence_cache and hasattr(data_provider, 'seqfetcher'):
+            sequence_fetcher = WindowedSequenceFetcher(
+                fetcher=data_provider.seqfetcher,
+                local=open_local_sequences(local_reference, aliases=accession__contig) if local_reference else None)
+            data_provider.seqfetcher = sequence_fetcher
+        elif local_reference:
+            raise ValueError(f'local reference requires a data provider with a sequence fetcher: {data_provider}')
         return cls(
             assembly_mapper=AssemblyMapper(
                 hdp=data_provider, assembly_name=assembly_name, alt_aln_method=alt_aln_method, add_gene_symbol=False,
@@ -52,7 +200,74 @@ class HgvsMachinery:
             normalizer_3p=Normalizer(hdp=data_provider, shuffle_direction=3),
             normalizer_5p=Normalizer(hdp=data_provider, shuffle_direction=5),
             accession__contig=accession__contig,
-            contig__accession={contig: acc for acc, contig in accession__contig.items()})
+            contig__accession={contig: acc for acc, contig in accession__contig.items()},
+            data_version=f'{assembly_name}:{alt_aln_method}:hgvs-{hgvs.__version__}:{data_provider.data_version()}',
+            transcript_index=transcript_index,
+            transcript_models=TranscriptModels(data_provider, alt_aln_method) if snv_fast_path else None,
+            sequence_fetcher=sequence_fetcher,
+            prefetcher=TranscriptPrefetcher(data_provider, alt_aln_method) if prefetch and isinstance(
+                data_provider, uta.UTABase) and data_provider.mode is None else None)
+
+    @property
+    def snv_fast_path(self) -> bool:
+        return self.transcript_models is not None
+
+    def preload_transcripts(self, contigs: Optional[Iterable[str]] = None) -> 'HgvsMachinery':
+        """
+        :param contigs: contigs to preload transcripts for (defaults to all contigs of the assembly).
+        :return: machinery answering `relevant_transcripts` from an in-memory transcript index.
+        """
+        alt_acs = self.accession__contig if contigs is None else (
+            self.contig__accession[contig] for contig in contigs if contig in self.contig__accession)
+        return replace(self, transcript_index=TranscriptIndex.from_data_provider(
+            hdp=self.assembly_mapper.hdp, assembly_name=self.assembly_mapper.assembly_name,
+            alt_aln_method=self.assembly_mapper.alt_aln_method, alt_acs=alt_acs))
+
+    def relevant_transcripts(self, hgvs_g: SequenceVariant) -> List[str]:
+        """
+        :param hgvs_g: genomic hgvs variant.
+        :return: accessions of transcripts overlapping the variant.
+        """
+        if self.transcript_index is not None and hgvs_g.ac in self.transcript_index:
+            return self.transcript_index.relevant_transcripts(hgvs_g)
+        return self.assembly_mapper.relevant_transcripts(hgvs_g)
+
+    def prefetch_transcripts(self, variants: Iterable[SimpleVariant]):
+        """
+        Bulk loads the data of the transcripts overlapping a chunk of variants, which their annotation then reads from
+        memory (a no-op without a prefetcher).
+
+        :param variants: simple variants about to be annotated.
+        """
+        if self.prefetcher is None:
+            return
+        alt_ac__tx_acs: Dict[str, Set[str]] = {}
+        for variant in variants:
+            if variant.contig not in self.contig__accession:
+                continue
+            # transcripts of the variant as is, which 3'-normalization rarely changes (the rest is queried as usual)
+            hgvs_g = self.hgvs_from_simple_variant(variant, vtype='g')
+            try:
+                alt_ac__tx_acs.setdefault(hgvs_g.ac, set()).update(self.relevant_transcripts(hgvs_g))
+            except HGVSError:
+                continue
+        for alt_ac, tx_acs in alt_ac__tx_acs.items():
+            self.prefetcher.prefetch(alt_ac, tx_acs, coding_tx_acs=filter(is_transcript_coding, tx_acs))
+
+    def validate_reference(self, hgvs_g: SequenceVariant):
+        """
+        Checks the reference bases of a variant against the reference sequence (served from the cached windows, if
+        any) - for substitutions, which skip normalization.
+
+        :param hgvs_g: genomic hgvs variant.
+        :raises HGVSInvalidVariantError: if they disagree.
+        """
+        fetch_seq = self.sequence_fetcher.fetch_seq if self.sequence_fetcher else self.assembly_mapper.hdp.get_seq
+        pos, var_ref_seq = hgvs_g.posedit.pos, hgvs_g.posedit.edit.ref
+        ref_seq = fetch_seq(hgvs_g.ac, pos.start.base - 1, pos.end.base)
+        if var_ref_seq and ref_seq.upper() != var_ref_seq.upper():
+            raise HGVSInvalidVariantError(
+                f'{hgvs_g}: {SEQ_ERROR_MSG.format(ref_seq=ref_seq, var_ref_seq=var_ref_seq)}')
 
     def hgvs_from_simple_variant(self, variant: SimpleVariant, vtype: str) -> SequenceVariant:
         """
@@ -148,6 +363,30 @@ def feature_variant_from_hgvs_p(hgvs_p: SequenceVariant, hgvs_c: SequenceVariant
         FeatureVariant.MISSENSE if hgvs_c.posedit.length_change() % 3 == 0 else FeatureVariant.FRAMESHIFT)
 
 
+def hgvs_from_snv_consequence(model: TranscriptModel, consequence: SnvConsequence) \
+        -> Tuple[SequenceVariant, SequenceVariant]:
+    """
+    :param model: transcript model.
+    :param consequence: SNV consequence on the transcript.
+    :return: hgvs.c and hgvs.p variants, as `hgvs` g_to_c and c_to_p would map the SNV.
+    """
+    pos_c = BaseOffsetPosition(base=consequence.c_pos, datum=Datum.CDS_START)
+    hgvs_c = SequenceVariant(
+        ac=model.tx_ac, type='c',
+        posedit=PosEdit(
+            pos=BaseOffsetInterval(start=pos_c, end=copy(pos_c)),
+            edit=NARefAlt(ref=consequence.ref, alt=consequence.alt)))
+    pos_p = AAPosition(base=consequence.aa_pos, aa=consequence.ref_aa)
+    hgvs_p = SequenceVariant(
+        ac=model.pro_ac, type='p',
+        posedit=PosEdit(
+            pos=Interval(start=pos_p, end=pos_p),
+            edit=AARefAlt(ref='', alt='') if consequence.ref_aa == consequence.alt_aa else AASub(
+                ref='', alt=consequence.alt_aa),
+            uncertain=hgvs.global_config.mapping.inferred_p_is_uncertain))
+    return hgvs_c, hgvs_p
+
+
 @dataclass(frozen=True)
 class HgvsTranscriptAnnotation:
     hgvs_c: Optional[SequenceVariant]
@@ -172,32 +411,57 @@ class HgvsVariantAnnotation(HgvsTranscriptAnnotation):
         :return: variant annotation from HGVS.
         """
 
+        def annotate_snv_transcript(tx_ac: str) -> Optional[HgvsTranscriptAnnotation]:
+            model = hgvs_machinery.transcript_models.get(tx_ac, hgvs_g.ac)
+            consequence = model.snv_consequence(variant.pos, variant.ref, variant.alt) if model else None
+            if consequence is None:
+                return None
+            hgvs_c, hgvs_p = hgvs_from_snv_consequence(model, consequence)
+            return HgvsTranscriptAnnotation(hgvs_c, hgvs_p, feature_variant_from_hgvs_p(hgvs_p, hgvs_c))
+
         def annotate_transcript(tx_ac: str) -> HgvsTranscriptAnnotation:
+            if snv:
+                with PROFILE.stage('hgvs.snv_fast_path'):
+                    tx_ann = annotate_snv_transcript(tx_ac)
+                if tx_ann:
+                    return tx_ann
             hgvs_c: Optional[SequenceVariant] = None
             hgvs_p: Optional[SequenceVariant] = None
             feature_variant: Optional[FeatureVariant] = None
             try:
-                hgvs_c = hgvs_machinery.assembly_mapper.g_to_c(hgvs_g, tx_ac)
+                with PROFILE.stage('hgvs.g_to_c'):
+                    hgvs_c = hgvs_machinery.assembly_mapper.g_to_c(hgvs_g, tx_ac)
             except HGVSError:
                 pass
             else:
                 feature_variant = feature_variant_from_hgvs_c(hgvs_c)
                 try:
-                    hgvs_p = hgvs_machinery.assembly_mapper.c_to_p(hgvs_c)
+                    with PROFILE.stage('hgvs.c_to_p'):
+                        hgvs_p = hgvs_machinery.assembly_mapper.c_to_p(hgvs_c)
                 except HGVSError:
                     pass
                 else:
                     feature_variant = feature_variant_from_hgvs_p(hgvs_p, hgvs_c)
             return HgvsTranscriptAnnotation(hgvs_c, hgvs_p, feature_variant)
 
-        # start by creating a 3'-normalized hgvs.g
-        hgvs_g = hgvs_machinery.normalizer_3p.normalize(hgvs_machinery.hgvs_from_simple_variant(variant, vtype='g'))
+        snv = hgvs_machinery.snv_fast_path and is_snv(variant.ref, variant.alt)
+
+        # start by creating a 3'-normalized hgvs.g (substitutions cannot shuffle, only their reference is validated)
+        hgvs_g = hgvs_machinery.hgvs_from_simple_variant(variant, vtype='g')
+        if snv:
+            with PROFILE.stage('hgvs.validate_reference'):
+                hgvs_machinery.validate_reference(hgvs_g)
+        else:
+            with PROFILE.stage('hgvs.normalize_3p'):
+                hgvs_g = hgvs_machinery.normalizer_3p.normalize(hgvs_g)
 
         # fetch overlapping transcripts
-        txs_all = hgvs_machinery.assembly_mapper.relevant_transcripts(hgvs_g)
+        with PROFILE.stage('hgvs.relevant_transcripts'):
+            txs_all = hgvs_machinery.relevant_transcripts(hgvs_g)
 
         # determine gene
-        gene: Optional[str] = hgvs_machinery.gene_from_transcripts(*txs_all)
+        with PROFILE.stage('hgvs.gene_from_transcripts'):
+            gene: Optional[str] = hgvs_machinery.gene_from_transcripts(*txs_all)
 
         # annotate coding transcripts (hgvs_g -> hgvs_c -> hgvs_p)
         tx_anns = tuple(annotate_transcript(tx_ac) for tx_ac in txs_all if is_transcript_coding(tx_ac))
@@ -0,0 +1,55 @@
+"""
+Scheduling utilities for parallel annotation.
+"""
+import multiprocessing
+import multiprocessing.forkserver
+from collections import deque
+from concurrent.futures import Executor, Future
+from itertools import islice
+from multiprocessing.context import BaseContext
+from typing import Callable, Deque, Iterable, Iterator, Tuple, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# modules imported by the forkserver once, and inherited by every worker forked from it
+FORKSERVER_PRELOAD: Tuple[str, ...] = ('tempus.commands',)
+
+
+def imap_ordered(executor: Executor, fn: Callable[[T], R], items: Iterable[T], window: int) -> Iterator[Tuple[T, R]]:
+    """
+    Like `Executor.map`, but consumes `items` lazily and keeps at most `window` tasks in flight.
+
+    Results are yielded in the order of `items` as soon as they (and all their predecessors) complete, hence memory use
+    is bounded by the window rather than by the number of items.
+
+    :param executor: executor.
+    :param fn: task function.
+    :param items: task arguments.
+    :param window: max number of submitted tasks whose results have not been yielded yet.
+    :return: items paired with their task results, in the order of items.
+    """
+    items = iter(items)
+    pending: Deque[Tuple[T, Future]] = deque((item, executor.submit(fn, item)) for item in islice(items, window))
+    while pending:
+        item, future = pending.popleft()
+        result = future.result()
+        # top up the window before handing over the result
+        pending.extend((item, executor.submit(fn, item)) for item in islice(items, 1))
+        yield item, result
+
+
+def forkserver_context(start: bool = False) -> BaseContext:
+    """
+    Workers forked from a server process which imported (and configured) hgvs and the rest once - rather than spawned
+    and importing everything anew each, or forked from a main process which may be running threads by then.
+
+    :param start: start the server right away, so that it imports `FORKSERVER_PRELOAD` in the background (e.g. while
+        the main process does the same), rather than along with the first worker.
+    :return: multiprocessing context.
+    """
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(list(FORKSERVER_PRELOAD))
+    if start:
+        multiprocessing.forkserver.ensure_running()
+    return context
@@ -0,0 +1,144 @@
+"""
+Bulk prefetch of transcript data from the UTA database - per chunk of variants rather than per variant.
+
+Annotating a variant asks the data provider for the identity info of every overlapping transcript (gene), and for the
+info, exon alignments, protein accession and sequence of every overlapping coding transcript (g_to_c, c_to_p and the
+SNV fast path) - one UTA round trip each. Neighbouring variants overlap the same transcripts, so a chunk of variants
+needs few distinct transcripts. `TranscriptPrefetcher.prefetch` loads the data of all of them with one query per
+table (`any(%s)`) into a bounded LRU, which the provider's own methods then answer from. Anything not prefetched (or
+evicted meanwhile) is still queried one at a time, with the provider's own results and errors.
+"""
+from collections import OrderedDict
+from itertools import groupby
+from typing import Any, Callable, Hashable, Iterable, Optional, Tuple
+
+from tempus.profiling import PROFILE
+
+# same selections as the queries of `hgvs.dataproviders.uta.UTABase`, for many transcripts at once
+_TX_IDENTITY_INFO_SQL = """
+    select distinct(tx_ac), alt_ac, alt_aln_method, cds_start_i, cds_end_i, lengths, hgnc
+    from tx_def_summary_v
+    where tx_ac=any(%s)
+    """
+_TX_INFO_SQL = """
+    select hgnc, cds_start_i, cds_end_i, tx_ac, alt_ac, alt_aln_method
+    from transcript T
+    join exon_set ES on T.ac=ES.tx_ac
+    where tx_ac=any(%s) and alt_ac=%s and alt_aln_method=%s
+    order by tx_ac
+    """
+_TX_EXONS_SQL = """
+    select *
+    from tx_exon_aln_v
+    where tx_ac=any(%s) and alt_ac=%s and alt_aln_method=%s
+    order by tx_ac, alt_start_i
+    """
+_TX_TO_PRO_SQL = """
+    select tx_ac, pro_ac from associated_accessions where tx_ac=any(%s) order by tx_ac, pro_ac desc
+    """
+_TX_SEQ_SQL = """
+    select ac, seq from seq S join seq_anno SA on S.seq_id=SA.seq_id where ac=any(%s)
+    """
+
+# stands in for entries that were not prefetched (None is a valid protein accession)
+_MISSING = object()
+
+
+class TranscriptPrefetcher:
+    """
+    Per-process (per-thread in threads mode) LRU cache of transcript data, filled by bulk queries and serving the
+    `get_tx_identity_info`, `get_tx_info`, `get_tx_exons`, `get_pro_ac_for_tx_ac` and `get_seq` methods of a UTA data
+    provider (which it wraps on construction).
+    """
+
+    def __init__(self, hdp: Any, alt_aln_method: str, maxsize: int = 20_000):
+        """
+        :param hdp: UTA (Postgres) data provider, connected to the database.
+        :param alt_aln_method: alignment method.
+        :param maxsize: max number of cached entries (an entry per transcript and method).
+        """
+        self.hdp = hdp
+        self.alt_aln_method = alt_aln_method
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[Tuple[str, Hashable], Any]' = OrderedDict()
+        hdp.get_tx_identity_info = self._serve('tx_identity_info', hdp.get_tx_identity_info)
+        hdp.get_tx_info = self._serve('tx_info', hdp.get_tx_info)
+        hdp.get_tx_exons = self._serve('tx_exons', hdp.get_tx_exons)
+        hdp.get_pro_ac_for_tx_ac = self._serve('pro_ac', hdp.get_pro_ac_for_tx_ac)
+        get_seq = hdp.get_seq
+
+        def serve_seq(ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+            # genomic sequences are never prefetched, hence not counted as misses
+            seq = self._get('seq', ac, count_miss=False)
+            return get_seq(ac, start_i, end_i) if seq is _MISSING else seq[start_i:end_i]
+
+        hdp.get_seq = serve_seq
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, method: str, key: Hashable, count_miss: bool = True) -> Any:
+        value = self._entries.get((method, key), _MISSING)
+        if value is _MISSING:
+            if count_miss:
+                PROFILE.count('prefetch.misses')
+        else:
+            self._entries.move_to_end((method, key))
+            PROFILE.count('prefetch.hits')
+        return value
+
+    def _put(self, method: str, key: Hashable, value: Any):
+        self._entries[(method, key)] = value
+        self._entries.move_to_end((method, key))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _serve(self, method: str, query: Callable) -> Callable:
+        def serve(*args: Any, **kwargs: Any) -> Any:
+            value = self._get(method, args[0] if len(args) == 1 else args) if not kwargs else _MISSING
+            return query(*args, **kwargs) if value is _MISSING else value
+
+        return serve
+
+    def __contains__(self, tx_ac: str) -> bool:
+        return ('tx_identity_info', tx_ac) in self._entries
+
+    def prefetch(self, alt_ac: str, tx_acs: Iterable[str], coding_tx_acs: Iterable[str] = ()):
+        """
+        Loads the data of transcripts not cached yet - a query per table.
+
+        :param alt_ac: contig accession the transcripts overlap variants on.
+        :param tx_acs: transcripts to load identity info of.
+        :param coding_tx_acs: transcripts to also load info, exon alignments, protein accession and sequence of.
+        """
+        tx_acs = sorted({tx_ac for tx_ac in tx_acs if tx_ac not in self})
+        coding_tx_acs = sorted({tx_ac for tx_ac in coding_tx_acs if ('coding', (tx_ac, alt_ac)) not in self._entries})
+        if not (tx_acs or coding_tx_acs):
+            return
+        with PROFILE.stage('hgvs.prefetch'):
+            if tx_acs:
+                for row in self.hdp._fetchall(_TX_IDENTITY_INFO_SQL, [tx_acs]):
+                    self._put('tx_identity_info', row['tx_ac'], row)
+            if coding_tx_acs:
+                self._prefetch_coding(alt_ac, coding_tx_acs)
+
+    def _prefetch_coding(self, alt_ac: str, tx_acs: Iterable[str]):
+        # entries are only kept where the single queries would not raise (no or many rows, incomplete alignments)
+        args = [list(tx_acs), alt_ac, self.alt_aln_method]
+        for tx_ac, rows in groupby(self.hdp._fetchall(_TX_INFO_SQL, args), key=lambda row: row['tx_ac']):
+            rows = list(rows)
+            if len(rows) == 1:
+                self._put('tx_info', (tx_ac, alt_ac, self.alt_aln_method), rows[0])
+        for tx_ac, rows in groupby(self.hdp._fetchall(_TX_EXONS_SQL, args), key=lambda row: row['tx_ac']):
+            rows = list(rows)
+            if rows[0 if rows[0]['alt_strand'] == 1 else -1]['tx_start_i'] == 0:
+                self._put('tx_exons', (tx_ac, alt_ac, self.alt_aln_method), rows)
+        pro_acs = {tx_ac: None for tx_ac in tx_acs}
+        for tx_ac, rows in groupby(self.hdp._fetchall(_TX_TO_PRO_SQL, [list(tx_acs)]), key=lambda row: row['tx_ac']):
+            pro_acs[tx_ac] = next(rows)['pro_ac']
+        for tx_ac, pro_ac in pro_acs.items():
+            self._put('pro_ac', tx_ac, pro_ac)
+        for row in self.hdp._fetchall(_TX_SEQ_SQL, [list(tx_acs)]):
+            self._put('seq', row['ac'], row['seq'])
+        for tx_ac in tx_acs:
+            self._put('coding', (tx_ac, alt_ac), True)
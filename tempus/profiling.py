@@ -0,0 +1,147 @@
+"""
+Lightweight per-stage instrumentation - call counts, latency histograms and error counts of the annotation stages,
+plus plain event counters (e.g. cache hits).
+
+Stages are timed by the process-wide `PROFILE`, which does nothing unless enabled. Latencies are kept in log-scale
+histograms (about 4% resolution), so that profiles of worker processes can be shipped to the main process and merged
+into percentiles of the whole run.
+"""
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, ContextManager, Dict, Iterator, Optional
+
+# histogram buckets per doubling of latency
+_BUCKETS_PER_OCTAVE = 16
+
+# guards the statistics of a process profiled from several threads (see `tempus annotate --mode threads`)
+_LOCK = threading.Lock()
+
+
+def _bucket(seconds: float) -> int:
+    return math.floor(math.log2(seconds * 1e9) * _BUCKETS_PER_OCTAVE) if seconds > 1e-9 else 0
+
+
+def _bucket_upper_bound(bucket: int) -> float:
+    return 2 ** ((bucket + 1) / _BUCKETS_PER_OCTAVE) / 1e9
+
+
+@dataclass
+class StageStats:
+    """
+    Calls of a single stage.
+
+        calls :: number of calls (including the failed ones).
+        total :: cumulative latency [s].
+        max :: max latency [s].
+        histogram :: number of calls by latency bucket.
+        errors :: number of calls that raised, by exception type (also when the exception was swallowed later on).
+    """
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    histogram: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+
+    def add(self, seconds: float, error: Optional[str] = None):
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[_bucket(seconds)] += 1
+        if error:
+            self.errors[error] += 1
+
+    def merge(self, other: 'StageStats'):
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.histogram.update(other.histogram)
+        self.errors.update(other.errors)
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: percentile (0-100).
+        :return: latency [s] (upper bound of its histogram bucket, at most the max latency).
+        """
+        rank = q / 100 * self.calls
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return min(_bucket_upper_bound(bucket), self.max)
+        return self.max
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': dict(self.errors),
+            'total_s': round(self.total, 6),
+            'mean_ms': round(1000 * self.total / self.calls, 4) if self.calls else None,
+            **{f'p{q}_ms': round(1000 * self.percentile(q), 4) for q in (50, 90, 99)},
+            'max_ms': round(1000 * self.max, 4)}
+
+
+@dataclass
+class Profile:
+    """
+    Per-stage statistics of a process (or, merged, of a whole run).
+    """
+    enabled: bool = False
+    stages: Dict[str, StageStats] = field(default_factory=dict)
+    counters: Counter = field(default_factory=Counter)
+
+    def stage(self, name: str) -> ContextManager:
+        """
+        :param name: stage name.
+        :return: context timing its block as a call of the stage (a no-op unless enabled).
+        """
+        return self._timed(name) if self.enabled else nullcontext()
+
+    def count(self, name: str, n: int = 1):
+        """
+        :param name: counter name.
+        :param n: number of events (ignored unless enabled).
+        """
+        if self.enabled:
+            with _LOCK:
+                self.counters[name] += n
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            with _LOCK:
+                self.stages.setdefault(name, StageStats()).add(seconds, error)
+
+    def merge(self, other: 'Profile'):
+        for name, stats in other.stages.items():
+            self.stages.setdefault(name, StageStats()).merge(stats)
+        self.counters.update(other.counters)
+
+    def drain(self) -> 'Profile':
+        """
+        :return: statistics recorded so far, which are reset.
+        """
+        with _LOCK:
+            drained = Profile(enabled=self.enabled, stages=self.stages, counters=self.counters)
+            self.stages, self.counters = {}, Counter()
+        return drained
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: json-serializable statistics by stage.
+        """
+        return {name: self.stages[name].report() for name in sorted(self.stages)}
+
+
+PROFILE = Profile()
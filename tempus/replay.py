@@ -0,0 +1,96 @@
+"""
+Recorded data-provider and ExAC responses - lets the annotation pipeline (and its benchmarks) run offline.
+
+A fixtures directory holds the UTA/seqrepo responses, recorded by the built-in learn/run cache modes of
+`biocommons/hgvs` data providers, and the ExAC annotations, recorded as json keyed by ExAC variant id. Fixtures are
+recorded once by running with live services (single worker, as the recordings are rewritten on every miss) and then
+replayed without any network access; replaying a query that was not recorded is an error.
+"""
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Any
+
+from hgvs.dataproviders import uta
+from hgvs.dataproviders.interface import Interface
+
+from tempus import SimpleVariant
+from tempus.exac import ExacAnnotator, ExacVariantAnnotation, exac_variant_id, annotate_simple_variants
+
+HGVS_FIXTURE = 'hgvs.pickle'
+EXAC_FIXTURE = 'exac.json'
+
+
+class ExacResponseNotRecorded(KeyError):
+    pass
+
+
+def connect_data_provider(fixtures_dir: Path, record: bool = False) -> Interface:
+    """
+    :param fixtures_dir: fixtures directory.
+    :param record: query UTA (and seqrepo) and record the responses, instead of replaying them.
+    :return: data provider, replaying (or recording) responses from/to `HGVS_FIXTURE`.
+    """
+    fixture = fixtures_dir / HGVS_FIXTURE
+    if record:
+        fixtures_dir.mkdir(parents=True, exist_ok=True)
+    elif not fixture.exists():
+        raise FileNotFoundError(f'no recorded data provider responses: {fixture}')
+    # in 'run' mode the provider never connects to the database
+    return uta.connect(mode='learn' if record else 'run', cache=str(fixture))
+
+
+@dataclass
+class ExacReplay:
+    """
+    ExAC annotator replaying recorded annotations - or, when given an annotator to record, delegating the variants
+    not recorded yet to it and saving its annotations after every batch.
+    """
+    path: Path
+    record: Optional[ExacAnnotator] = None
+    _responses: Optional[Dict[str, Dict[str, Any]]] = field(default=None, repr=False)
+
+    @classmethod
+    def from_fixtures(cls, fixtures_dir: Path, record: bool = False) -> 'ExacReplay':
+        """
+        :param fixtures_dir: fixtures directory.
+        :param record: annotate using the non-bulk ExAC REST API and record the annotations.
+        :return: ExAC annotator, replaying (or recording) annotations from/to `EXAC_FIXTURE`.
+        """
+        fixture = fixtures_dir / EXAC_FIXTURE
+        if record:
+            fixtures_dir.mkdir(parents=True, exist_ok=True)
+        elif not fixture.exists():
+            raise FileNotFoundError(f'no recorded ExAC responses: {fixture}')
+        return cls(path=fixture, record=annotate_simple_variants if record else None)
+
+    @property
+    def data_version(self) -> str:
+        return f'replay:{self.path}'
+
+    @property
+    def responses(self) -> Dict[str, Dict[str, Any]]:
+        if self._responses is None:
+            self._responses = json.loads(self.path.read_text()) if self.path.exists() else {}
+        return self._responses
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+    def annotate_batch(self, variants: Sequence[SimpleVariant]) -> List[ExacVariantAnnotation]:
+        """
+        :param variants: 5p-normalized simple variants.
+        :return: variant annotations in the order of variants.
+        """
+        var_ids = [exac_variant_id(variant) for variant in variants]
+        missing = [variant for var_id, variant in zip(var_ids, variants) if var_id not in self.responses]
+        if missing:
+            if not self.record:
+                raise ExacResponseNotRecorded(exac_variant_id(missing[0]))
+            for variant, ann in zip(missing, self.record(missing)):
+                self.responses[exac_variant_id(variant)] = {
+                    'allele_frequency': ann.allele_frequency, 'consequences': ann.consequences}
+            self.path.write_text(json.dumps(self.responses, sort_keys=True))
+        return [ExacVariantAnnotation(**self.responses[var_id]) for var_id in var_ids]
+
+    __call__ = annotate_batch
@@ -0,0 +1,184 @@
+"""
+Cost-aware (guided) scheduling of annotation chunks.
+
+Fixed-size chunks are badly unbalanced: an intergenic SNV takes milliseconds, an indel within a gene of dozens of
+coding transcripts (a g_to_c and c_to_p round trip each) orders of magnitude longer - and a run waits on its slowest
+chunks. Guided scheduling cuts chunks by estimated cost instead:
+
+    * every record is scanned upfront (leading columns only) for its features - a count of SNV and of other alleles,
+      and these counts times the number of coding transcripts overlapping the record (probed from a transcript
+      index, where there is one),
+    * the cost of a record is a linear model of its features, in seconds, fitted (ridge least squares) to the
+      measured durations of completed chunks - and persisted, so that it improves from run to run,
+    * chunks are cut lazily, as workers free up, at a share of the estimated remaining cost (OpenMP `guided`
+      schedule): large chunks while there is plenty of work left, ever smaller ones towards the end, so that no
+      worker is left with a long tail. Chunks cut later use a model refined by the chunks completed meanwhile.
+"""
+import bisect
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from tempus.hgvs import TranscriptIndex
+from tempus.snv import is_snv
+from tempus.vcf import VcfShard, scan_record_offsets, vcf_compression
+
+FEATURES: Tuple[str, ...] = ('record', 'snv', 'snv_tx', 'other', 'other_tx')
+
+# seconds per unit of each feature, before anything was measured
+_PRIOR_WEIGHTS: Tuple[float, ...] = (1e-4, 2e-3, 2e-3, 2e-2, 5e-2)
+# pull of the prior - in number of (unit) observations
+_PRIOR_STRENGTH = 1.0
+# estimates never drop below this share of the prior (features must keep a positive cost)
+_MIN_WEIGHT_SHARE = 1e-3
+
+
+@dataclass
+class CostModel:
+    """
+    Linear model of the annotation time of a chunk (see module docs), as the sufficient statistics of its least squares
+    fit (`gram` = X'X, `moments` = X'y over the observed chunks).
+    """
+    gram: np.ndarray = field(default_factory=lambda: np.zeros((len(FEATURES), len(FEATURES))))
+    moments: np.ndarray = field(default_factory=lambda: np.zeros(len(FEATURES)))
+    n_observations: int = 0
+    weights: np.ndarray = field(default_factory=lambda: np.array(_PRIOR_WEIGHTS))
+
+    @classmethod
+    def load(cls, path: Path) -> 'CostModel':
+        """
+        :param path: file written by `CostModel.save`.
+        :return: cost model.
+        """
+        data = json.loads(path.read_text())
+        if tuple(data['features']) != FEATURES:
+            raise ValueError(f'cost model of other features: {data["features"]}')
+        model = cls(
+            gram=np.array(data['gram'], dtype=float), moments=np.array(data['moments'], dtype=float),
+            n_observations=data['n_observations'])
+        model.fit()
+        return model
+
+    def save(self, path: Path):
+        """
+        :param path: output (.json) file.
+        """
+        path.write_text(json.dumps({
+            'features': FEATURES, 'gram': self.gram.tolist(), 'moments': self.moments.tolist(),
+            'n_observations': self.n_observations,
+            'weights': dict(zip(FEATURES, self.weights.tolist()))}, indent=2))
+
+    def observe(self, features: np.ndarray, seconds: float):
+        """
+        :param features: feature sums of a completed chunk.
+        :param seconds: time taken to annotate the chunk.
+        """
+        self.gram += np.outer(features, features)
+        self.moments += features * seconds
+        self.n_observations += 1
+        self.fit()
+
+    def fit(self):
+        # ridge regression towards the prior weights, scaled to the features' magnitudes
+        prior = np.array(_PRIOR_WEIGHTS)
+        ridge = _PRIOR_STRENGTH * np.diag(np.maximum(np.diag(self.gram), 1.0)) / max(self.n_observations, 1)
+        weights = np.linalg.solve(self.gram + ridge, self.moments + ridge @ prior)
+        self.weights = np.maximum(weights, prior * _MIN_WEIGHT_SHARE)
+
+    def cost(self, features: np.ndarray) -> np.ndarray:
+        """
+        :param features: features (of a record or chunk), or a matrix of them.
+        :return: estimated annotation time in seconds.
+        """
+        return features @ self.weights
+
+
+@dataclass(frozen=True)
+class RecordFeatures:
+    """
+    Features (see `FEATURES`) of the records of a vcf file, along with their offsets (as `VcfShard` offsets).
+    """
+    path: Path
+    starts: np.ndarray = field(repr=False)
+    ends: np.ndarray = field(repr=False)
+    features: np.ndarray = field(repr=False)
+    contig_starts: List[int] = field(repr=False)
+
+    @classmethod
+    def scan(cls, vcf_path: Path, transcript_index: Optional[TranscriptIndex] = None,
+             contig__accession: Optional[Dict[str, str]] = None, skip_records: int = 0) -> 'RecordFeatures':
+        """
+        :param vcf_path: (optionally bgzipped) vcf file - the offsets of a plain gzip one would only be reached by
+                         decompressing everything before them.
+        :param transcript_index: probed for the number of coding transcripts overlapping each record.
+        :param contig__accession: contig accessions of the transcript index by vcf contig name.
+        :param skip_records: number of leading records to leave out.
+        :return: features of the records.
+        """
+        if vcf_compression(vcf_path) == 'gzip':
+            raise ValueError(f'cannot shard a plain gzip vcf by offsets, please bgzip it: {vcf_path}')
+        starts, ends, contigs, positions, alleles = [], [], [], [], []
+        for start, end, line in scan_record_offsets(vcf_path, skip_records):
+            contig, pos, _, ref, alts = line.decode().split('\t', 5)[:5]
+            alts = alts.split(',') if alts != '.' else []
+            n_snv = sum(is_snv(ref, alt) for alt in alts)
+            starts.append(start)
+            ends.append(end)
+            contigs.append(contig)
+            positions.append(int(pos))
+            alleles.append((n_snv, len(alts) - n_snv))
+        positions, alleles = np.array(positions, dtype=np.int64), np.array(alleles, dtype=float).reshape(-1, 2)
+        n_txs = np.zeros(len(positions))
+        contig_starts = [idx for idx in range(len(contigs)) if idx == 0 or contigs[idx] != contigs[idx - 1]]
+        if transcript_index is not None:
+            for lo, hi in zip(contig_starts, contig_starts[1:] + [len(contigs)]):
+                alt_ac = (contig__accession or {}).get(contigs[lo], contigs[lo])
+                n_txs[lo:hi] = transcript_index.count_coding_transcripts(alt_ac, positions[lo:hi])
+        features = np.column_stack([
+            np.ones(len(positions)), alleles[:, 0], alleles[:, 0] * n_txs, alleles[:, 1], alleles[:, 1] * n_txs])
+        return cls(path=vcf_path, starts=np.array(starts, dtype=np.int64), ends=np.array(ends, dtype=np.int64),
+                   features=features, contig_starts=contig_starts)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+def guided_shards(records: RecordFeatures, model: CostModel, workers: int, min_records: int = 1,
+                  by_contig: bool = False) -> Iterator[Tuple[VcfShard, np.ndarray]]:
+    """
+    Cuts records into chunks of about `1 / (2 * workers)` of the estimated remaining cost each (see module docs).
+    Chunks are cut as they are consumed, with the model as it is by then.
+
+    :param records: features of the records.
+    :param model: cost model (observing completed chunks meanwhile).
+    :param workers: number of workers.
+    :param min_records: min number of records in each chunk (unless it is the last one, of its contig).
+    :param by_contig: cut chunks at contig boundaries as well, so that no chunk spans contigs.
+    :return: shards along with their feature sums.
+    """
+    # prefix sums - the features of any range of records in constant time
+    cumulative = np.vstack([np.zeros((1, len(FEATURES))), np.cumsum(records.features, axis=0)])
+    n_records, idx = len(records), 0
+    while idx < n_records:
+        remaining = model.cost(cumulative[n_records] - cumulative[idx])
+        target = remaining / (2 * workers)
+        limit = n_records
+        if by_contig:
+            next_contig = bisect.bisect_right(records.contig_starts, idx)
+            limit = records.contig_starts[next_contig] if next_contig < len(records.contig_starts) else n_records
+        # the fewest records (at least `min_records`) reaching the target - costs are monotone in the end record
+        lo, hi = min(idx + min_records, limit), limit
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if model.cost(cumulative[mid] - cumulative[idx]) >= target:
+                hi = mid
+            else:
+                lo = mid + 1
+        end = max(lo, idx + 1)
+        yield VcfShard(
+            path=records.path, start=int(records.starts[idx]), end=int(records.ends[end - 1]),
+            n_records=end - idx), cumulative[end] - cumulative[idx]
+        idx = end
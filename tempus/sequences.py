@@ -0,0 +1,194 @@
+"""
+Reference sequence fetching for hgvs - a windowed in-memory cache in front of the data provider's sequence fetcher,
+optionally backed by a local FASTA (memory-mapped) or seqrepo.
+
+Normalization fetches a few dozen bases around every variant; as vcfs are position-sorted, neighbouring variants ask
+for overlapping stretches of the same contig. The cache fetches aligned windows of `window_size` bases instead and
+serves every request falling within cached windows from memory, evicting the least recently used windows beyond
+`max_bytes`. Whole-sequence requests (e.g. transcripts for c_to_p) are passed through, as they are cached by the data
+provider itself.
+"""
+import logging
+import mmap
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from tempus.profiling import PROFILE
+
+
+@dataclass(frozen=True)
+class _FaiEntry:
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+
+def index_fasta(fasta: Path) -> Path:
+    """
+    Writes a samtools compatible `.fai` index of an uncompressed FASTA file, unless there is one already.
+
+    :param fasta: FASTA file.
+    :return: path of the index.
+    """
+    fai = fasta.with_name(fasta.name + '.fai')
+    if fai.exists():
+        return fai
+    entries = []
+    name, length, offset, line_bases, line_width = None, 0, 0, 0, 0
+    pos = 0
+    with fasta.open('rb') as fasta_io:
+        for line in fasta_io:
+            if line.startswith(b'>'):
+                if name is not None:
+                    entries.append((name, length, offset, line_bases, line_width))
+                name, length, offset, line_bases, line_width = line[1:].split()[0].decode(), 0, pos + len(line), 0, 0
+            elif name is not None:
+                if not line_bases:
+                    line_bases, line_width = len(line.rstrip(b'\r\n')), len(line)
+                length += len(line.rstrip(b'\r\n'))
+            pos += len(line)
+    if name is not None:
+        entries.append((name, length, offset, line_bases, line_width))
+    fai.write_text(''.join('\t'.join(map(str, entry)) + '\n' for entry in entries))
+    return fai
+
+
+class FastaSequences:
+    """
+    Sequences of a local, uncompressed FASTA file (e.g. the assembly the vcf was called against), memory-mapped and
+    sliced through its `.fai` index.
+    """
+
+    def __init__(self, fasta: Path, aliases: Optional[Dict[str, str]] = None):
+        """
+        :param fasta: uncompressed FASTA file.
+        :param aliases: FASTA sequence names by accession, for the accessions not named as such (e.g. '1' for
+                        'NC_000001.10').
+        """
+        with fasta.open('rb') as fasta_io:
+            if fasta_io.read(2) == b'\x1f\x8b':
+                raise ValueError(f'compressed FASTA is not supported: {fasta}')
+        self._entries = {
+            name: _FaiEntry(*map(int, values))
+            for name, *values in (line.split('\t') for line in index_fasta(fasta).read_text().splitlines())}
+        self._aliases = aliases or {}
+        with fasta.open('rb') as fasta_io:
+            self._mmap = mmap.mmap(fasta_io.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _entry(self, ac: str) -> Optional[_FaiEntry]:
+        return self._entries.get(ac) or self._entries.get(self._aliases.get(ac))
+
+    def __contains__(self, ac: str) -> bool:
+        return self._entry(ac) is not None
+
+    def fetch_seq(self, ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+        entry = self._entry(ac)
+        if entry is None:
+            raise KeyError(ac)
+        start_i = 0 if start_i is None else min(max(start_i, 0), entry.length)
+        end_i = entry.length if end_i is None else min(max(end_i, start_i), entry.length)
+
+        def byte_offset(pos: int) -> int:
+            return entry.offset + (pos // entry.line_bases) * entry.line_width + pos % entry.line_bases
+
+        raw = self._mmap[byte_offset(start_i):byte_offset(end_i)] if end_i > start_i else b''
+        return raw.replace(b'\n', b'').replace(b'\r', b'').decode().upper()
+
+
+class SeqRepoSequences:
+    """
+    Sequences of a local seqrepo instance - requires `biocommons.seqrepo`.
+    """
+
+    def __init__(self, seqrepo_dir: Path):
+        from biocommons.seqrepo import SeqRepo
+        self._seqrepo = SeqRepo(str(seqrepo_dir))
+
+    def __contains__(self, ac: str) -> bool:
+        try:
+            self._seqrepo[ac]
+        except KeyError:
+            return False
+        return True
+
+    def fetch_seq(self, ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+        return self._seqrepo.fetch(ac, start_i, end_i)
+
+
+def open_local_sequences(path: Path, aliases: Optional[Dict[str, str]] = None) \
+        -> Union[FastaSequences, SeqRepoSequences]:
+    """
+    :param path: uncompressed FASTA file, or seqrepo instance directory.
+    :param aliases: FASTA sequence names by accession.
+    :return: local sequences.
+    """
+    return SeqRepoSequences(path) if path.is_dir() else FastaSequences(path, aliases)
+
+
+@dataclass
+class WindowStats:
+    requests: int = 0
+    hits: int = 0
+    misses: int = 0
+    passthrough: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+@dataclass
+class WindowedSequenceFetcher:
+    """
+    Sequence fetcher serving sub-sequence requests from an LRU cache of aligned reference windows (see module docs).
+
+    Windows are read from `local` sequences when they hold the accession, and from `fetcher` (the data provider's
+    `seqfetcher`, anything with `fetch_seq(ac, start_i, end_i)`) otherwise.
+    """
+    fetcher: Any
+    local: Optional[Union[FastaSequences, SeqRepoSequences]] = None
+    window_size: int = 1 << 17
+    max_bytes: int = 1 << 27
+    stats: WindowStats = field(default_factory=WindowStats)
+    _windows: 'OrderedDict[Tuple[str, int], str]' = field(default_factory=OrderedDict, repr=False)
+    _bytes: int = field(default=0, repr=False)
+
+    def _source(self, ac: str) -> Any:
+        return self.local if self.local is not None and ac in self.local else self.fetcher
+
+    def _window(self, ac: str, idx: int) -> str:
+        key = (ac, idx)
+        window = self._windows.get(key)
+        if window is not None:
+            self._windows.move_to_end(key)
+            self.stats.hits += 1
+            PROFILE.count('sequences.window_hits')
+            return window
+        self.stats.misses += 1
+        PROFILE.count('sequences.window_misses')
+        with PROFILE.stage('sequences.fetch_window'):
+            window = self._source(ac).fetch_seq(ac, idx * self.window_size, (idx + 1) * self.window_size)
+        self._windows[key] = window
+        self._bytes += len(window)
+        while self._bytes > self.max_bytes and len(self._windows) > 1:
+            _, evicted = self._windows.popitem(last=False)
+            self._bytes -= len(evicted)
+        return window
+
+    def fetch_seq(self, ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+        self.stats.requests += 1
+        if start_i is None or end_i is None:
+            self.stats.passthrough += 1
+            return self._source(ac).fetch_seq(ac, start_i, end_i)
+        if end_i <= start_i:
+            return ''
+        first, last = start_i // self.window_size, (end_i - 1) // self.window_size
+        seq = ''.join(self._window(ac, idx) for idx in range(first, last + 1))
+        offset = first * self.window_size
+        return seq[start_i - offset:end_i - offset]
+
+    def log_stats(self):
+        logging.debug(f'reference windows: {self.stats} (hit rate {self.stats.hit_rate:.1%}), {self._bytes} bytes')
@@ -0,0 +1,170 @@
+"""
+Local transcript models for classifying single nucleotide variants (SNVs) without the hgvs mapping round trips.
+
+A model keeps the exon structure, coding sequence (CDS) and protein of a transcript, fetched once from the data
+provider, so that an SNV is projected onto the CDS and its codon translated locally. Only the transcripts (and
+positions) for which this is equivalent to `hgvs` g_to_c -> c_to_p get a model (an answer) - ungapped alignments of
+adjacent exons, a CDS of whole codons with a single stop codon at its end, and substitutions inside the CDS away from
+the start and stop codons. Everything else is left to `hgvs`.
+"""
+import bisect
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from Bio.Seq import Seq
+from bioutils.sequences import reverse_complement
+from hgvs.dataproviders.interface import Interface
+from hgvs.exceptions import HGVSError
+
+_UNGAPPED_CIGAR = re.compile(r'(\d+[=MX])+')
+
+
+@lru_cache(maxsize=None)
+def translate_codon(codon: str) -> str:
+    """
+    :param codon: codon (standard table, as `hgvs` translates).
+    :return: amino acid (one letter, '*' for stop, 'X' if ambiguous).
+    """
+    return str(Seq(codon).translate())
+
+
+def is_snv(ref: str, alt: str) -> bool:
+    return len(ref) == 1 and len(alt) == 1 and ref != alt and ref in 'ACGT' and alt in 'ACGT'
+
+
+@dataclass(frozen=True)
+class SnvConsequence:
+    """
+    Effect of an SNV on a coding transcript.
+
+        c_pos :: CDS position (1-based).
+        ref :: reference base on the transcript strand.
+        alt :: alternate base on the transcript strand.
+        aa_pos :: amino acid position (1-based).
+        ref_aa :: reference amino acid (one letter).
+        alt_aa :: alternate amino acid (one letter, '*' for stop).
+    """
+    c_pos: int
+    ref: str
+    alt: str
+    aa_pos: int
+    ref_aa: str
+    alt_aa: str
+
+
+@dataclass(frozen=True)
+class TranscriptModel:
+    """
+    Exon structure and coding sequence of a transcript aligned to a genomic sequence.
+
+        exons :: (alt_start_i, alt_end_i, tx_start_i) of every exon, ordered by alt_start_i. [interbase coordinates]
+    """
+    tx_ac: str
+    alt_ac: str
+    pro_ac: str
+    strand: int
+    exons: Tuple[Tuple[int, int, int], ...]
+    cds_start_i: int
+    cds_end_i: int
+    cds: str
+    protein: str
+
+    @classmethod
+    def from_data_provider(cls, hdp: Interface, tx_ac: str, alt_ac: str, alt_aln_method: str) \
+            -> Optional['TranscriptModel']:
+        """
+        :param hdp: data provider.
+        :param tx_ac: transcript accession.
+        :param alt_ac: genomic accession the transcript is aligned to.
+        :param alt_aln_method: alignment method.
+        :return: model of the transcript, None unless it is supported (see module docs).
+        """
+        try:
+            tx_info = hdp.get_tx_info(tx_ac, alt_ac, alt_aln_method)
+            tx_exons = hdp.get_tx_exons(tx_ac, alt_ac, alt_aln_method)
+            tx_identity_info = hdp.get_tx_identity_info(tx_ac)
+            tx_seq = hdp.get_seq(tx_ac)
+        except HGVSError:
+            return None
+        if not (tx_info and tx_exons and tx_identity_info and tx_seq) or tx_info['cds_start_i'] is None:
+            return None
+        # the projection (g_to_c) uses the alignment's CDS, the translation (c_to_p) the transcript's
+        cds_start_i, cds_end_i = tx_info['cds_start_i'], tx_info['cds_end_i']
+        if (tx_identity_info['cds_start_i'], tx_identity_info['cds_end_i']) != (cds_start_i, cds_end_i):
+            return None
+        exons = sorted(tx_exons, key=lambda exon: exon['ord'])
+        if exons[0]['tx_start_i'] != 0 or any(
+                prev['tx_end_i'] != exon['tx_start_i'] for prev, exon in zip(exons, exons[1:])):
+            return None
+        if not all(
+                _UNGAPPED_CIGAR.fullmatch(exon['cigar'] or '') and
+                exon['alt_end_i'] - exon['alt_start_i'] == exon['tx_end_i'] - exon['tx_start_i'] for exon in exons):
+            return None
+        cds = tx_seq[cds_start_i:cds_end_i]
+        if len(cds) % 3 != 0:
+            return None
+        protein = str(Seq(cds).translate())
+        if protein.find('*') != len(protein) - 1:
+            return None
+        try:
+            pro_ac = hdp.get_pro_ac_for_tx_ac(tx_ac) or hdp.get_acs_for_protein_seq(protein)[0]
+        except HGVSError:
+            return None
+        return cls(
+            tx_ac=tx_ac, alt_ac=alt_ac, pro_ac=pro_ac, strand=exons[0]['alt_strand'],
+            exons=tuple(sorted((exon['alt_start_i'], exon['alt_end_i'], exon['tx_start_i']) for exon in exons)),
+            cds_start_i=cds_start_i, cds_end_i=cds_end_i, cds=cds, protein=protein)
+
+    def n_pos(self, pos: int) -> Optional[int]:
+        """
+        :param pos: genomic position. [base coordinate system]
+        :return: transcript position [base coordinate system], None if not exonic.
+        """
+        idx = bisect.bisect_right(self.exons, (pos - 1, float('inf'), 0)) - 1
+        if idx < 0:
+            return None
+        alt_start_i, alt_end_i, tx_start_i = self.exons[idx]
+        if not alt_start_i <= pos - 1 < alt_end_i:
+            return None
+        if self.strand == 1:
+            return tx_start_i + (pos - 1 - alt_start_i) + 1
+        return tx_start_i + (alt_end_i - pos) + 1
+
+    def snv_consequence(self, pos: int, ref: str, alt: str) -> Optional[SnvConsequence]:
+        """
+        :param pos: genomic position. [base coordinate system]
+        :param ref: reference base (genomic strand).
+        :param alt: alternate base (genomic strand).
+        :return: consequence of the SNV, None unless it hits a codon other than the start and stop codons.
+        """
+        n_pos = self.n_pos(pos)
+        if n_pos is None or not self.cds_start_i < n_pos <= self.cds_end_i:
+            return None
+        c_pos = n_pos - self.cds_start_i
+        aa_pos, frame = divmod(c_pos - 1, 3)
+        aa_pos += 1
+        if aa_pos in (1, len(self.protein)):
+            return None
+        if self.strand == -1:
+            ref, alt = reverse_complement(ref), reverse_complement(alt)
+        codon = self.cds[3 * (aa_pos - 1):3 * aa_pos]
+        ref_aa, alt_aa = self.protein[aa_pos - 1], translate_codon(codon[:frame] + alt + codon[frame + 1:])
+        if 'X' in (ref_aa, alt_aa):
+            return None
+        return SnvConsequence(c_pos=c_pos, ref=ref, alt=alt, aa_pos=aa_pos, ref_aa=ref_aa, alt_aa=alt_aa)
+
+
+class TranscriptModels:
+    """
+    Per-process LRU cache of transcript models (including the unsupported transcripts).
+    """
+
+    def __init__(self, hdp: Interface, alt_aln_method: str, maxsize: int = 10_000):
+        self.hdp = hdp
+        self.alt_aln_method = alt_aln_method
+        self.get = lru_cache(maxsize=maxsize)(self._load)
+
+    def _load(self, tx_ac: str, alt_ac: str) -> Optional[TranscriptModel]:
+        return TranscriptModel.from_data_provider(self.hdp, tx_ac, alt_ac, self.alt_aln_method)
@@ -0,0 +1,333 @@
+"""
+Embedded UTA snapshot - the Universal Transcript Archive (UTA) tables `biocommons/hgvs` queries, exported from the
+UTA Postgres database into a local SQLite file, and a data provider reading from it.
+
+The snapshot is denormalized into one indexed table per data provider query (transcript spans, exon alignments,
+transcript info, identity info, protein accessions, genes and transcript sequences), optionally restricted to the
+contigs of a vcf and/or a gene panel. Genomic sequences are still fetched by the provider's `seqfetcher` (see
+`tempus.sequences` to serve them from a local reference).
+"""
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from bioutils.assemblies import make_ac_name_map
+from bioutils.digests import seq_md5
+from hgvs.dataproviders.interface import Interface
+from hgvs.dataproviders.seqfetcher import SeqFetcher
+from hgvs.exceptions import HGVSDataNotAvailableError, HGVSError
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+_SCHEMA = """
+create table meta (key text primary key, value text not null);
+create table tx_span (
+    tx_ac text not null, alt_ac text not null, alt_strand integer not null, alt_aln_method text not null,
+    start_i integer not null, end_i integer not null);
+create index tx_span_region on tx_span (alt_ac, alt_aln_method, start_i);
+create table tx_exon_aln (
+    tx_ac text not null, alt_ac text not null, alt_strand integer not null, alt_aln_method text not null,
+    ord integer not null, tx_start_i integer not null, tx_end_i integer not null, alt_start_i integer not null,
+    alt_end_i integer not null, cigar text);
+create index tx_exon_aln_tx on tx_exon_aln (tx_ac, alt_ac, alt_aln_method);
+create table tx_info (
+    hgnc text, cds_start_i integer, cds_end_i integer, tx_ac text not null, alt_ac text not null,
+    alt_aln_method text not null);
+create index tx_info_tx on tx_info (tx_ac, alt_ac, alt_aln_method);
+create index tx_info_hgnc on tx_info (hgnc);
+create table tx_identity_info (
+    tx_ac text primary key, alt_ac text, alt_aln_method text, cds_start_i integer, cds_end_i integer,
+    lengths text, hgnc text);
+create table tx_to_pro (tx_ac text not null, pro_ac text not null);
+create index tx_to_pro_tx on tx_to_pro (tx_ac);
+create table protein_md5 (md5 text not null, ac text not null);
+create index protein_md5_md5 on protein_md5 (md5);
+create table gene (hgnc text primary key, maploc text, descr text, summary text, aliases text, added text);
+create table seq (ac text primary key, seq text not null);
+"""
+
+#
+# export (UTA Postgres queries)
+#
+
+_EXPORT_BATCH_SIZE = 1000
+
+_UTA_SPANS_SQL = """
+    select tx_ac, alt_ac, alt_strand, alt_aln_method, min(start_i) as start_i, max(end_i) as end_i
+    from exon_set ES
+    join exon E on ES.exon_set_id=E.exon_set_id
+    where alt_ac=any(%s) and alt_aln_method=%s
+    group by tx_ac, alt_ac, alt_strand, alt_aln_method
+    """
+_UTA_TX_INFO_SQL = """
+    select hgnc, cds_start_i, cds_end_i, tx_ac, alt_ac, alt_aln_method
+    from transcript T
+    join exon_set ES on T.ac=ES.tx_ac
+    where tx_ac=any(%s) and alt_ac=any(%s) and alt_aln_method=%s
+    """
+_UTA_TX_EXON_ALN_SQL = """
+    select tx_ac, alt_ac, alt_strand, alt_aln_method, ord, tx_start_i, tx_end_i, alt_start_i, alt_end_i, cigar
+    from tx_exon_aln_v
+    where tx_ac=any(%s) and alt_ac=any(%s) and alt_aln_method=%s
+    """
+_UTA_TX_IDENTITY_INFO_SQL = """
+    select distinct(tx_ac), alt_ac, alt_aln_method, cds_start_i, cds_end_i, lengths, hgnc
+    from tx_def_summary_v
+    where tx_ac=any(%s)
+    """
+_UTA_TX_TO_PRO_SQL = """
+    select tx_ac, pro_ac from associated_accessions where tx_ac=any(%s)
+    """
+_UTA_PROTEIN_MD5_SQL = """
+    select distinct SA2.seq_id as md5, SA2.ac
+    from seq_anno SA1
+    join seq_anno SA2 on SA1.seq_id=SA2.seq_id
+    where SA1.ac=any(%s)
+    """
+_UTA_GENE_SQL = """
+    select hgnc, maploc, descr, summary, aliases, added::text from gene where hgnc=any(%s)
+    """
+_UTA_SEQ_SQL = """
+    select ac, seq from seq S join seq_anno SA on S.seq_id=SA.seq_id where ac=any(%s)
+    """
+
+_TABLE__COLUMNS: Dict[str, Sequence[str]] = {
+    'tx_span': ('tx_ac', 'alt_ac', 'alt_strand', 'alt_aln_method', 'start_i', 'end_i'),
+    'tx_exon_aln': (
+        'tx_ac', 'alt_ac', 'alt_strand', 'alt_aln_method', 'ord', 'tx_start_i', 'tx_end_i', 'alt_start_i', 'alt_end_i',
+        'cigar'),
+    'tx_info': ('hgnc', 'cds_start_i', 'cds_end_i', 'tx_ac', 'alt_ac', 'alt_aln_method'),
+    'tx_identity_info': ('tx_ac', 'alt_ac', 'alt_aln_method', 'cds_start_i', 'cds_end_i', 'lengths', 'hgnc'),
+    'tx_to_pro': ('tx_ac', 'pro_ac'),
+    'protein_md5': ('md5', 'ac'),
+    'gene': ('hgnc', 'maploc', 'descr', 'summary', 'aliases', 'added'),
+    'seq': ('ac', 'seq'),
+}
+
+
+def _fetch_batched(hdp: Interface, sql: str, values: Sequence[str], *args: Any) -> List[Dict[str, Any]]:
+    rows = []
+    for offset in range(0, len(values), _EXPORT_BATCH_SIZE):
+        rows.extend(dict(row) for row in hdp._fetchall(sql, [list(values[offset:offset + _EXPORT_BATCH_SIZE]), *args]))
+    return rows
+
+
+def export_uta_snapshot(hdp: Interface, path: Path, assembly_name: str, alt_aln_method: str = 'splign',
+                        contigs: Optional[Iterable[str]] = None, genes: Optional[Iterable[str]] = None) -> Path:
+    """
+    Exports the UTA data of an assembly into a SQLite snapshot (see module docs) - a few bulk queries per table.
+
+    :param hdp: UTA (Postgres) data provider.
+    :param path: output SQLite file (overwritten).
+    :param assembly_name: assembly name.
+    :param alt_aln_method: alignment method.
+    :param contigs: contigs to export (defaults to all contigs of the assembly).
+    :param genes: HGNC symbols of the genes to export (defaults to all genes).
+    :return: path of the snapshot.
+    """
+    accession__contig = hdp.get_assembly_map(assembly_name=assembly_name)
+    contigs = set(contigs) if contigs is not None else None
+    alt_acs = [alt_ac for alt_ac, contig in accession__contig.items() if contigs is None or contig in contigs]
+    genes = sorted(set(genes)) if genes is not None else None
+
+    spans = [dict(row) for row in hdp._fetchall(_UTA_SPANS_SQL, [alt_acs, alt_aln_method])]
+    tx_acs = sorted({span['tx_ac'] for span in spans})
+    tx_info = _fetch_batched(hdp, _UTA_TX_INFO_SQL, tx_acs, alt_acs, alt_aln_method)
+    if genes is not None:
+        tx_info = [row for row in tx_info if row['hgnc'] in genes]
+        tx_acs = sorted({row['tx_ac'] for row in tx_info})
+        spans = [span for span in spans if span['tx_ac'] in set(tx_acs)]
+    logging.info(f'exporting {len(tx_acs)} transcripts on {len(alt_acs)} contigs')
+    tx_to_pro = _fetch_batched(hdp, _UTA_TX_TO_PRO_SQL, tx_acs)
+    tables = {
+        'tx_span': spans,
+        'tx_exon_aln': _fetch_batched(hdp, _UTA_TX_EXON_ALN_SQL, tx_acs, alt_acs, alt_aln_method),
+        'tx_info': tx_info,
+        'tx_identity_info': [
+            {**row, 'lengths': json.dumps(list(row['lengths']) if row['lengths'] is not None else None)}
+            for row in _fetch_batched(hdp, _UTA_TX_IDENTITY_INFO_SQL, tx_acs)],
+        'tx_to_pro': tx_to_pro,
+        'protein_md5': _fetch_batched(hdp, _UTA_PROTEIN_MD5_SQL, sorted({row['pro_ac'] for row in tx_to_pro})),
+        'gene': _fetch_batched(hdp, _UTA_GENE_SQL, sorted({row['hgnc'] for row in tx_info if row['hgnc']})),
+        'seq': _fetch_batched(hdp, _UTA_SEQ_SQL, tx_acs),
+    }
+    meta = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'schema_version': hdp.schema_version(),
+        # restricting contigs leaves the annotations of the exported contigs as they are, a gene panel does not
+        'data_version': hdp.data_version() + (f':genes-{seq_md5(",".join(genes))[:12]}' if genes is not None else ''),
+        'assembly_name': assembly_name,
+        'alt_aln_method': alt_aln_method,
+        'contigs': json.dumps(sorted(contigs) if contigs is not None else None),
+        'genes': json.dumps(genes),
+    }
+    return write_uta_snapshot(path, meta, tables)
+
+
+def write_uta_snapshot(path: Path, meta: Dict[str, Any], tables: Dict[str, Iterable[Dict[str, Any]]]) -> Path:
+    """
+    :param path: output SQLite file (overwritten).
+    :param meta: snapshot metadata, including 'schema_version' and 'data_version' of the source.
+    :param tables: rows by table name (see `_SCHEMA`).
+    :return: path of the snapshot.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+    connection = sqlite3.connect(str(tmp_path))
+    try:
+        connection.executescript(_SCHEMA)
+        connection.executemany('insert into meta values (?, ?)', [(key, str(value)) for key, value in meta.items()])
+        for table, rows in tables.items():
+            columns = _TABLE__COLUMNS[table]
+            connection.executemany(
+                f'insert or replace into {table} ({", ".join(columns)}) values ({", ".join("?" * len(columns))})',
+                ([row[column] for column in columns] for row in rows))
+        connection.commit()
+        connection.execute('analyze')
+    finally:
+        connection.close()
+    os.replace(str(tmp_path), str(path))
+    return path
+
+
+#
+# data provider
+#
+
+def _dict_row(cursor: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class UtaSnapshot(Interface):
+    """
+    Data provider answering `biocommons/hgvs` queries from a SQLite snapshot (see `export_uta_snapshot`), with the
+    same results (and errors) as the UTA Postgres provider for the exported transcripts. Transcript sequences come
+    from the snapshot, other sequences from `seqfetcher`.
+
+    Each process lazily opens its own read-only connection; sqlite3 keeps the (constant) queries prepared.
+    """
+    required_version = '1.1'
+
+    def __init__(self, path: Path, mode: Optional[str] = None, cache: Optional[str] = None):
+        """
+        :param path: snapshot file.
+        :param mode: hgvs data provider cache mode (see `hgvs.dataproviders.interface.Interface`).
+        :param cache: hgvs data provider cache file.
+        """
+        if not path.exists():
+            raise FileNotFoundError(f'no UTA snapshot: {path}')
+        self.path = path
+        self.seqfetcher = SeqFetcher()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connection_pid: Optional[int] = None
+        self.meta = {row['key']: row['value'] for row in self._fetchall('select key, value from meta')}
+        super().__init__(mode, cache)
+
+    def __str__(self) -> str:
+        return f'{type(self).__name__} <data_version:{self.data_version()}; path={self.path}>'
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # connections must not be shared with forked children
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(
+                f'file:{self.path.resolve()}?mode=ro', uri=True, check_same_thread=False)
+            self._connection.row_factory = _dict_row
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # connections are per process, hence never pickled
+        return {**self.__dict__, '_connection': None, '_connection_pid': None}
+
+    def _fetchone(self, sql: str, *args: Any) -> Optional[Dict[str, Any]]:
+        return self.connection.execute(sql, *args).fetchone()
+
+    def _fetchall(self, sql: str, *args: Any) -> List[Dict[str, Any]]:
+        return self.connection.execute(sql, *args).fetchall()
+
+    def data_version(self) -> str:
+        return self.meta['data_version']
+
+    def schema_version(self) -> str:
+        return self.meta['schema_version']
+
+    def get_seq(self, ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+        row = self._fetchone('select seq from seq where ac=?', [ac])
+        if row is None:
+            return self.seqfetcher.fetch_seq(ac, start_i, end_i)
+        return row['seq'][start_i:end_i]
+
+    def get_acs_for_protein_seq(self, seq: str) -> List[str]:
+        md5 = seq_md5(seq)
+        return [row['ac'] for row in self._fetchall('select ac from protein_md5 where md5=?', [md5])] + ['MD5_' + md5]
+
+    def get_assembly_map(self, assembly_name: str) -> Dict[str, str]:
+        return make_ac_name_map(assembly_name)
+
+    def get_gene_info(self, gene: str) -> Optional[Dict[str, Any]]:
+        return self._fetchone('select * from gene where hgnc=?', [gene])
+
+    def get_pro_ac_for_tx_ac(self, tx_ac: str) -> Optional[str]:
+        row = self._fetchone('select pro_ac from tx_to_pro where tx_ac=? order by pro_ac desc', [tx_ac])
+        return row['pro_ac'] if row else None
+
+    def get_similar_transcripts(self, tx_ac: str) -> List[Dict[str, Any]]:
+        # transcript similarities are not exported
+        return []
+
+    def get_tx_exons(self, tx_ac: str, alt_ac: str, alt_aln_method: str) -> List[Dict[str, Any]]:
+        rows = self._fetchall(
+            'select * from tx_exon_aln where tx_ac=? and alt_ac=? and alt_aln_method=? order by alt_start_i',
+            [tx_ac, alt_ac, alt_aln_method])
+        if not rows:
+            raise HGVSDataNotAvailableError(
+                f'No tx_exons for (tx_ac={tx_ac},alt_ac={alt_ac},alt_aln_method={alt_aln_method})')
+        if rows[0 if rows[0]['alt_strand'] == 1 else -1]['tx_start_i'] != 0:
+            raise HGVSDataNotAvailableError(
+                f'Alignment is incomplete; cannot use transcript for mapping'
+                f'(tx_ac={tx_ac},alt_ac={alt_ac},alt_aln_method={alt_aln_method})')
+        return rows
+
+    def get_tx_for_gene(self, gene: str) -> List[Dict[str, Any]]:
+        return self._fetchall('select * from tx_info where hgnc=?', [gene])
+
+    def get_tx_for_region(self, alt_ac: str, alt_aln_method: str, start_i: int, end_i: int) -> List[Dict[str, Any]]:
+        # same (peculiar) condition as the UTA query
+        return self._fetchall(
+            'select * from tx_span where alt_ac=? and alt_aln_method=? and start_i < ? and ? <= end_i',
+            [alt_ac, alt_aln_method, start_i, end_i])
+
+    def get_tx_spans(self, alt_ac: str, alt_aln_method: str) -> List[Dict[str, Any]]:
+        """
+        :param alt_ac: contig accession.
+        :param alt_aln_method: alignment method.
+        :return: spans (tx_ac, start_i, end_i) of all transcripts aligned to the contig (see `TranscriptIndex`).
+        """
+        return self._fetchall(
+            'select tx_ac, start_i, end_i from tx_span where alt_ac=? and alt_aln_method=?', [alt_ac, alt_aln_method])
+
+    def get_tx_identity_info(self, tx_ac: str) -> Dict[str, Any]:
+        row = self._fetchone('select * from tx_identity_info where tx_ac=?', [tx_ac])
+        if row is None:
+            raise HGVSDataNotAvailableError(f'No transcript definition for (tx_ac={tx_ac})')
+        return {**row, 'lengths': json.loads(row['lengths'])}
+
+    def get_tx_info(self, tx_ac: str, alt_ac: str, alt_aln_method: str) -> Dict[str, Any]:
+        rows = self._fetchall(
+            'select * from tx_info where tx_ac=? and alt_ac=? and alt_aln_method=?', [tx_ac, alt_ac, alt_aln_method])
+        if not rows:
+            raise HGVSDataNotAvailableError(
+                f'No tx_info for (tx_ac={tx_ac},alt_ac={alt_ac},alt_aln_method={alt_aln_method})')
+        if len(rows) > 1:
+            raise HGVSError(
+                f'Multiple ({len(rows)}) replies for tx_info(tx_ac={tx_ac},alt_ac={alt_ac},'
+                f'alt_aln_method={alt_aln_method})')
+        return rows[0]
+
+    def get_tx_mapping_options(self, tx_ac: str) -> List[Dict[str, Any]]:
+        return self._fetchall('select distinct tx_ac, alt_ac, alt_aln_method from tx_exon_aln where tx_ac=?', [tx_ac])
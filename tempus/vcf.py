@@ -1,13 +1,21 @@
 """
-Convenience functions for working with the `jamescasbon/PyVCF` library and annotation functions which draw from the VCF.
+Lightweight VCF reader (only the fields used for annotation) and annotation functions which draw from the VCF.
 """
+import bisect
+import gzip
+import io
+import re
+import struct
+import zlib
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import takewhile, chain, islice, groupby
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Iterable, List, Dict
+from typing import Iterable, List, Dict, Optional, BinaryIO, Tuple, Iterator, Union, TextIO, Sequence
 
-from more_itertools import partition, chunked
-from vcf.model import _Record, _Call
+from Bio.bgzf import BgzfReader
+from more_itertools import chunked
+import numpy as np
 
 from tempus import SimpleVariant, Assembly
 
@@ -16,7 +24,155 @@ TEMPUS_REFERENCE__ASSEMBLY: Dict[str, Assembly] = {
 }
 
 
-def simple_variants_from_record(record: _Record) -> Iterable[SimpleVariant]:
+@dataclass(frozen=True)
+class VcfHeader:
+    """
+    The parts of a VCF header used for annotation.
+    """
+    reference: Optional[str]
+    samples: Tuple[str, ...]
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> 'VcfHeader':
+        """
+        :param lines: header lines (meta-information lines followed by the #CHROM line).
+        :return: header.
+        """
+        reference, samples = None, ()
+        for line in lines:
+            if line.startswith('##reference='):
+                reference = line[len('##reference='):].rstrip('\r\n')
+            elif line.startswith('#CHROM'):
+                samples = tuple(line.rstrip('\r\n').split('\t')[9:])
+        return cls(reference=reference, samples=samples)
+
+
+@dataclass(frozen=True, eq=False)
+class VcfRecord:
+    """
+    Compact vcf record - only the fields used for annotation, per-sample data as arrays rather than call objects.
+
+        dpr :: (samples x alleles) read depth of each allele (DPR format field), 0 if missing.
+        gt :: (samples x ploidy) allele indices of the genotype calls, -1 if missing.
+    """
+    contig: str
+    pos: int
+    ref: str
+    alts: Tuple[str, ...]
+    read_depth: Optional[int]
+    samples: Tuple[str, ...]
+    dpr: np.ndarray
+    gt: np.ndarray
+
+
+_INFO_DP = re.compile(r'(?:^|;)DP=([^;]*)')
+
+
+def _format_column(calls: Sequence[str], fmt: List[str], key: str) -> List[str]:
+    if key not in fmt:
+        return ['.'] * len(calls)
+    idx = fmt.index(key)
+    values = ':'.join(calls).split(':')
+    if len(values) == len(calls) * len(fmt):
+        # every call carries every format field - slice the values of all calls at once
+        return values[idx::len(fmt)]
+    # trailing format fields may be dropped from calls
+    return [fields[idx] if idx < len(fields) else '.' for fields in (call.split(':') for call in calls)]
+
+
+def _int_matrix(cells: List[str], sep: str, width: int, missing: int, dtype: type) -> np.ndarray:
+    """
+    :param cells: per-sample values of a format field, e.g. '0/1' or '10,5'.
+    :param sep: separator of the values within a cell.
+    :param width: min number of columns, cells with fewer values are padded as missing.
+    :param missing: stands in for missing ('.') values.
+    :param dtype: integer type of the matrix.
+    :return: (samples x values) matrix.
+    :raises ValueError: if a value is not an integer.
+    """
+    row_widths = [cell.count(sep) + 1 for cell in cells]
+    width = max(width, max(row_widths, default=0))
+    if any(row_width != width for row_width in row_widths):
+        cells = [cell + (sep + '.') * (width - row_width) for cell, row_width in zip(cells, row_widths)]
+    if not cells:
+        return np.empty((0, width), dtype=dtype)
+    # converted in bulk by numpy, rather than value by value
+    text = f' {sep.join(cells).replace(sep, " ")} '.replace(' . ', f' {missing} ').replace(' . ', f' {missing} ')
+    return np.array(text.split(), dtype=dtype).reshape(len(cells), width)
+
+
+def _invalid_values(fields: List[str], key: str, error: ValueError) -> ValueError:
+    return ValueError(f'invalid {key} values of the record at {fields[0]}:{fields[1]}: {error}')
+
+
+def _parse_vcf_record(line: str, samples: Tuple[str, ...]) -> VcfRecord:
+    fields = line.rstrip('\r\n').split('\t')
+    info_dp = _INFO_DP.search(fields[7])
+    alts = tuple(fields[4].split(',')) if fields[4] != '.' else ()
+    fmt = fields[8].split(':') if len(fields) > 8 else []
+    calls = fields[9:]
+    gts = _format_column(calls, fmt, 'GT')
+    try:
+        dpr = _int_matrix(_format_column(calls, fmt, 'DPR'), ',', len(alts) + 1, 0, np.int64)
+    except ValueError as e:
+        raise _invalid_values(fields, 'DPR', e) from e
+    try:
+        gt = _int_matrix('\t'.join(gts).replace('|', '/').split('\t') if gts else gts, '/', 0, -1, np.int16)
+    except ValueError as e:
+        raise _invalid_values(fields, 'GT', e) from e
+    return VcfRecord(
+        contig=fields[0],
+        pos=int(fields[1]),
+        ref=fields[3],
+        alts=alts,
+        read_depth=int(info_dp.group(1)) if info_dp and info_dp.group(1) != '.' else None,
+        samples=samples,
+        dpr=dpr,
+        gt=gt)
+
+
+def read_vcf(vcf_io: TextIO) -> Tuple[VcfHeader, Iterator[VcfRecord]]:
+    """
+    Reads the header of a vcf stream upfront and its records lazily.
+
+    :param vcf_io: text stream of the vcf.
+    :return: header and records.
+    """
+    header_lines = []
+    for line in vcf_io:
+        header_lines.append(line)
+        if line.startswith('#CHROM'):
+            break
+    header = VcfHeader.from_lines(header_lines)
+    return header, (_parse_vcf_record(line, header.samples) for line in vcf_io if line.strip())
+
+
+def assembly_from_header(header: Sequence[bytes]) -> Assembly:
+    """
+    :param header: vcf header lines.
+    :return: reference assembly declared by the vcf header.
+    """
+    return TEMPUS_REFERENCE__ASSEMBLY[VcfHeader.from_lines(line.decode() for line in header).reference]
+
+
+def assembly_from_vcf(vcf_path: Path) -> Assembly:
+    """
+    :param vcf_path: (optionally gzipped/bgzipped) vcf file.
+    :return: reference assembly declared by the vcf header.
+    """
+    return assembly_from_header(read_vcf_header(vcf_path))
+
+
+def contigs_from_vcf(vcf_path: Path) -> List[str]:
+    """
+    :param vcf_path: (optionally gzipped/bgzipped) vcf file.
+    :return: distinct contigs of the vcf records, in order of appearance.
+    """
+    with open_vcf(vcf_path) as vcf_io:
+        return list(dict.fromkeys(line.split('\t', 1)[0] for line in vcf_io if not line.startswith('#')))
+
+
+def simple_variants_from_record(record: VcfRecord) -> Iterable[SimpleVariant]:
     """
     Produces SimpleVariants for each ALT allele at a locus.
 
@@ -24,28 +180,71 @@ def simple_variants_from_record(record: _Record) -> Iterable[SimpleVariant]:
     :return: simple variants
     """
     return (
-        SimpleVariant(contig=record.CHROM, pos=record.POS, ref=record.REF, alt=alt.sequence, alt_index=idx)
-        for idx, alt in enumerate(record.ALT, 1))
+        SimpleVariant(contig=record.contig, pos=record.pos, ref=record.ref, alt=alt, alt_index=idx)
+        for idx, alt in enumerate(record.alts, 1))
+
 
+# contig, pos, ref and alts of a vcf record
+Locus = Tuple[str, int, str, Tuple[str, ...]]
+
+
+def scan_loci(vcf: Union[Path, 'VcfShard', 'StreamVcfShard', 'RegionVcfShard']) -> Iterator[Locus]:
+    """
+    Reads the loci of a vcf without parsing the rest of its records (e.g. to look ahead at the variants of a chunk).
 
-def calls_containing_allele(record: _Record, allele_index: int) -> Iterable[_Call]:
+    :param vcf: path of the (optionally gzipped/bgzipped) vcf file, or a shard of one (or of a stream).
+    :return: contig, pos, ref and alts of each record.
+    """
+    with open_vcf(vcf) as vcf_io:
+        for line in vcf_io:
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.split('\t', 5)
+            yield fields[0], int(fields[1]), fields[3], tuple(fields[4].split(',')) if fields[4] != '.' else ()
+
+
+def locus_alleles(locus: Locus) -> List[SimpleVariant]:
+    """
+    :param locus: contig, pos, ref and alts of a vcf record.
+    :return: simple variants for each ALT allele at the locus.
+    """
+    contig, pos, ref, alts = locus
+    return [SimpleVariant(contig=contig, pos=pos, ref=ref, alt=alt, alt_index=idx) for idx, alt in enumerate(alts, 1)]
+
+
+def allele_read_depths(record: VcfRecord) -> np.ndarray:
+    """
+    :param record: site object.
+    :return: sum of read depths across all samples, per allele (zero-based allele index).
+    """
+    return record.dpr.sum(axis=0)
+
+
+def allele_carriers(record: VcfRecord) -> np.ndarray:
+    """
+    :param record: site object.
+    :return: (samples x alleles) whether the genotype call of a sample contains an allele (missing calls contain none).
+    """
+    n_alleles = max(len(record.alts) + 1, record.dpr.shape[1])
+    return (record.gt[:, :, np.newaxis] == np.arange(n_alleles)).any(axis=1)
+
+
+def samples_containing_allele(record: VcfRecord, allele_index: int) -> List[str]:
     """
     :param record: vcf site object.
     :param allele_index: zero-based allele index.
-    :return:
+    :return: samples whose genotype calls contain the allele.
     """
-    return (
-        call for call in record.samples
-        if any(int(gt_allele) == allele_index for gt_allele in call.gt_alleles))
+    return [record.samples[idx] for idx in np.flatnonzero((record.gt == allele_index).any(axis=1))]
 
 
-def read_depth_allele(record: _Record, allele_index: int) -> int:
+def read_depth_allele(record: VcfRecord, allele_index: int) -> int:
     """
     :param record: site object.
     :param allele_index: zero-based allele index
     :return: sum of allele read depths across all samples.
     """
-    return sum(call.data.DPR[allele_index] for call in record.samples)
+    return int(record.dpr[:, allele_index].sum())
 
 
 @dataclass(frozen=True)
@@ -56,7 +255,7 @@ class VcfVariantAnnotation:
     containing_samples: List[str]
 
     @classmethod
-    def from_vcf_locus(cls, locus: _Record, allele_index: int) -> 'VcfVariantAnnotation':
+    def from_vcf_locus(cls, locus: VcfRecord, allele_index: int) -> 'VcfVariantAnnotation':
         """
         Annotate a particular allele by extracting data directly from VCF.
 
@@ -64,30 +263,394 @@ class VcfVariantAnnotation:
         :param allele_index: zero-based index for the allele to be annotated.
         :return: allele annotation.
         """
-        read_depth_ref = read_depth_allele(locus, 0)
-        read_depth_alt = read_depth_allele(locus, allele_index)
-        return cls(
-            read_depth_site=locus.INFO['DP'],
-            read_depth_alt=read_depth_alt,
-            perc_reads_alt=float(read_depth_alt) / read_depth_ref,
-            containing_samples=[call.sample for call in calls_containing_allele(locus, allele_index)])
+        return cls.from_vcf_site(locus)[allele_index]
+
+    @classmethod
+    def from_vcf_site(cls, locus: VcfRecord) -> List['VcfVariantAnnotation']:
+        """
+        Annotate all alleles of a locus at once, by reductions over its (samples x alleles) depth and carrier matrices.
+
+        :param locus: vcf record for a given locus.
+        :return: allele annotations by zero-based allele index (REF first), `perc_reads_alt` is NaN without REF reads.
+        """
+        read_depths = allele_read_depths(locus)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            perc_reads = read_depths / read_depths[0]
+        carriers = allele_carriers(locus)
+        samples = np.array(locus.samples, dtype=object)
+        return [
+            cls(read_depth_site=locus.read_depth,
+                read_depth_alt=int(read_depth),
+                perc_reads_alt=float(perc_read) if read_depths[0] else float('nan'),
+                containing_samples=samples[carriers[:, allele_index]].tolist())
+            for allele_index, (read_depth, perc_read) in enumerate(zip(read_depths, perc_reads))]
+
 
+#
+# sharding
+#
 
-def split_vcf(vcf_path: Path, chunk_size: int) -> Iterable[Path]:
+def vcf_compression(vcf_path: Path) -> Optional[str]:
     """
-    A simple utility for splitting a VCF file into chunk-sized VCF files.
+    :param vcf_path: vcf file.
+    :return: 'bgzf' (block gzip), 'gzip' or None (uncompressed).
+    """
+    with vcf_path.open('rb') as vcf_io:
+        head = vcf_io.read(18)
+    if head[:2] != b'\x1f\x8b':
+        return None
+    # bgzf blocks are gzip members with a 'BC' extra subfield
+    return 'bgzf' if len(head) == 18 and head[3] & 4 and head[12:14] == b'BC' else 'gzip'
+
+
+def _open_binary(vcf_path: Path, compression: Optional[str]) -> BinaryIO:
+    if compression == 'bgzf':
+        return BgzfReader(str(vcf_path), 'rb')
+    elif compression == 'gzip':
+        return gzip.open(str(vcf_path), 'rb')
+    else:
+        return vcf_path.open('rb')
+
+
+@dataclass(frozen=True)
+class VcfShard:
+    """
+    A contiguous range of records of a VCF file, read in place (no intermediate files).
 
-    Note: all splits keep the original header.
+    Offsets point into the file for uncompressed VCFs and are virtual offsets for bgzip. (A range of a plain gzip VCF
+    is only reached by decompressing everything that precedes it - such VCFs are sharded as `StreamVcfShard`s.)
+    """
+    path: Path
+    start: int
+    end: int
+    n_records: int
 
-    :param vcf_path: input vcf file.
-    :param chunk_size: max number of records in each file.
-    :return: paths of tmp split files.
+    def read_records(self) -> List[bytes]:
+        """
+        :return: record lines of the shard.
+        """
+        compression = vcf_compression(self.path)
+        with _open_binary(self.path, compression) as vcf_io:
+            vcf_io.seek(self.start)
+            if compression == 'bgzf':
+                return [vcf_io.readline() for _ in range(self.n_records)]
+            return vcf_io.read(self.end - self.start).splitlines(keepends=True)
+
+
+@lru_cache(maxsize=16)
+def read_vcf_header(vcf_path: Path) -> Tuple[bytes, ...]:
+    """
+    :param vcf_path: (optionally gzipped/bgzipped) vcf file.
+    :return: header lines (cached per process, as every shard of a file shares them).
+    """
+    with _open_binary(vcf_path, vcf_compression(vcf_path)) as vcf_io:
+        return tuple(takewhile(lambda line: line.startswith(b'#'), iter(vcf_io.readline, b'')))
+
+
+def scan_record_offsets(vcf_path: Path, skip_records: int = 0) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    :param vcf_path: (optionally gzipped/bgzipped) vcf file.
+    :param skip_records: number of leading records to leave out.
+    :return: start and end offset (as `VcfShard` offsets) and line of each record.
+    """
+    with _open_binary(vcf_path, vcf_compression(vcf_path)) as vcf_io:
+        n_skipped = 0
+        while True:
+            offset = vcf_io.tell()
+            line = vcf_io.readline()
+            if not line:
+                break
+            if line.startswith(b'#'):
+                continue
+            if n_skipped < skip_records:
+                n_skipped += 1
+                continue
+            yield offset, vcf_io.tell(), line
+
+
+def shard_vcf(vcf_path: Path, chunk_size: int, skip_records: int = 0, by_contig: bool = False) \
+        -> Iterator[Union[VcfShard, 'StreamVcfShard']]:
+    """
+    Scans a VCF file once for the offsets of chunk-sized ranges of records.
+
+    A plain gzip VCF cannot be seeked into without decompressing everything before the offset (making every shard
+    cost as much as the records preceding it), hence its records are read along and shipped within the shards instead
+    (see `shard_vcf_stream`).
+
+    :param vcf_path: (optionally gzipped/bgzipped) vcf file.
+    :param chunk_size: max number of records in each shard.
+    :param skip_records: number of leading records to leave out (e.g. already annotated by an interrupted run).
+    :param by_contig: cut shards at contig boundaries as well, so that no shard spans contigs.
+    :return: shards.
+    """
+    compression = vcf_compression(vcf_path)
+    if compression == 'gzip':
+        with _open_binary(vcf_path, compression) as vcf_io:
+            yield from shard_vcf_stream(vcf_io, chunk_size, skip_records, by_contig=by_contig)[1]
+        return
+    with _open_binary(vcf_path, compression) as vcf_io:
+        start, n_records, n_skipped, contig = None, 0, 0, None
+        while True:
+            offset = vcf_io.tell()
+            line = vcf_io.readline()
+            if not line:
+                break
+            if line.startswith(b'#'):
+                continue
+            if n_skipped < skip_records:
+                n_skipped += 1
+                continue
+            if by_contig:
+                line_contig = line.split(b'\t', 1)[0]
+                if n_records and line_contig != contig:
+                    yield VcfShard(path=vcf_path, start=start, end=offset, n_records=n_records)
+                    start, n_records = None, 0
+                contig = line_contig
+            start = offset if start is None else start
+            n_records += 1
+            if n_records == chunk_size:
+                yield VcfShard(path=vcf_path, start=start, end=vcf_io.tell(), n_records=n_records)
+                start, n_records = None, 0
+        if n_records:
+            yield VcfShard(path=vcf_path, start=start, end=offset, n_records=n_records)
+
+
+class BgzfStreamWriter:
+    """
+    Block gzip (BGZF) writer for write-only streams such as stdout (unlike `Bio.bgzf.BgzfWriter`, which insists on a
+    readable file object).
+    """
+    # uncompressed bytes per block, as in htslib - leaves room for incompressible data within the 64KiB block limit
+    block_size = 0xff00
+
+    def __init__(self, out_io: BinaryIO, compresslevel: int = 6):
+        self._out_io = out_io
+        self._compresslevel = compresslevel
+        self._buffer = bytearray()
+
+    def _write_block(self, data: bytes):
+        compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        # gzip member with a 'BC' extra subfield holding the total block size - 1
+        self._out_io.write(
+            struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2,
+                        len(compressed) + 25)
+            + compressed + struct.pack('<II', zlib.crc32(data), len(data)))
+
+    def write(self, data: bytes):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.block_size:
+            self._write_block(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+
+    def flush(self):
+        """
+        Writes out buffered data as a (short) block.
+        """
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+        self._out_io.flush()
+
+    def close(self):
+        self.flush()
+        # empty block as end-of-file marker
+        self._write_block(b'')
+        self._out_io.flush()
+
+
+@dataclass(frozen=True)
+class StreamVcfShard:
+    """
+    A contiguous range of records of a VCF stream (e.g. stdin), which cannot be seeked - hence carries its records.
+    """
+    header: Tuple[bytes, ...]
+    records: Tuple[bytes, ...]
+
+    @property
+    def n_records(self) -> int:
+        return len(self.records)
+
+    def read_records(self) -> List[bytes]:
+        """
+        :return: record lines of the shard.
+        """
+        return list(self.records)
+
+
+def shard_vcf_stream(vcf_io: BinaryIO, chunk_size: int, skip_records: int = 0, by_contig: bool = False) -> Tuple[
+        Tuple[bytes, ...], Iterator[StreamVcfShard]]:
+    """
+    Reads the header of a VCF stream upfront and its records lazily, one chunk at a time.
+
+    :param vcf_io: binary (optionally gzipped/bgzipped) vcf stream, read sequentially.
+    :param chunk_size: max number of records in each shard.
+    :param skip_records: number of leading records to leave out (e.g. already annotated by an interrupted run).
+    :param by_contig: cut shards at contig boundaries as well, so that no shard spans contigs.
+    :return: header lines and shards.
+    """
+    if isinstance(vcf_io, io.BufferedReader) and vcf_io.peek(2)[:2] == b'\x1f\x8b':
+        # bgzip is a special case of (multi-member) gzip
+        vcf_io = gzip.GzipFile(fileobj=vcf_io, mode='rb')
+    lines = iter(vcf_io.readline, b'')
+    header: List[bytes] = []
+    for line in lines:
+        if not line.startswith(b'#'):
+            lines = chain((line,), lines)
+            break
+        header.append(line)
+    lines = islice(lines, skip_records, None)
+    chunks = (
+        chunk for _, contig_lines in groupby(lines, key=lambda line: line.split(b'\t', 1)[0])
+        for chunk in chunked(contig_lines, chunk_size)) if by_contig else chunked(lines, chunk_size)
+    return tuple(header), (StreamVcfShard(header=tuple(header), records=tuple(records)) for records in chunks)
+
+
+#
+# regions
+#
+
+# max position of a tabix index
+MAX_POS = 2 ** 29
+
+
+@dataclass(frozen=True)
+class Region:
+    """
+    Genomic region. [1-based, inclusive - as in 'contig:start-end']
+    """
+    contig: str
+    start: int = 1
+    end: int = MAX_POS
+
+    @classmethod
+    def parse(cls, region: str) -> 'Region':
+        """
+        :param region: 'contig', 'contig:start' (through the end of the contig) or 'contig:start-end'.
+        :return: region.
+        """
+        match = re.fullmatch(r'([^:\s]+)(?::([\d,]+)(?:-([\d,]+))?)?', region.strip())
+        if not match:
+            raise ValueError(f'invalid region: {region}')
+        contig, start, end = match.groups()
+        region = cls(
+            contig=contig, start=int(start.replace(',', '')) if start else 1,
+            end=int(end.replace(',', '')) if end else MAX_POS)
+        if not 1 <= region.start <= region.end:
+            raise ValueError(f'invalid region: {region}')
+        return region
+
+    def __str__(self) -> str:
+        return f'{self.contig}:{self.start}-{self.end}'
+
+
+def read_bed(bed_path: Path) -> List[Region]:
+    """
+    :param bed_path: BED file (0-based, half-open intervals).
+    :return: regions of the file.
+    """
+    regions = []
+    with bed_path.open() as bed_io:
+        for line in bed_io:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            contig, start, end = line.split('\t')[:3]
+            regions.append(Region(contig=contig, start=int(start) + 1, end=int(end)))
+    return regions
+
+
+def merge_regions(regions: Iterable[Region], contigs: Sequence[str]) -> List[Region]:
+    """
+    :param regions: regions.
+    :param contigs: contigs (of a vcf) in order - regions of other contigs are left out.
+    :return: non-overlapping regions, ordered by contig and start.
+    """
+    contig_order = {contig: idx for idx, contig in enumerate(contigs)}
+    merged: List[Region] = []
+    for region in sorted(
+            (region for region in regions if region.contig in contig_order),
+            key=lambda region: (contig_order[region.contig], region.start)):
+        if merged and merged[-1].contig == region.contig and region.start <= merged[-1].end + 1:
+            merged[-1] = Region(region.contig, merged[-1].start, max(merged[-1].end, region.end))
+        else:
+            merged.append(region)
+    return merged
+
+
+def _fetch_region(tabix, region: Region) -> Iterator[str]:
+    # records starting within the region (tabix also yields those which merely overlap it)
+    for line in tabix.fetch(region.contig, region.start - 1, region.end):
+        if region.start <= int(line.split('\t', 2)[1]) <= region.end:
+            yield line
+
+
+@dataclass(frozen=True)
+class RegionVcfShard:
+    """
+    Records of a bgzipped, tabix-indexed VCF file starting within a region - read through the index (requires the
+    optional `pysam` dependency), hence only the blocks of the region are decompressed.
+
+        skip :: number of leading records of the region to leave out.
+    """
+    path: Path
+    region: Region
+    n_records: int
+    skip: int = 0
+
+    def read_records(self) -> List[bytes]:
+        """
+        :return: record lines of the shard.
+        """
+        import pysam
+        with pysam.TabixFile(str(self.path)) as tabix:
+            return [
+                f'{line}\n'.encode()
+                for line in islice(_fetch_region(tabix, self.region), self.skip, self.skip + self.n_records)]
+
+
+def is_tabix_indexed(vcf_path: Path) -> bool:
+    return vcf_compression(vcf_path) == 'bgzf' and any(
+        vcf_path.with_name(vcf_path.name + suffix).exists() for suffix in ('.tbi', '.csi'))
+
+
+def shard_vcf_regions(vcf_path: Path, regions: Iterable[Region], chunk_size: int, skip_records: int = 0) \
+        -> Iterator[RegionVcfShard]:
+    """
+    Cuts the records within given regions of a bgzipped, tabix-indexed VCF file into blocks of about `chunk_size`
+    records - contiguous ranges of a single contig, cut between positions - reading only the requested ranges.
+
+    :param vcf_path: bgzipped vcf file, with a tabix (.tbi or .csi) index.
+    :param regions: regions (merged where they overlap, left out for contigs without records).
+    :param chunk_size: min number of records in each shard (unless it is the last of its region).
+    :param skip_records: number of leading records (of all regions) to leave out.
+    :return: shards, in vcf order.
+    """
+    import pysam
+    if not is_tabix_indexed(vcf_path):
+        raise ValueError(f'region queries require a bgzipped, tabix-indexed vcf: {vcf_path}')
+    with pysam.TabixFile(str(vcf_path)) as tabix:
+        for region in merge_regions(regions, tabix.contigs):
+            positions = [int(line.split('\t', 2)[1]) for line in _fetch_region(tabix, region)]
+            skip = min(skip_records, len(positions))
+            skip_records -= skip
+            start_idx = skip
+            for idx in range(skip + 1, len(positions) + 1):
+                if idx == len(positions) or idx - start_idx >= chunk_size and positions[idx] != positions[idx - 1]:
+                    # blocks start at the first record of their position, unless resuming in the middle of one
+                    block_skip = start_idx - bisect.bisect_left(positions, positions[start_idx])
+                    yield RegionVcfShard(
+                        path=vcf_path, region=Region(region.contig, positions[start_idx], positions[idx - 1]),
+                        n_records=idx - start_idx, skip=block_skip)
+                    start_idx = idx
+
+
+def open_vcf(vcf: Union[Path, VcfShard, StreamVcfShard, RegionVcfShard]) -> TextIO:
+    """
+    :param vcf: (optionally gzipped/bgzipped) vcf file, or a shard of one.
+    :return: text stream of the vcf (a shard comes with the header of its file).
     """
-    with vcf_path.open() as vcf_io:
-        records, header = partition(lambda line: line.startswith('#'), vcf_io)
-        for n, chunk in enumerate(chunked(records, chunk_size)):
-            header = header if isinstance(header, tuple) else tuple(header)
-            with NamedTemporaryFile(mode='w', suffix='.vcf', delete=False) as out_io:
-                out_io.writelines(header)
-                out_io.writelines(chunk)
-            yield Path(out_io.name)
+    if isinstance(vcf, (VcfShard, RegionVcfShard)):
+        return io.StringIO(b''.join(read_vcf_header(vcf.path) + tuple(vcf.read_records())).decode())
+    elif isinstance(vcf, StreamVcfShard):
+        return io.StringIO(b''.join(vcf.header + vcf.records).decode())
+    return gzip.open(str(vcf), 'rt') if vcf_compression(vcf) else vcf.open()
@@ -0,0 +1,29 @@
+from typing import List
+
+import pytest
+
+from tempus import SimpleVariant, SequenceAlteration, FeatureVariant
+from tempus.annotation import VariantAnnotation
+from tempus.exac import ExacVariantAnnotation
+from tempus.hgvs import HgvsVariantAnnotation
+from tempus.vcf import VcfVariantAnnotation
+
+
+@pytest.fixture(scope='session')
+def annotations() -> List[VariantAnnotation]:
+    from hgvs.parser import Parser
+    hgvs_parser = Parser()
+    return [
+        VariantAnnotation(
+            var=SimpleVariant(contig='1', pos=931393 + idx, ref='G', alt='T', alt_index=1),
+            vcf=VcfVariantAnnotation(
+                read_depth_site=4124, read_depth_alt=95, perc_reads_alt=95 / 4029, containing_samples=['vaf5']),
+            hgvs=HgvsVariantAnnotation(
+                hgvs_c=hgvs_parser.parse_hgvs_variant('NM_001291366.1:c.1A>T') if idx % 2 else None,
+                hgvs_p=None,
+                feature_variant=FeatureVariant.MISSENSE if idx % 2 else None,
+                hgvs_g=hgvs_parser.parse_hgvs_variant(f'NC_000001.10:g.{931393 + idx}G>T'),
+                sequence_alteration=SequenceAlteration.SUBSTITUTION,
+                gene='SAMD11' if idx % 2 else None),
+            exac=ExacVariantAnnotation(allele_frequency=None if idx % 3 else 0.25, consequences=['missense_variant']))
+        for idx in range(25)]
@@ -0,0 +1,106 @@
+import asyncio
+import io
+import json
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from types import SimpleNamespace
+from typing import Iterator, List
+
+import pytest
+
+from tempus import SimpleVariant, SequenceAlteration
+from tempus.aio import AsyncExacClient, annotate_records_async
+from tempus.exac import ExacVariantAnnotation
+from tempus.hgvs import HgvsVariantAnnotation
+from tempus.vcf import read_vcf
+
+
+class _FlakyExacHandler(BaseHTTPRequestHandler):
+    """
+    Serves the allele frequency from the variant position, failing the first request for every variant.
+    """
+    attempts: Counter = Counter()
+
+    def do_GET(self):
+        var_id = self.path.rsplit('/', 1)[-1]
+        self.attempts[var_id] += 1
+        if self.attempts[var_id] == 1:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps({'variant': {'allele_freq': int(var_id.split('-')[1]) / 1000}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_exac_url() -> Iterator[str]:
+    _FlakyExacHandler.attempts = Counter()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FlakyExacHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/rest'
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_exac_client(stub_exac_url: str):
+    variants = [SimpleVariant(contig='1', pos=pos, ref='C', alt='A') for pos in range(100, 120)]
+    client = AsyncExacClient(api_base_url=stub_exac_url, concurrency=4, backoff=0.01, rate_limit=1000)
+
+    async def annotate_all() -> List[ExacVariantAnnotation]:
+        return await asyncio.gather(*(client.annotate(variant) for variant in variants))
+
+    loop = asyncio.new_event_loop()
+    try:
+        anns = loop.run_until_complete(annotate_all())
+    finally:
+        loop.close()
+        client.close()
+
+    assert anns == [ExacVariantAnnotation(allele_frequency=v.pos / 1000, consequences=[]) for v in variants]
+    assert set(_FlakyExacHandler.attempts.values()) == {2}
+
+
+def test_annotate_records_async_failure(monkeypatch):
+    monkeypatch.setattr(HgvsVariantAnnotation, 'from_simple_variant', classmethod(
+        lambda *_: HgvsVariantAnnotation(hgvs_c=None, hgvs_p=None, feature_variant=None, hgvs_g=None,
+                                         sequence_alteration=SequenceAlteration.SUBSTITUTION, gene=None)))
+    cancelled: List[int] = []
+
+    async def annotate(variant: SimpleVariant) -> ExacVariantAnnotation:
+        if variant.pos == 100:
+            await asyncio.sleep(0.01)
+            raise RuntimeError('ExAC is down')
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(variant.pos)
+            raise
+
+    _, records = read_vcf(io.StringIO(
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tnormal\n' + ''.join(
+            f'1\t{pos}\t.\tC\tA\t.\t.\tDP=10\tGT:DPR\t0/1:5,5\n' for pos in (100, 200, 300))))
+    annotations = annotate_records_async(
+        SimpleNamespace(data_version='fake', snv_fast_path=True), records,
+        SimpleNamespace(api_base_url='fake', annotate=annotate), window=10)
+
+    async def annotate_all() -> list:
+        return [ann async for ann in annotations]
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(RuntimeError, match='ExAC is down'):
+            loop.run_until_complete(annotate_all())
+        # the requests still in flight are cancelled rather than left behind
+        assert cancelled == [200, 300]
+        assert not asyncio.all_tasks(loop)
+    finally:
+        loop.close()
@@ -1,11 +1,155 @@
+import io
+import pickle
+from dataclasses import replace
 from pathlib import Path
+from types import SimpleNamespace
+from typing import List
 
 import pytest
+from vcf import Reader
 
-from tempus.annotation import annotate_vcf
+from tempus import FeatureVariant, SequenceAlteration, SimpleVariant
+from tempus.annotation import annotate_vcf, VcfAnnotationWriter, tabix_index_vcf, annotate_vcf_record, \
+    PreviousAnnotations, write_annotations_to_csv, annotation_to_csv_row, CompactAnnotation, compact_annotations, \
+    AlleleAnnotator
+from tempus.cache import AnnotationCache
+from tempus.exac import ExacVariantAnnotation
+from tempus.vcf import read_vcf_header, shard_vcf, vcf_compression, read_vcf, VcfVariantAnnotation
 
 
 @pytest.mark.parametrize('vcf_path', [Path('test/data/data_sys_test.vcf')])
 def test_an(vcf_path: Path):
     anns = tuple(annotate_vcf(vcf_path))
     assert anns
+
+
+def test_allele_annotator_exac_variant(tmp_path: Path):
+    normalized: List[str] = []
+
+    def normalize(hgvs_g: str) -> str:
+        normalized.append(hgvs_g)
+        return hgvs_g
+
+    # 5'-normalization shifts indels by one base
+    hgvs_machinery = SimpleNamespace(
+        data_version='fake', snv_fast_path=True, normalizer_5p=SimpleNamespace(normalize=normalize),
+        hgvs_from_simple_variant=lambda variant, **_: (variant.contig, variant.pos, variant.ref, variant.alt),
+        simple_variant_from_hgvs=lambda hgvs_g: SimpleVariant(
+            contig=hgvs_g[0], pos=hgvs_g[1] - 1, ref=hgvs_g[2], alt=hgvs_g[3]))
+    variants = [SimpleVariant(contig='1', pos=pos, ref='CA', alt='C', alt_index=1) for pos in (100, 200)]
+    expected = [SimpleVariant(contig='1', pos=pos, ref='CA', alt='C') for pos in (99, 199)]
+    cache = AnnotationCache(tmp_path / 'cache.sqlite')
+    allele_annotator = AlleleAnnotator.from_machinery(hgvs_machinery, cache)
+
+    # normalized from the variant asked about, once per variant
+    assert [allele_annotator.exac_variant(variant) for variant in variants * 2] == expected * 2
+    assert AlleleAnnotator.from_machinery(hgvs_machinery, cache).exac_variant(variants[1]) == expected[1]
+    assert normalized == [('1', 100, 'CA', 'C'), ('1', 200, 'CA', 'C')]
+    # substitutions cannot shuffle
+    snv = SimpleVariant(contig='1', pos=300, ref='C', alt='A', alt_index=1)
+    assert allele_annotator.exac_variant(snv) == replace(snv, alt_index=None)
+    assert len(normalized) == 2
+
+
+def test_vcf_annotation_writer(annotations, tmp_path: Path):
+    pysam = pytest.importorskip('pysam')
+    vcf_path = Path('test/data/Challenge_data.vcf')
+    header = read_vcf_header(vcf_path)
+    shards = list(shard_vcf(vcf_path, 10))[:3]
+    out_path = tmp_path / 'annotated.vcf.gz'
+    with out_path.open('wb') as out_io, VcfAnnotationWriter(out_io, header) as writer:
+        for idx, shard in enumerate(shards):
+            writer.write(shard.read_records(), annotations[idx * 10:(idx + 1) * 10])
+    assert vcf_compression(out_path) == 'bgzf'
+    tabix_index_vcf(out_path)
+
+    records = list(Reader(filename=str(out_path)))
+    assert len(records) == 25
+    assert records[1].INFO['TEMPUS_GENE'] == 'SAMD11' and 'TEMPUS_GENE' not in records[0].INFO
+    assert records[0].INFO['TEMPUS_CONTAINING_SAMPLES'] == ['vaf5']
+    assert records[0].INFO['TEMPUS_EXAC_AF'] == 0.25
+    assert records[0].INFO['TEMPUS_HGVS_G'] == 'NC_000001.10:g.931393G>T'.replace(':', '%3A')
+    # original INFO is kept
+    assert records[0].INFO['DP'] == int(shards[0].read_records()[0].split(b'DP=')[1].split(b';')[0])
+
+    first, last = records[0], records[-1]
+    with pysam.TabixFile(str(out_path)) as tabix_file:
+        fetched = list(tabix_file.fetch(first.CHROM, first.POS - 1, last.POS))
+    assert len(fetched) == sum(1 for record in records if record.CHROM == first.CHROM)
+
+
+def test_annotate_vcf_record_escapes(annotations):
+    ann = annotations[1]
+    ann = replace(ann, hgvs=replace(ann.hgvs, gene='A=B;C D'))
+    record = annotate_vcf_record(b'1\t10\t.\tG\tT\t.\t.\t.\tGT\t0/1\n', ann)
+    fields = record.decode().rstrip('\n').split('\t')
+    assert fields[7].startswith('TEMPUS_ALT_INDEX=1;')
+    assert 'TEMPUS_GENE=A%3DB%3BC%20D' in fields[7].split(';')
+    assert fields[8:] == ['GT', '0/1']
+
+
+def test_previous_annotations_reuse(annotations, tmp_path: Path):
+    csv_path = tmp_path / 'previous.csv'
+    with csv_path.open('w') as out_io:
+        write_annotations_to_csv(annotations, out_io)
+    previous = PreviousAnnotations.from_csv(csv_path)
+    assert len(previous) == len(annotations)
+
+    vcf_io = io.StringIO(
+        '##reference=/data/human_g1k_v37.fasta\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tnormal\tvaf5\n'
+        '1\t931394\t.\tG\tT\t.\t.\tDP=100\tGT:DPR\t0/0:50,0\t0/1:40,10\n'
+        '1\t931394\t.\tG\tT,C\t.\t.\tDP=100\tGT:DPR\t0/0:50,0,0\t0/1:40,10,0\n'
+        '1\t931394\t.\tG\tC\t.\t.\tDP=100\tGT:DPR\t0/0:50,0\t0/1:40,10\n')
+    _, records = read_vcf(vcf_io)
+    biallelic, multiallelic, changed = records
+
+    reused = previous.reuse(biallelic)
+    assert annotation_to_csv_row(replace(reused, vcf=annotations[1].vcf)) == annotation_to_csv_row(annotations[1])
+    # vcf fields come from the current record
+    assert reused.vcf == VcfVariantAnnotation(
+        read_depth_site=100, read_depth_alt=10, perc_reads_alt=10 / 90, containing_samples=['vaf5'])
+    assert previous.reuse(multiallelic) is None
+    assert previous.reuse(changed) is None
+
+
+def test_previous_annotations_reuse_rare_allele(annotations, tmp_path: Path):
+    rare = replace(
+        annotations[1], exac=ExacVariantAnnotation(allele_frequency=1.2e-05, consequences=['intron_variant']))
+    csv_path = tmp_path / 'previous.csv'
+    with csv_path.open('w') as out_io:
+        write_annotations_to_csv([rare], out_io)
+    previous = PreviousAnnotations.from_csv(csv_path)
+
+    _, records = read_vcf(io.StringIO(
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tnormal\tvaf5\n'
+        '1\t931394\t.\tG\tT\t.\t.\tDP=100\tGT:DPR\t0/0:50,0\t0/1:40,10\n'))
+    # reused at full precision, for the typed outputs as well
+    assert previous.reuse(next(records)).exac == rare.exac
+
+
+def test_compact_annotation(annotations):
+    compact = CompactAnnotation.from_annotation(annotations[3])
+    assert CompactAnnotation.from_annotation(compact) is compact
+    assert compact.sequence_alteration is SequenceAlteration.SUBSTITUTION
+    assert compact.feature_variant is FeatureVariant.MISSENSE
+    assert CompactAnnotation.from_annotation(annotations[0]).feature_variant is None
+    assert compact.csv_row() == annotation_to_csv_row(annotations[3]) == {
+        'var_contig': '1', 'var_pos': 931396, 'var_ref': 'G', 'var_alt': 'T', 'var_alt_index': 1,
+        'vcf_read_depth_site': 4124, 'vcf_read_depth_alt': 95, 'vcf_perc_reads_alt': 0.02,
+        'vcf_containing_samples': ['vaf5'], 'hgvs_sequence_alteration': 'substitution',
+        'hgvs_feature_variant': 'missense_variant', 'hgvs_hgvs_g': 'NC_000001.10:g.931396G>T',
+        'hgvs_hgvs_c': 'NM_001291366.1:c.1A>T', 'hgvs_hgvs_p': None, 'hgvs_gene': 'SAMD11',
+        'exac_allele_frequency': 0.25, 'exac_consequences': ['missense_variant']}
+    assert pickle.loads(pickle.dumps(compact)) == compact
+    assert len(pickle.dumps(compact)) * 4 < len(pickle.dumps(annotations[3]))
+
+    # written the same either way
+    compacts = compact_annotations(annotations)
+    full_io, compact_io = io.StringIO(), io.StringIO()
+    write_annotations_to_csv(annotations, full_io)
+    write_annotations_to_csv(compacts, compact_io)
+    assert compact_io.getvalue() == full_io.getvalue()
+    record = b'1\t10\t.\tG\tT\t.\t.\t.\tGT\t0/1\n'
+    assert [annotate_vcf_record(record, ann) for ann in compacts] == [
+        annotate_vcf_record(record, ann) for ann in annotations]
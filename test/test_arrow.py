@@ -0,0 +1,48 @@
+import csv
+import io
+from pathlib import Path
+
+import pytest
+
+from tempus.annotation import write_annotations_to_csv, CSV_FIELDNAMES
+
+pa = pytest.importorskip('pyarrow')
+pytest.importorskip('pyarrow.parquet')
+
+from tempus.arrow import ArrowAnnotationWriter, SCHEMA  # noqa: E402
+
+
+def test_schema():
+    # columns as the csv output, in the same order
+    assert tuple(SCHEMA.names) == CSV_FIELDNAMES
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+@pytest.mark.parametrize('row_group_size', [1, 10, 100])
+def test_arrow_annotation_writer(annotations, tmp_path: Path, output_format: str, row_group_size: int):
+    out_path = tmp_path / f'annotations.{output_format}'
+    with ArrowAnnotationWriter(str(out_path), output_format, row_group_size) as writer:
+        writer.write(annotations[:7])
+        writer.write(annotations[7:])
+
+    if output_format == 'parquet':
+        parquet_file = pa.parquet.ParquetFile(str(out_path))
+        assert parquet_file.num_row_groups == -(-len(annotations) // row_group_size)
+        table = parquet_file.read()
+    else:
+        table = pa.ipc.open_file(str(out_path)).read_all()
+
+    rows = table.to_pylist()
+    assert [row['vcf_containing_samples'] for row in rows] == [['vaf5']] * len(annotations)
+    assert [row['exac_consequences'] for row in rows] == [['missense_variant']] * len(annotations)
+    assert rows[0]['vcf_perc_reads_alt'] == 95 / 4029
+    assert rows[1]['exac_allele_frequency'] is None
+
+    # same values as the csv output, less the stringified lists and rounding
+    out_io = io.StringIO()
+    write_annotations_to_csv(annotations, out_io)
+    out_io.seek(0)
+    for row, csv_row in zip(rows, csv.DictReader(out_io)):
+        for key in ('var_contig', 'var_pos', 'hgvs_sequence_alteration', 'hgvs_feature_variant', 'hgvs_hgvs_g',
+                    'hgvs_hgvs_c', 'hgvs_gene'):
+            assert ('' if row[key] is None else str(row[key])) == csv_row[key]
@@ -0,0 +1,61 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Sequence
+
+from tempus import SimpleVariant
+from tempus.cache import AnnotationCache
+from tempus.exac import ExacVariantAnnotation
+
+_VARIANTS = [SimpleVariant(contig='1', pos=pos, ref='C', alt='A') for pos in range(100, 110)]
+
+
+def test_memoize_batch(tmp_path: Path):
+    computed: List[SimpleVariant] = []
+
+    def annotate(variants: Sequence[SimpleVariant]) -> List[ExacVariantAnnotation]:
+        computed.extend(variants)
+        return [ExacVariantAnnotation(allele_frequency=v.pos / 1000, consequences=['intron_variant']) for v in variants]
+
+    cache = AnnotationCache(tmp_path / 'cache.sqlite')
+    memoized = cache.memoize_batch('exac', 'v1', annotate)
+    first = memoized(_VARIANTS[:5])
+    second = memoized(_VARIANTS)
+
+    assert computed == _VARIANTS
+    assert second[:5] == first
+    assert second == annotate(_VARIANTS)
+    assert (cache.hits['exac'], cache.misses['exac']) == (5, 10)
+
+    # a new data version does not see old entries
+    cache.memoize_batch('exac', 'v2', annotate)(_VARIANTS[:1])
+    assert cache.misses['exac'] == 11
+
+    cache.flush_stats()
+    assert cache.stats() == {'exac': {'hits': 5, 'misses': 11}}
+
+
+def test_eviction(tmp_path: Path):
+    cache = AnnotationCache(tmp_path / 'cache.sqlite', max_entries=4, evict_every=1)
+    for variant in _VARIANTS:
+        cache.put_many('hgvs', 'v1', [(variant, variant.pos)])
+    assert cache.get_many('hgvs', 'v1', _VARIANTS) == [None] * 6 + [106, 107, 108, 109]
+
+
+def test_shared_between_instances(tmp_path: Path):
+    cache = AnnotationCache(tmp_path / 'cache.sqlite')
+    cache.put_many('hgvs', 'v1', [(_VARIANTS[0], 'ann')])
+    unpickled = pickle.loads(pickle.dumps(cache))
+    assert unpickled.get_many('hgvs', 'v1', _VARIANTS[:1]) == ['ann']
+
+
+def test_shared_between_threads(tmp_path: Path):
+    cache = AnnotationCache(tmp_path / 'cache.sqlite')
+
+    def put_get(variant: SimpleVariant):
+        cache.put_many('hgvs', 'v1', [(variant, variant.pos)])
+        return cache.get_many('hgvs', 'v1', [variant])[0]
+
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(put_get, _VARIANTS)) == [variant.pos for variant in _VARIANTS]
+    assert cache.hits['hgvs'] == len(_VARIANTS)
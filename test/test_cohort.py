@@ -0,0 +1,116 @@
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+import tempus.commands as commands
+from tempus import SimpleVariant, SequenceAlteration, FeatureVariant
+from tempus.cohort import CohortVariants, output_paths
+from tempus.exac import ExacVariantAnnotation
+from tempus.hgvs import HgvsVariantAnnotation
+from tempus.vcf import locus_alleles
+
+_VCF_PATH = Path('test/data/Challenge_data.vcf')
+
+_FEATURE_VARIANTS = [None, FeatureVariant.SYNONYMOUS, FeatureVariant.MISSENSE, FeatureVariant.FRAMESHIFT]
+
+
+class _FakeAnnotations:
+    """
+    Deterministic stand-ins for hgvs and ExAC, recording the variants they were asked about.
+    """
+
+    def __init__(self):
+        self.hgvs_calls: List[SimpleVariant] = []
+        self.exac_calls: List[SimpleVariant] = []
+        # 5'-normalization shifts indels by one base, so that the ExAC annotations tell whether it was applied
+        self.hgvs_machinery = SimpleNamespace(
+            data_version='fake', snv_fast_path=True, sequence_fetcher=None, prefetch_transcripts=lambda _: None,
+            hgvs_from_simple_variant=lambda variant, **_: f'{variant.contig}:{variant.pos}:{variant.ref}:{variant.alt}',
+            normalizer_5p=SimpleNamespace(normalize=lambda hgvs_g: hgvs_g),
+            simple_variant_from_hgvs=lambda hgvs_g: SimpleVariant(
+                contig=hgvs_g.split(':')[0], pos=int(hgvs_g.split(':')[1]) - 1, ref=hgvs_g.split(':')[2],
+                alt=hgvs_g.split(':')[3]))
+
+    def annotate_hgvs(self, _, variant: SimpleVariant) -> HgvsVariantAnnotation:
+        self.hgvs_calls.append(variant)
+        return HgvsVariantAnnotation(
+            hgvs_c=None, hgvs_p=None, feature_variant=_FEATURE_VARIANTS[(variant.pos + len(variant.alt)) % 4],
+            hgvs_g=f'{variant.contig}:{variant.pos}:{variant.ref}:{variant.alt}',
+            sequence_alteration=SequenceAlteration.SUBSTITUTION, gene=None)
+
+    def annotate_exac(self, variants: List[SimpleVariant]) -> List[ExacVariantAnnotation]:
+        self.exac_calls.extend(variants)
+        return [ExacVariantAnnotation(allele_frequency=variant.pos % 100 / 100, consequences=[
+            f'{variant.pos}{variant.ref}>{variant.alt}']) for variant in variants]
+
+
+@pytest.fixture
+def fakes(monkeypatch) -> _FakeAnnotations:
+    fakes = _FakeAnnotations()
+    monkeypatch.setattr(commands.HgvsMachinery, 'from_assembly', lambda *args, **kwargs: fakes.hgvs_machinery)
+    monkeypatch.setattr(
+        HgvsVariantAnnotation, 'from_simple_variant',
+        classmethod(lambda _, hgvs_machinery, variant: fakes.annotate_hgvs(hgvs_machinery, variant)))
+    monkeypatch.setattr(commands, '_exac_annotator', lambda *_: (fakes.annotate_exac, 'fake'))
+    return fakes
+
+
+@pytest.fixture
+def cohort_vcfs(tmp_path: Path) -> List[Path]:
+    lines = _VCF_PATH.read_text().splitlines(keepends=True)
+    header = [line for line in lines if line.startswith('#')]
+    records = [line for line in lines if not line.startswith('#')]
+    # a tumor and a normal sample of the same panel, and an overlapping one
+    vcfs = [tmp_path / 'tumor.vcf', tmp_path / 'normal.vcf', tmp_path / 'other.vcf']
+    vcfs[0].write_text(''.join(header + records))
+    vcfs[1].write_text(''.join(header + records[::2]))
+    vcfs[2].write_text(''.join(header + records[3000:4000]))
+    return vcfs
+
+
+def _options(mode: str = 'threads') -> commands._AnnotateOptions:
+    return commands._AnnotateOptions(
+        mode=mode, exac_batch_size=0, exac_sites=None, exac_concurrency=1, exac_rate_limit=None, cache=None,
+        transcript_index=None, previous=None)
+
+
+def test_cohort_variants(cohort_vcfs: List[Path]):
+    cohort = CohortVariants.from_vcfs(cohort_vcfs)
+    assert cohort.n_records == 6977 + 3489 + 1000
+    assert len(cohort.loci) == 6977
+    alleles = cohort.alleles
+    assert len(alleles) == len(set(alleles)) >= len(cohort.loci)
+    assert all(variant.alt_index is None for variant in alleles)
+    assert locus_alleles(('1', 10, 'A', ('C', 'G'))) == [
+        SimpleVariant('1', 10, 'A', 'C', 1), SimpleVariant('1', 10, 'A', 'G', 2)]
+
+
+def test_output_paths(tmp_path: Path):
+    assert output_paths([Path('a/tumor.vcf.gz'), Path('b/normal.vcf')], tmp_path, '.csv') == [
+        tmp_path / 'tumor.csv', tmp_path / 'normal.csv']
+    with pytest.raises(ValueError):
+        output_paths([Path('a/tumor.vcf.gz'), Path('b/tumor.vcf')], tmp_path, '.csv')
+
+
+def test_handle_annotate_cohort(fakes: _FakeAnnotations, cohort_vcfs: List[Path], tmp_path: Path):
+    expected = []
+    for vcf in cohort_vcfs:
+        expected_path = tmp_path / f'{vcf.stem}.expected.csv'
+        commands.handle_annotate(
+            in_vcf=vcf, out=expected_path, max_workers=2, chunk_size=500, window=0, output_format='csv',
+            row_group_size=0, resume=False, options=_options())
+        expected.append(expected_path.read_text())
+    fakes.hgvs_calls.clear()
+    fakes.exac_calls.clear()
+
+    out_dir = tmp_path / 'cohort'
+    commands.handle_annotate_cohort(
+        in_vcfs=cohort_vcfs, out_dir=out_dir, max_workers=2, chunk_size=500, window=0, output_format='csv',
+        row_group_size=0, options=_options())
+    # same output as annotating each vcf on its own
+    assert [(out_dir / f'{vcf.stem}.csv').read_text() for vcf in cohort_vcfs] == expected
+    # every distinct allele annotated once
+    assert len(fakes.hgvs_calls) == len(set(fakes.hgvs_calls)) == len(CohortVariants.from_vcfs(cohort_vcfs).alleles)
+    assert len(fakes.exac_calls) == len(set(fakes.exac_calls)) <= 6977
@@ -1,7 +1,48 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from typing import Iterator, List
+
 import pytest
 
 from tempus import SimpleVariant
-from tempus.exac import ExacVariantAnnotation
+from tempus.exac import ExacVariantAnnotation, ExacBulkClient
+
+_STUB_VARIANTS = {
+    '1-935222-C-A': {
+        'variant': {'allele_freq': 0.66},
+        'consequence': {'intron_variant': {}, 'missense_variant': {}}},
+    '1-1277533-T-C': {
+        'variant': {'allele_freq': 1.0},
+        'consequence': {'synonymous_variant': {}}},
+}
+
+
+class _StubExacHandler(BaseHTTPRequestHandler):
+    requests: List[List[str]] = []
+
+    def do_POST(self):
+        var_ids = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append(var_ids)
+        body = json.dumps({var_id: _STUB_VARIANTS.get(var_id, {}) for var_id in var_ids}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_exac_url() -> Iterator[str]:
+    _StubExacHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), _StubExacHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/rest'
+    server.shutdown()
+    server.server_close()
 
 
 @pytest.mark.parametrize('variant', [
@@ -11,3 +52,21 @@ def test_annotate_variant_exac(variant: SimpleVariant):
     ann = ExacVariantAnnotation.from_simple_variant(variant)
     assert ann.allele_frequency
     assert ann.consequences
+
+
+def test_annotate_variants_exac_bulk(stub_exac_url: str):
+    variants = [
+        SimpleVariant(contig='1', pos=935222, ref='C', alt='A'),
+        SimpleVariant(contig='1', pos=1, ref='G', alt='T'),
+        SimpleVariant(contig='1', pos=1277533, ref='T', alt='C'),
+    ]
+    client = ExacBulkClient(api_base_url=stub_exac_url, batch_size=2)
+    anns = list(client.annotate(variants))
+
+    assert anns == [
+        ExacVariantAnnotation(allele_frequency=0.66, consequences=['intron_variant', 'missense_variant']),
+        ExacVariantAnnotation(allele_frequency=None, consequences=[]),
+        ExacVariantAnnotation(allele_frequency=1.0, consequences=['synonymous_variant']),
+    ]
+    assert _StubExacHandler.requests == [['1-935222-C-A', '1-1-G-T'], ['1-1277533-T-C']]
+    assert len(client.batch_latencies) == 2
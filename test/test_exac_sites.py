@@ -0,0 +1,60 @@
+import gzip
+
+import pytest
+
+from tempus import SimpleVariant
+from tempus.exac import ExacVariantAnnotation
+from tempus.exac_sites import ExacSitesIndex, minimal_representation
+
+_SITES_VCF = (
+    '##fileformat=VCFv4.1\n'
+    '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. '
+    'Format: Allele|Consequence|Gene|ALLELE_NUM">\n'
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    '1\t935222\t.\tC\tA,T\t100\tPASS\tAC_Adj=66,1;AN_Adj=100;'
+    'CSQ=A|missense_variant|HES4|1,A|intron_variant&non_coding_transcript_variant|HES4|1,T|synonymous_variant|HES4|2\n'
+    '1\t100\t.\tCAT\tCGT,C\t100\tPASS\tAC_Adj=0,3;AN_Adj=0\n'
+    '2\t500\t.\tG\tT\t100\tPASS\tAF=0.25\n')
+
+
+@pytest.fixture(scope='module', params=['vcf', 'vcf.gz'])
+def sites_index(request, tmp_path_factory) -> ExacSitesIndex:
+    tmp_path = tmp_path_factory.mktemp('sites')
+    sites_vcf = tmp_path / f'sites.{request.param}'
+    with (gzip.open(str(sites_vcf), 'wt') if request.param.endswith('gz') else sites_vcf.open('w')) as sites_io:
+        sites_io.write(_SITES_VCF)
+    ExacSitesIndex.build(sites_vcf, tmp_path / 'index')
+    return ExacSitesIndex.open(tmp_path / 'index')
+
+
+@pytest.mark.parametrize('variant, ann', [
+    pytest.param(
+        SimpleVariant(contig='1', pos=935222, ref='C', alt='A'),
+        ExacVariantAnnotation(allele_frequency=0.66, consequences=['missense_variant', 'intron_variant']), id='snp'),
+    pytest.param(
+        SimpleVariant(contig='1', pos=935222, ref='C', alt='T'),
+        ExacVariantAnnotation(allele_frequency=0.01, consequences=['synonymous_variant']), id='multiallelic'),
+    pytest.param(
+        SimpleVariant(contig='1', pos=101, ref='A', alt='G'),
+        ExacVariantAnnotation(allele_frequency=None, consequences=[]), id='minimal-snp'),
+    pytest.param(
+        SimpleVariant(contig='1', pos=100, ref='CAT', alt='C'),
+        ExacVariantAnnotation(allele_frequency=None, consequences=[]), id='del'),
+    pytest.param(
+        SimpleVariant(contig='2', pos=500, ref='G', alt='T'),
+        ExacVariantAnnotation(allele_frequency=0.25, consequences=[]), id='af'),
+    pytest.param(
+        SimpleVariant(contig='2', pos=500, ref='G', alt='C'),
+        ExacVariantAnnotation(allele_frequency=None, consequences=[]), id='absent'),
+    pytest.param(
+        SimpleVariant(contig='X', pos=500, ref='G', alt='C'),
+        ExacVariantAnnotation(allele_frequency=None, consequences=[]), id='absent-contig'),
+])
+def test_annotate_variant_exac_sites(sites_index: ExacSitesIndex, variant: SimpleVariant, ann: ExacVariantAnnotation):
+    assert sites_index.annotate_batch([variant]) == [ann]
+
+
+def test_minimal_representation():
+    assert minimal_representation(100, 'CAT', 'CGT') == (101, 'A', 'G')
+    assert minimal_representation(100, 'CAT', 'C') == (100, 'CAT', 'C')
+    assert minimal_representation(100, 'CTT', 'CT') == (100, 'CT', 'C')
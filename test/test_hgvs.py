@@ -1,7 +1,20 @@
+from dataclasses import replace
+from itertools import islice
+from pathlib import Path
+from typing import List
+
+import numpy as np
 import pytest
+from bioutils.sequences import reverse_complement
+from hgvs.exceptions import HGVSInvalidVariantError
+from hgvs.parser import Parser
 
 from tempus import Assembly, SimpleVariant
-from tempus.hgvs import HgvsMachinery
+from tempus.hgvs import HgvsMachinery, TranscriptIndex, HgvsVariantAnnotation
+from tempus.snv import is_snv
+from tempus.uta_snapshot import UtaSnapshot, export_uta_snapshot
+from tempus.vcf import open_vcf, read_vcf, simple_variants_from_record
+from test.test_uta_snapshot import _FakeUta, _TX_SEQ
 
 
 @pytest.fixture(scope='module')
@@ -24,3 +37,104 @@ def test_hgvs_simple_variant_conversions(hgvs_machinery: HgvsMachinery, variant:
 
     _variant = hgvs_machinery.simple_variant_from_hgvs(hgvs_g)
     assert _variant == variant
+
+
+@pytest.fixture(scope='module')
+def hgvs_parser() -> Parser:
+    return Parser()
+
+
+@pytest.fixture(scope='module')
+def transcript_index() -> TranscriptIndex:
+    return TranscriptIndex(
+        assembly_name='GRCh37', alt_aln_method='splign',
+        starts={'NC_000001.10': np.array([10, 50, 100]), 'NC_000002.11': np.array([], dtype=np.int64)},
+        ends={'NC_000001.10': np.array([200, 60, 150]), 'NC_000002.11': np.array([], dtype=np.int64)},
+        tx_acs={'NC_000001.10': np.array(['NM_A', 'NM_B', 'NR_C']), 'NC_000002.11': np.array([], dtype=str)})
+
+
+@pytest.mark.parametrize('hgvs_g_str, tx_acs', [
+    pytest.param('NC_000001.10:g.55C>T', ['NM_A', 'NM_B'], id='nested'),
+    pytest.param('NC_000001.10:g.120C>T', ['NM_A', 'NR_C'], id='overlapping'),
+    pytest.param('NC_000001.10:g.10C>T', [], id='first-base'),
+    pytest.param('NC_000001.10:g.200C>T', ['NM_A'], id='last-base'),
+    pytest.param('NC_000001.10:g.145_155del', ['NM_A'], id='partial-overlap'),
+    pytest.param('NC_000002.11:g.100C>T', [], id='no-transcripts'),
+])
+def test_transcript_index(
+        hgvs_parser: Parser, transcript_index: TranscriptIndex, tmp_path: Path, hgvs_g_str: str, tx_acs: List[str]):
+    """
+    Note: mirrors the UTA `tx_for_region` query - transcripts must contain the variant.
+    """
+    hgvs_g = hgvs_parser.parse_hgvs_variant(hgvs_g_str)
+    assert transcript_index.relevant_transcripts(hgvs_g) == tx_acs
+
+    transcript_index.save(tmp_path / 'transcripts.npz')
+    assert TranscriptIndex.load(tmp_path / 'transcripts.npz').relevant_transcripts(hgvs_g) == tx_acs
+
+
+def test_snv_fast_path_matches_hgvs(hgvs_machinery: HgvsMachinery):
+    """
+    Note: cross-checks the local SNV classification against the full hgvs g_to_c -> c_to_p path.
+    """
+    full_hgvs_machinery = replace(hgvs_machinery, transcript_models=None)
+    with open_vcf(Path('test/data/Challenge_data.vcf')) as vcf_io:
+        _, records = read_vcf(vcf_io)
+        snvs = [variant for record in islice(records, 300) for variant in simple_variants_from_record(record)
+                if is_snv(variant.ref, variant.alt)]
+    assert snvs
+    for variant in snvs:
+        fast = HgvsVariantAnnotation.from_simple_variant(hgvs_machinery, variant)
+        full = HgvsVariantAnnotation.from_simple_variant(full_hgvs_machinery, variant)
+        assert (str(fast.hgvs_g), str(fast.hgvs_c), str(fast.hgvs_p), fast.feature_variant, fast.gene) == \
+               (str(full.hgvs_g), str(full.hgvs_c), str(full.hgvs_p), full.feature_variant, full.gene), variant
+
+
+@pytest.fixture(scope='module')
+def offline_hgvs_machinery(tmp_path_factory) -> HgvsMachinery:
+    """
+    Machinery over the transcripts of the fake UTA snapshot, with a reference genome agreeing with them.
+    """
+    tmp_path = tmp_path_factory.mktemp('offline')
+    chr1, chr2 = list('ACGT' * 300), list('TGCA' * 100)
+    for (start_i, end_i), seq in [((100, 110), _TX_SEQ[:10]), ((200, 215), _TX_SEQ[10:]),
+                                  ((1000, 1010), _TX_SEQ[:10]), ((1100, 1115), _TX_SEQ[10:])]:
+        chr1[start_i:end_i] = seq
+    for (start_i, end_i), seq in [((300, 310), _TX_SEQ[:10]), ((200, 215), _TX_SEQ[10:])]:
+        chr2[start_i:end_i] = reverse_complement(seq)
+    fasta = tmp_path / 'reference.fa'
+    fasta.write_text(f'>NC_000001.10\n{"".join(chr1)}\n>NC_000002.11\n{"".join(chr2)}\n')
+    snapshot = UtaSnapshot(export_uta_snapshot(_FakeUta(), tmp_path / 'uta.sqlite', 'GRCh37'))
+    return HgvsMachinery.from_assembly(Assembly.GRCH37, data_provider=snapshot, local_reference=fasta)
+
+
+def test_snv_fast_path_matches_hgvs_offline(offline_hgvs_machinery: HgvsMachinery):
+    """
+    Note: as `test_snv_fast_path_matches_hgvs`, for every substitution within (and around) the exons of the snapshot.
+    """
+    full_hgvs_machinery = replace(offline_hgvs_machinery, transcript_models=None)
+    fetcher = offline_hgvs_machinery.sequence_fetcher
+    snvs = [
+        SimpleVariant(contig=contig, pos=pos, ref=ref, alt=alt)
+        for contig, alt_ac, spans in [('1', 'NC_000001.10', [(98, 112), (198, 217), (1000, 1010)]),
+                                      ('2', 'NC_000002.11', [(198, 217), (298, 312)])]
+        for start_i, end_i in spans for pos in range(start_i + 1, end_i + 1)
+        for ref in [fetcher.fetch_seq(alt_ac, pos - 1, pos)] for alt in 'ACGT' if alt != ref]
+    fast_paths = 0
+    for variant in snvs:
+        fast = HgvsVariantAnnotation.from_simple_variant(offline_hgvs_machinery, variant)
+        full = HgvsVariantAnnotation.from_simple_variant(full_hgvs_machinery, variant)
+        assert (str(fast.hgvs_g), str(fast.hgvs_c), str(fast.hgvs_p), fast.feature_variant, fast.gene) == \
+               (str(full.hgvs_g), str(full.hgvs_c), str(full.hgvs_p), full.feature_variant, full.gene), variant
+        fast_paths += fast.hgvs_c is not None
+    assert fast_paths > len(snvs) / 2
+
+
+@pytest.mark.parametrize('variant', [
+    pytest.param(SimpleVariant(contig='1', pos=101, ref='G', alt='T'), id='utr'),
+    pytest.param(SimpleVariant(contig='1', pos=106, ref='C', alt='G'), id='coding'),
+    pytest.param(SimpleVariant(contig='2', pos=205, ref='G', alt='C'), id='reverse-strand'),
+])
+def test_snv_fast_path_validates_reference(offline_hgvs_machinery: HgvsMachinery, variant: SimpleVariant):
+    with pytest.raises(HGVSInvalidVariantError, match='does not agree with reference sequence'):
+        HgvsVariantAnnotation.from_simple_variant(offline_hgvs_machinery, variant)
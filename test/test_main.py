@@ -0,0 +1,227 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import pytest
+from docopt import DocoptExit
+
+import tempus.commands as commands
+from tempus import Assembly, SimpleVariant, SequenceAlteration
+from tempus.__main__ import cli
+from tempus.annotation import VariantAnnotation
+from tempus.checkpoint import Checkpoint
+from tempus.exac import ExacVariantAnnotation
+from tempus.hgvs import HgvsVariantAnnotation
+from tempus.profiling import PROFILE
+from tempus.uta_snapshot import export_uta_snapshot
+from tempus.vcf import VcfVariantAnnotation, open_vcf, read_vcf, Region
+from test.test_uta_snapshot import _FakeUta
+
+_VCF_PATH = Path('test/data/Challenge_data.vcf')
+
+# position of the first record of the chunk to fail on (inherited by forked workers)
+_fail_at_pos: Optional[int] = None
+
+
+def _fake_init_worker(*_):
+    pass
+
+
+def _fake_annotate_vcf(vcf_shard, options) -> List[VariantAnnotation]:
+    with open_vcf(vcf_shard) as vcf_io:
+        _, records = read_vcf(vcf_io)
+        records = list(records)
+    if records[0].pos == _fail_at_pos:
+        raise RuntimeError('worker died')
+    with PROFILE.stage('fake.annotate'):
+        return [
+            VariantAnnotation(
+                var=SimpleVariant(
+                    contig=record.contig, pos=record.pos, ref=record.ref, alt=record.alts[0], alt_index=1),
+                vcf=VcfVariantAnnotation.from_vcf_locus(record, 1),
+                hgvs=HgvsVariantAnnotation(
+                    hgvs_c=None, hgvs_p=None, feature_variant=None, hgvs_g=None,
+                    sequence_alteration=SequenceAlteration.SUBSTITUTION, gene=None),
+                exac=ExacVariantAnnotation(allele_frequency=None, consequences=[]))
+            for record in records]
+
+
+@pytest.fixture
+def fake_workers(monkeypatch):
+    monkeypatch.setattr(commands, '_init_worker', _fake_init_worker)
+    monkeypatch.setattr(commands, '_annotate_vcf', _fake_annotate_vcf)
+
+
+def _annotate(out: Path, resume: bool, profile_out: Optional[Path] = None, mode: str = 'sync',
+              in_vcf: Path = _VCF_PATH, regions: Optional[List[Region]] = None, schedule: str = 'fixed',
+              cost_model: Optional[Path] = None):
+    options = commands._AnnotateOptions(
+        mode=mode, exac_batch_size=0, exac_sites=None, exac_concurrency=1, exac_rate_limit=None, cache=None,
+        transcript_index=None, previous=None, profile=bool(profile_out))
+    commands.handle_annotate(
+        in_vcf=in_vcf, out=out, max_workers=2, chunk_size=500, window=0, output_format='csv',
+        row_group_size=0, resume=resume, options=options, profile_out=str(profile_out) if profile_out else None,
+        regions=regions, schedule=schedule, cost_model=cost_model)
+
+
+def test_handle_annotate_resume(fake_workers, tmp_path: Path, monkeypatch):
+    expected_path = tmp_path / 'expected.csv'
+    _annotate(expected_path, resume=False)
+
+    with open_vcf(_VCF_PATH) as vcf_io:
+        _, records = read_vcf(vcf_io)
+        positions = [record.pos for record in records]
+    out_path = tmp_path / 'out.csv'
+    checkpoint_path = Checkpoint.path_for(out_path)
+    monkeypatch.setattr(f'{__name__}._fail_at_pos', positions[1500])
+    with pytest.raises(RuntimeError):
+        _annotate(out_path, resume=True)
+    assert Checkpoint.load(checkpoint_path).records == 1500
+    # a partially written chunk
+    with out_path.open('a') as out_io:
+        out_io.write('1,12')
+
+    monkeypatch.setattr(f'{__name__}._fail_at_pos', None)
+    _annotate(out_path, resume=True)
+    assert out_path.read_text() == expected_path.read_text()
+    assert not checkpoint_path.exists()
+
+
+def test_handle_annotate_resume_lost_output(fake_workers, tmp_path: Path, monkeypatch):
+    out_path = tmp_path / 'out.csv'
+    Checkpoint(vcf=str(_VCF_PATH), output_format='csv', records=500, out_bytes=100).save(
+        Checkpoint.path_for(out_path))
+    monkeypatch.setattr(sys, 'argv', ['tempus', 'annotate', str(_VCF_PATH), str(out_path), '--resume'])
+    with pytest.raises(ValueError, match='cannot resume: .* is missing'):
+        _annotate(out_path, resume=True)
+    with pytest.raises(DocoptExit, match='cannot resume'):
+        cli()
+
+    # shorter than checkpointed - left as is
+    out_path.write_text('var_contig')
+    with pytest.raises(ValueError, match='cannot resume: .* less than the 100 written'):
+        _annotate(out_path, resume=True)
+    with pytest.raises(DocoptExit, match='cannot resume'):
+        cli()
+    assert out_path.read_text() == 'var_contig'
+
+
+def test_handle_annotate_profile(fake_workers, tmp_path: Path):
+    profile_path = tmp_path / 'profile.json'
+    try:
+        _annotate(tmp_path / 'out.csv', resume=False, profile_out=profile_path)
+    finally:
+        PROFILE.enabled = False
+        PROFILE.drain()
+    report = json.loads(profile_path.read_text())
+    n_chunks = -(-report['records'] // 500)
+    # aggregated across both workers
+    assert report['stages']['fake.annotate']['calls'] == n_chunks
+    assert report['stages']['output.write']['calls'] == n_chunks
+    assert report['stages']['fake.annotate']['p50_ms'] <= report['stages']['fake.annotate']['max_ms']
+
+
+@pytest.mark.parametrize('profile', [False, True])
+def test_handle_annotate_threads(fake_workers, tmp_path: Path, profile: bool):
+    expected_path = tmp_path / 'expected.csv'
+    _annotate(expected_path, resume=False)
+    out_path = tmp_path / 'out.csv'
+    profile_path = tmp_path / 'profile.json' if profile else None
+    try:
+        _annotate(out_path, resume=False, profile_out=profile_path, mode='threads')
+    finally:
+        PROFILE.enabled = False
+        PROFILE.drain()
+    assert out_path.read_text() == expected_path.read_text()
+    if profile:
+        report = json.loads(profile_path.read_text())
+        assert report['stages']['fake.annotate']['calls'] == -(-report['records'] // 500)
+
+
+@pytest.mark.parametrize('mode', ['sync', 'threads'])
+def test_handle_annotate_guided(fake_workers, tmp_path: Path, mode: str, monkeypatch):
+    expected_path = tmp_path / 'expected.csv'
+    _annotate(expected_path, resume=False)
+    out_path, model_path = tmp_path / 'out.csv', tmp_path / 'model.json'
+    _annotate(out_path, resume=False, mode=mode, schedule='guided', cost_model=model_path)
+    assert out_path.read_text() == expected_path.read_text()
+    n_observations = json.loads(model_path.read_text())['n_observations']
+    assert n_observations > 1
+    # refined further by the next run
+    _annotate(out_path, resume=False, mode=mode, schedule='guided', cost_model=model_path)
+    assert out_path.read_text() == expected_path.read_text()
+    assert json.loads(model_path.read_text())['n_observations'] > n_observations
+    with pytest.raises(ValueError):
+        _annotate(out_path, resume=False, schedule='guided', regions=[Region('1', 1, 10**6)])
+    gzip_path = tmp_path / 'in.vcf.gz'
+    with gzip.open(str(gzip_path), 'wb') as gzip_io:
+        gzip_io.write(_VCF_PATH.read_bytes())
+    with pytest.raises(ValueError, match='bgzip'):
+        _annotate(out_path, resume=False, in_vcf=gzip_path, schedule='guided')
+    monkeypatch.setattr(sys, 'argv', ['tempus', 'annotate', str(gzip_path), str(out_path), '--schedule=guided'])
+    with pytest.raises(DocoptExit, match='bgzip'):
+        cli()
+
+
+def test_thread_worker_contexts(monkeypatch):
+    monkeypatch.setattr(commands.HgvsMachinery, 'from_assembly', lambda *args, **kwargs: object())
+    options = commands._AnnotateOptions(
+        mode='threads', exac_batch_size=0, exac_sites=None, exac_concurrency=1, exac_rate_limit=None, cache=None,
+        transcript_index=None, previous=None)
+    shared = commands._SharedResources.load(options)
+    both_started = threading.Barrier(2)
+
+    def worker_context(_) -> commands._WorkerContext:
+        both_started.wait(timeout=10)
+        return commands._thread_context.context
+
+    with ThreadPoolExecutor(2, initializer=commands._init_worker, initargs=(Assembly.GRCH37, options, shared)) as pool:
+        contexts = list(pool.map(worker_context, range(2)))
+    # a data provider per thread, nothing set up for the process
+    assert contexts[0].hgvs_machinery is not contexts[1].hgvs_machinery
+    assert commands._worker_context is None
+
+
+def _worker_state(_) -> Tuple[int, bool]:
+    return os.getpid(), commands._worker_context is not None
+
+
+def test_forkserver_workers(tmp_path: Path):
+    options = commands._AnnotateOptions(
+        mode='sync', exac_batch_size=0, exac_sites=None, exac_concurrency=1, exac_rate_limit=None, cache=None,
+        transcript_index=None, previous=None, start_method='forkserver',
+        uta=export_uta_snapshot(_FakeUta(), tmp_path / 'uta.sqlite', 'GRCh37'))
+    with commands._worker_pool(2, Assembly.GRCH37, options) as pool:
+        states = list(pool.map(_worker_state, range(4)))
+    # set up in processes of their own
+    assert all(set_up for _, set_up in states)
+    assert os.getpid() not in {pid for pid, _ in states}
+
+
+def test_handle_annotate_regions(fake_workers, tmp_path: Path):
+    pysam = pytest.importorskip('pysam')
+    vcf_path = tmp_path / 'in.vcf'
+    vcf_path.write_bytes(_VCF_PATH.read_bytes())
+    vcf_path = Path(pysam.tabix_index(str(vcf_path), preset='vcf'))
+    expected_path, out_path = tmp_path / 'expected.csv', tmp_path / 'out.csv'
+    _annotate(expected_path, resume=False)
+    _annotate(out_path, resume=False, in_vcf=vcf_path, regions=[Region.parse('3'), Region.parse('1:1-2000000')])
+
+    expected_lines = expected_path.read_text().splitlines()
+    assert out_path.read_text().splitlines() == expected_lines[:1] + [
+        line for line in expected_lines[1:] if line.startswith('1,') and int(line.split(',')[1]) <= 2000000] + [
+        line for line in expected_lines[1:] if line.startswith('3,')]
+
+
+def test_cli_imports():
+    # `--help` and argument errors need none of the annotation modules
+    imported = subprocess.run(
+        [sys.executable, '-c', 'import sys, tempus.__main__; print(" ".join(sorted(sys.modules)))'],
+        capture_output=True, text=True, check=True).stdout.split()
+    assert not {'hgvs', 'vcf', 'numpy', 'requests', 'tempus.commands'} & set(imported)
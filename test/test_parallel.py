@@ -0,0 +1,25 @@
+import time
+from concurrent.futures.thread import ThreadPoolExecutor
+
+from tempus.parallel import imap_ordered
+
+
+def test_imap_ordered():
+    pulled = []
+
+    def items():
+        for item in range(20):
+            pulled.append(item)
+            yield item
+
+    def task(item: int) -> int:
+        # later items complete first
+        time.sleep((20 - item) * 0.001)
+        return item * 2
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = imap_ordered(executor, task, items(), window=3)
+        assert next(results) == (0, 0)
+        # no more than the window is ever pulled ahead of the consumer
+        assert len(pulled) == 4
+        assert list(results) == [(item, item * 2) for item in range(1, 20)]
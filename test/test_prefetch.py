@@ -0,0 +1,139 @@
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pytest
+from hgvs.exceptions import HGVSDataNotAvailableError
+
+from tempus import Assembly, SimpleVariant
+from tempus.hgvs import HgvsMachinery
+from tempus.prefetch import TranscriptPrefetcher, _TX_IDENTITY_INFO_SQL, _TX_INFO_SQL, _TX_EXONS_SQL, \
+    _TX_TO_PRO_SQL, _TX_SEQ_SQL
+from tempus.uta_snapshot import UtaSnapshot, export_uta_snapshot
+from test.test_uta_snapshot import _FakeUta as _SnapshotUta
+
+
+def _exons(tx_ac: str, strand: int, tx_starts: List[int]) -> List[Dict[str, Any]]:
+    return [
+        {'tx_ac': tx_ac, 'alt_ac': 'NC_1', 'alt_strand': strand, 'alt_aln_method': 'splign', 'ord': ord_,
+         'tx_start_i': tx_start_i, 'tx_end_i': tx_start_i + 10, 'alt_start_i': 100 * ord_, 'alt_end_i': 100 * ord_ + 10,
+         'cigar': '10='}
+        for ord_, tx_start_i in enumerate(tx_starts)]
+
+
+# NM_C.1 is aligned incompletely, NR_D.1 is non-coding
+_EXONS = _exons('NM_A.1', 1, [0, 10]) + _exons('NM_B.1', -1, [10, 0]) + _exons('NM_C.1', 1, [5, 15])
+
+
+class _FakeUta:
+    """
+    Answers the single and the bulk queries of a few transcripts, recording the single ones.
+    """
+
+    def __init__(self):
+        self.calls: List[tuple] = []
+
+    def _fetchall(self, sql: str, args: List[Any]) -> List[Dict[str, Any]]:
+        tx_acs = args[0]
+        if sql == _TX_IDENTITY_INFO_SQL:
+            return [{'tx_ac': tx_ac, 'hgnc': tx_ac[3]} for tx_ac in tx_acs if tx_ac != 'NM_E.1']
+        elif sql == _TX_INFO_SQL:
+            return [{'tx_ac': tx_ac, 'cds_start_i': 0} for tx_ac in tx_acs if tx_ac != 'NM_E.1']
+        elif sql == _TX_EXONS_SQL:
+            return [exon for exon in _EXONS if exon['tx_ac'] in tx_acs]
+        elif sql == _TX_TO_PRO_SQL:
+            return [{'tx_ac': tx_ac, 'pro_ac': tx_ac.replace('NM_', 'NP_')} for tx_ac in tx_acs if tx_ac == 'NM_A.1']
+        elif sql == _TX_SEQ_SQL:
+            return [{'ac': tx_ac, 'seq': 'ACGT' * 5} for tx_ac in tx_acs]
+        raise AssertionError(f'unexpected query: {sql}')
+
+    def get_tx_identity_info(self, tx_ac: str) -> Dict[str, Any]:
+        self.calls.append(('get_tx_identity_info', tx_ac))
+        if tx_ac == 'NM_E.1':
+            raise HGVSDataNotAvailableError(tx_ac)
+        return {'tx_ac': tx_ac, 'hgnc': tx_ac[3]}
+
+    def get_tx_info(self, tx_ac: str, alt_ac: str, alt_aln_method: str) -> Dict[str, Any]:
+        self.calls.append(('get_tx_info', tx_ac))
+        return {'tx_ac': tx_ac, 'cds_start_i': 0}
+
+    def get_tx_exons(self, tx_ac: str, alt_ac: str, alt_aln_method: str) -> List[Dict[str, Any]]:
+        self.calls.append(('get_tx_exons', tx_ac))
+        raise HGVSDataNotAvailableError(tx_ac)
+
+    def get_pro_ac_for_tx_ac(self, tx_ac: str) -> Optional[str]:
+        self.calls.append(('get_pro_ac_for_tx_ac', tx_ac))
+        return None
+
+    def get_seq(self, ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+        self.calls.append(('get_seq', ac))
+        return ('N' * 100)[start_i:end_i]
+
+
+def test_prefetched():
+    hdp = _FakeUta()
+    prefetcher = TranscriptPrefetcher(hdp, 'splign')
+    prefetcher.prefetch('NC_1', ['NM_A.1', 'NM_B.1', 'NM_C.1', 'NR_D.1'], ['NM_A.1', 'NM_B.1', 'NM_C.1'])
+    assert hdp.get_tx_identity_info('NR_D.1')['hgnc'] == 'D'
+    assert hdp.get_tx_info('NM_B.1', 'NC_1', 'splign')['cds_start_i'] == 0
+    assert [exon['ord'] for exon in hdp.get_tx_exons('NM_B.1', 'NC_1', 'splign')] == [0, 1]
+    assert hdp.get_pro_ac_for_tx_ac('NM_A.1') == 'NP_A.1'
+    assert hdp.get_pro_ac_for_tx_ac('NM_B.1') is None
+    assert hdp.get_seq('NM_A.1', 2, 6) == 'GTAC'
+    assert hdp.calls == []
+
+    # not prefetched (the incompletely aligned transcript, other contigs, genomic sequences) - queried as usual
+    with pytest.raises(HGVSDataNotAvailableError):
+        hdp.get_tx_exons('NM_C.1', 'NC_1', 'splign')
+    hdp.get_tx_info('NM_A.1', 'NC_2', 'splign')
+    assert hdp.get_seq('NC_1', 0, 3) == 'NNN'
+    assert hdp.calls == [('get_tx_exons', 'NM_C.1'), ('get_tx_info', 'NM_A.1'), ('get_seq', 'NC_1')]
+
+
+def test_prefetch_once():
+    hdp = _FakeUta()
+    prefetcher = TranscriptPrefetcher(hdp, 'splign')
+    queries = []
+    fetchall = hdp._fetchall
+    hdp._fetchall = lambda sql, args: queries.append(sql) or fetchall(sql, args)
+    prefetcher.prefetch('NC_1', ['NM_A.1', 'NR_D.1'], ['NM_A.1'])
+    assert len(queries) == 5
+    prefetcher.prefetch('NC_1', ['NM_A.1', 'NR_D.1'], ['NM_A.1'])
+    assert len(queries) == 5
+    prefetcher.prefetch('NC_1', ['NM_A.1', 'NM_B.1'], [])
+    assert queries[5:] == [_TX_IDENTITY_INFO_SQL]
+
+    # transcripts the bulk query has no rows for raise as usual
+    prefetcher.prefetch('NC_1', ['NM_E.1'])
+    with pytest.raises(HGVSDataNotAvailableError):
+        hdp.get_tx_identity_info('NM_E.1')
+
+
+def test_prefetch_eviction():
+    hdp = _FakeUta()
+    prefetcher = TranscriptPrefetcher(hdp, 'splign', maxsize=2)
+    prefetcher.prefetch('NC_1', ['NM_A.1', 'NM_B.1', 'NR_D.1'])
+    assert len(prefetcher) == 2
+    # least recently used first
+    hdp.get_tx_identity_info('NM_A.1')
+    assert hdp.calls == [('get_tx_identity_info', 'NM_A.1')]
+
+
+def test_prefetch_transcripts(tmp_path: Path):
+    prefetched = []
+    snapshot = UtaSnapshot(export_uta_snapshot(_SnapshotUta(), tmp_path / 'uta.sqlite', 'GRCh37'))
+    hgvs_machinery = HgvsMachinery.from_assembly(Assembly.GRCH37, data_provider=snapshot)
+    # a UTA snapshot is local already, hence not prefetched from
+    assert hgvs_machinery.prefetcher is None
+    hgvs_machinery.prefetch_transcripts([SimpleVariant('1', 106, 'A', 'G')])
+
+    class _RecordingPrefetcher:
+        def prefetch(self, alt_ac, tx_acs, coding_tx_acs=()):
+            prefetched.append((alt_ac, sorted(tx_acs), sorted(coding_tx_acs)))
+
+    hgvs_machinery = replace(hgvs_machinery, prefetcher=_RecordingPrefetcher())
+    hgvs_machinery.prefetch_transcripts([
+        SimpleVariant('1', 106, 'A', 'G'), SimpleVariant('1', 1005, 'C', 'T'), SimpleVariant('2', 207, 'C', 'T'),
+        SimpleVariant('unplaced', 10, 'C', 'T')])
+    assert sorted(prefetched) == [
+        ('NC_000001.10', ['NM_A.1', 'NM_C.1'], ['NM_A.1', 'NM_C.1']), ('NC_000002.11', ['NM_B.1'], ['NM_B.1'])]
@@ -0,0 +1,48 @@
+import pickle
+
+import pytest
+
+from tempus.profiling import Profile, StageStats
+
+
+def test_stage_stats_percentiles():
+    stats = StageStats()
+    for ms in range(1, 101):
+        stats.add(ms / 1000)
+    assert stats.calls == 100
+    assert stats.max == pytest.approx(0.1)
+    # within the histogram resolution
+    assert stats.percentile(50) == pytest.approx(0.05, rel=0.05)
+    assert stats.percentile(99) == pytest.approx(0.099, rel=0.05)
+    assert stats.percentile(100) == pytest.approx(0.1)
+
+
+def test_profile_merge():
+    profile = Profile(enabled=True)
+    for _ in range(3):
+        try:
+            with profile.stage('failing'):
+                raise KeyError('swallowed')
+        except KeyError:
+            pass
+    with profile.stage('ok'):
+        pass
+
+    # as shipped from a worker
+    worker_profile = pickle.loads(pickle.dumps(profile.drain()))
+    assert not profile.stages
+    merged = Profile()
+    merged.merge(worker_profile)
+    merged.merge(worker_profile)
+    report = merged.report()
+    assert report['failing']['calls'] == 6
+    assert report['failing']['errors'] == {'KeyError': 6}
+    assert report['ok']['calls'] == 2
+    assert report['ok']['errors'] == {}
+
+
+def test_profile_disabled():
+    profile = Profile()
+    with profile.stage('noop'):
+        pass
+    assert profile.report() == {}
@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import List, Sequence
+
+import pytest
+
+from tempus import SimpleVariant
+from tempus.exac import ExacVariantAnnotation
+from tempus.replay import ExacReplay, ExacResponseNotRecorded, connect_data_provider
+
+_VARIANTS = [
+    SimpleVariant(contig='1', pos=935222, ref='C', alt='A'),
+    SimpleVariant(contig='1', pos=1277533, ref='T', alt='C'),
+]
+
+
+def test_exac_replay(tmp_path: Path):
+    recorded: List[List[SimpleVariant]] = []
+
+    def annotator(variants: Sequence[SimpleVariant]) -> List[ExacVariantAnnotation]:
+        recorded.append(list(variants))
+        return [ExacVariantAnnotation(allele_frequency=variant.pos / 1e7, consequences=['missense_variant'])
+                for variant in variants]
+
+    recording = ExacReplay(path=tmp_path / 'exac.json', record=annotator)
+    expected = recording(_VARIANTS[:1])
+    assert recording(_VARIANTS) == expected + annotator(_VARIANTS[1:])
+    # only the variants not recorded yet are delegated
+    assert recorded[:2] == [_VARIANTS[:1], _VARIANTS[1:]]
+
+    replay = ExacReplay.from_fixtures(tmp_path)
+    assert len(replay) == 2
+    assert replay(_VARIANTS[::-1]) == recording(_VARIANTS[::-1])
+    with pytest.raises(ExacResponseNotRecorded):
+        replay([SimpleVariant(contig='1', pos=1, ref='A', alt='G')])
+
+
+def test_missing_fixtures(tmp_path: Path):
+    with pytest.raises(FileNotFoundError):
+        ExacReplay.from_fixtures(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        connect_data_provider(tmp_path)
@@ -0,0 +1,128 @@
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pytest
+from Bio.bgzf import BgzfWriter
+
+from tempus.hgvs import TranscriptIndex
+from tempus.scheduling import CostModel, RecordFeatures, guided_shards, FEATURES
+from tempus.vcf import VcfShard, shard_vcf
+
+_VCF_PATH = Path('test/data/Challenge_data.vcf')
+
+
+@pytest.fixture(scope='module')
+def records() -> RecordFeatures:
+    return RecordFeatures.scan(_VCF_PATH)
+
+
+def test_cost_model(tmp_path: Path):
+    model = CostModel()
+    assert model.cost(np.ones(len(FEATURES))) > 0
+    true_weights = np.array([2e-4, 1e-3, 3e-3, 1e-2, 2e-2])
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        features = rng.integers(0, 100, len(FEATURES)).astype(float)
+        model.observe(features, features @ true_weights)
+    assert model.n_observations == 200
+    # close to the measurements, despite the prior
+    features = rng.integers(0, 100, (50, len(FEATURES))).astype(float)
+    assert np.allclose(model.cost(features), features @ true_weights, rtol=0.1)
+    assert model.weights[2] == pytest.approx(3e-3, rel=0.1)
+    assert (model.weights > 0).all()
+
+    model_path = tmp_path / 'model.json'
+    model.save(model_path)
+    loaded = CostModel.load(model_path)
+    assert loaded.n_observations == 200
+    assert np.allclose(loaded.weights, model.weights)
+    assert loaded.cost(np.ones(len(FEATURES))) == pytest.approx(model.cost(np.ones(len(FEATURES))))
+
+
+def test_record_features(records: RecordFeatures):
+    assert len(records) == 6977
+    assert (records.features[:, 0] == 1).all()
+    # alleles are either SNVs or not; no transcripts probed
+    assert (records.features[:, 1] + records.features[:, 3] >= 1).all()
+    assert (records.features[:, [2, 4]] == 0).all()
+    assert records.contig_starts[0] == 0
+
+    # offsets as `shard_vcf` cuts them
+    shard = next(shard_vcf(_VCF_PATH, 10))
+    assert (int(records.starts[0]), int(records.ends[9])) == (shard.start, shard.end)
+    assert len(RecordFeatures.scan(_VCF_PATH, skip_records=1000)) == 6977 - 1000
+
+
+def test_record_features_compressed(records: RecordFeatures, tmp_path: Path):
+    bgzip_path, gzip_path = tmp_path / 'records.vcf.gz', tmp_path / 'records.gz.vcf.gz'
+    with BgzfWriter(str(bgzip_path), 'wb') as bgzip_io:
+        bgzip_io.write(_VCF_PATH.read_bytes())
+    with gzip.open(str(gzip_path), 'wb') as gzip_io:
+        gzip_io.write(_VCF_PATH.read_bytes())
+
+    bgzip_records = RecordFeatures.scan(bgzip_path)
+    assert np.array_equal(bgzip_records.features, records.features)
+    shard = next(guided_shards(bgzip_records, CostModel(), workers=4))
+    assert shard[0].read_records() == VcfShard(
+        _VCF_PATH, int(records.starts[0]), int(records.ends[shard[0].n_records - 1]), shard[0].n_records).read_records()
+    # plain gzip offsets would be reached by decompressing everything before them
+    with pytest.raises(ValueError, match='bgzip'):
+        RecordFeatures.scan(gzip_path)
+
+
+def test_record_features_transcripts(records: RecordFeatures):
+    contig = next(shard_vcf(_VCF_PATH, 1)).read_records()[0].split(b'\t', 1)[0]
+    transcript_index = TranscriptIndex(
+        assembly_name='GRCh37', alt_aln_method='splign',
+        starts={'NC_1': np.array([0, 5, 10])}, ends={'NC_1': np.array([10**9, 10**9, 10**9])},
+        tx_acs={'NC_1': np.array(['NM_A', 'NR_B', 'NM_C'])})
+    probed = RecordFeatures.scan(_VCF_PATH, transcript_index, {contig.decode(): 'NC_1'})
+    first_contig = slice(0, probed.contig_starts[1])
+    # two coding transcripts span the first contig (all of it), none is indexed for the others
+    assert (probed.features[first_contig, 2] == 2 * probed.features[first_contig, 1]).all()
+    assert (probed.features[first_contig, 4] == 2 * probed.features[first_contig, 3]).all()
+    assert (probed.features[probed.contig_starts[1]:, [2, 4]] == 0).all()
+
+
+def test_count_coding_transcripts():
+    transcript_index = TranscriptIndex(
+        assembly_name='GRCh37', alt_aln_method='splign',
+        starts={'NC_000001.10': np.array([10, 50, 100])}, ends={'NC_000001.10': np.array([200, 60, 150])},
+        tx_acs={'NC_000001.10': np.array(['NM_A', 'NM_B', 'NR_C'])})
+    positions = np.array([10, 11, 55, 60, 61, 120, 200, 201])
+    assert transcript_index.count_coding_transcripts('NC_000001.10', positions).tolist() == [0, 1, 2, 2, 1, 1, 1, 0]
+    assert transcript_index.count_coding_transcripts('NC_000002.11', positions).tolist() == [0] * len(positions)
+
+
+@pytest.mark.parametrize('by_contig', [False, True])
+def test_guided_shards(records: RecordFeatures, by_contig: bool):
+    model = CostModel()
+    shards = list(guided_shards(records, model, workers=4, min_records=10, by_contig=by_contig))
+    # every record once, in order
+    assert sum(shard.n_records for shard, _ in shards) == len(records)
+    assert all(left.end == right.start for (left, _), (right, _) in zip(shards, shards[1:]))
+    assert np.allclose(sum(features for _, features in shards), records.features.sum(axis=0))
+    assert [record for shard, _ in shards for record in shard.read_records()] == \
+        VcfShard(_VCF_PATH, int(records.starts[0]), int(records.ends[-1]), len(records)).read_records()
+    # large chunks first, ever smaller ones towards the end
+    sizes = [shard.n_records for shard, _ in shards]
+    assert sizes[0] > 10 * sizes[-1]
+    assert min(sizes[:-1]) >= 1 if by_contig else min(sizes[:-1]) >= 10
+    if by_contig:
+        for shard, _ in shards:
+            assert len({record.split(b'\t', 1)[0] for record in shard.read_records()}) == 1
+
+
+def test_guided_shards_adapt(records: RecordFeatures):
+    expected = [shard for shard, _ in guided_shards(records, CostModel(), workers=2)]
+    model = CostModel()
+    shards = guided_shards(records, model, workers=2)
+    assert [next(shards)[0] for _ in range(2)] == expected[:2]
+    # SNVs observed to cost far more than the other alleles - later chunks are cut accordingly
+    model.observe(np.array([0, 1e4, 0, 0, 0]), 100.0)
+    model.observe(np.array([0, 0, 0, 1e4, 0]), 1e-3)
+    third, features = next(shards)
+    assert third != expected[2]
+    remaining = records.features[expected[0].n_records + expected[1].n_records:].sum(axis=0)
+    assert model.cost(features) == pytest.approx(model.cost(remaining) / 4, rel=0.1)
@@ -0,0 +1,86 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import pytest
+
+from tempus.sequences import FastaSequences, WindowedSequenceFetcher, index_fasta
+
+_CHR1 = 'ACGTACGTAC' * 5 + 'GGT'
+_CHR2 = 'TTGCA' * 4
+
+
+class _RecordingFetcher:
+    def __init__(self, seqs: dict):
+        self.seqs = seqs
+        self.fetches: List[Tuple[str, Optional[int], Optional[int]]] = []
+
+    def fetch_seq(self, ac: str, start_i: Optional[int] = None, end_i: Optional[int] = None) -> str:
+        self.fetches.append((ac, start_i, end_i))
+        return self.seqs[ac][start_i:end_i]
+
+
+@pytest.fixture
+def fasta(tmp_path: Path) -> Path:
+    fasta = tmp_path / 'ref.fa'
+    fasta.write_text(
+        '>1 some description\n' + ''.join(_CHR1[i:i + 12].lower() + '\n' for i in range(0, len(_CHR1), 12)) +
+        '>2\n' + ''.join(_CHR2[i:i + 12] + '\n' for i in range(0, len(_CHR2), 12)))
+    return fasta
+
+
+def test_fasta_sequences(fasta: Path):
+    sequences = FastaSequences(fasta, aliases={'NC_000001.10': '1'})
+    assert index_fasta(fasta).read_text().splitlines()[0] == '1\t53\t20\t12\t13'
+    assert 'NC_000001.10' in sequences and '2' in sequences and 'NC_000003.11' not in sequences
+    assert sequences.fetch_seq('NC_000001.10') == _CHR1
+    assert sequences.fetch_seq('2') == _CHR2
+    for start_i, end_i in [(0, 1), (5, 30), (11, 13), (12, 24), (40, 100), (53, 60)]:
+        assert sequences.fetch_seq('1', start_i, end_i) == _CHR1[start_i:end_i]
+    with pytest.raises(KeyError):
+        sequences.fetch_seq('NC_000003.11', 0, 10)
+
+
+def test_compressed_fasta(tmp_path: Path):
+    fasta = tmp_path / 'ref.fa.gz'
+    fasta.write_bytes(b'\x1f\x8b\x08\x00')
+    with pytest.raises(ValueError):
+        FastaSequences(fasta)
+
+
+def test_windowed_fetches():
+    fetcher = _RecordingFetcher({'1': _CHR1, '2': _CHR2})
+    windowed = WindowedSequenceFetcher(fetcher=fetcher, window_size=16)
+    for start_i, end_i in [(3, 7), (5, 20), (14, 40), (45, 60), (0, 53)]:
+        assert windowed.fetch_seq('1', start_i, end_i) == _CHR1[start_i:end_i]
+    # every window fetched once
+    assert fetcher.fetches == [('1', 0, 16), ('1', 16, 32), ('1', 32, 48), ('1', 48, 64)]
+    assert (windowed.stats.hits, windowed.stats.misses) == (8, 4)
+    assert windowed.stats.hit_rate == pytest.approx(2 / 3)
+
+    # whole sequences are passed through
+    assert windowed.fetch_seq('2') == _CHR2
+    assert fetcher.fetches[-1] == ('2', None, None)
+    assert windowed.stats.passthrough == 1
+    assert windowed.fetch_seq('2', 4, 4) == ''
+
+
+def test_window_eviction():
+    fetcher = _RecordingFetcher({'1': _CHR1})
+    windowed = WindowedSequenceFetcher(fetcher=fetcher, window_size=16, max_bytes=32)
+    windowed.fetch_seq('1', 0, 1)
+    windowed.fetch_seq('1', 16, 17)
+    windowed.fetch_seq('1', 1, 2)
+    # least recently used window (16-32) evicted
+    windowed.fetch_seq('1', 32, 33)
+    windowed.fetch_seq('1', 2, 3)
+    windowed.fetch_seq('1', 17, 18)
+    assert fetcher.fetches == [('1', 0, 16), ('1', 16, 32), ('1', 32, 48), ('1', 16, 32)]
+
+
+def test_windowed_local_reference(fasta: Path):
+    fetcher = _RecordingFetcher({'NC_000002.11': _CHR2})
+    windowed = WindowedSequenceFetcher(
+        fetcher=fetcher, local=FastaSequences(fasta, aliases={'NC_000001.10': '1'}), window_size=16)
+    assert windowed.fetch_seq('NC_000001.10', 10, 30) == _CHR1[10:30]
+    assert windowed.fetch_seq('NC_000002.11', 0, 5) == _CHR2[:5]
+    assert fetcher.fetches == [('NC_000002.11', 0, 16)]
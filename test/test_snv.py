@@ -0,0 +1,116 @@
+from typing import Any, Dict, List, Optional
+
+import pytest
+from hgvs.parser import Parser
+from hgvs.variantmapper import VariantMapper
+
+from tempus.hgvs import hgvs_from_snv_consequence
+from tempus.snv import TranscriptModel, SnvConsequence, is_snv
+
+# 5'UTR | ATG AAA GGG TTT CCC TGG TAA (M K G F P W *) | 3'UTR
+_CDS = 'ATGAAAGGGTTTCCCTGGTAA'
+_TX_SEQ = 'CC' + _CDS + 'GG'
+
+
+class _FakeDataProvider:
+    """
+    A two exon transcript (tx [0, 10) and [10, 25)) aligned to either strand.
+    """
+
+    def __init__(self, strand: int):
+        self.strand = strand
+
+    def get_tx_info(self, tx_ac: str, alt_ac: str, alt_aln_method: str) -> Dict[str, Any]:
+        return {'cds_start_i': 2, 'cds_end_i': 23}
+
+    def get_tx_identity_info(self, tx_ac: str) -> Dict[str, Any]:
+        return {'cds_start_i': 2, 'cds_end_i': 23}
+
+    def get_tx_exons(self, tx_ac: str, alt_ac: str, alt_aln_method: str) -> List[Dict[str, Any]]:
+        alt_spans = [(100, 110), (200, 215)] if self.strand == 1 else [(300, 310), (200, 215)]
+        # ordered by alt_start_i, as UTA serves them
+        return sorted((
+            {'ord': ord_, 'tx_start_i': tx_start_i, 'tx_end_i': tx_end_i, 'alt_start_i': alt_start_i,
+             'alt_end_i': alt_end_i, 'alt_strand': self.strand, 'cigar': f'{tx_end_i - tx_start_i}='}
+            for ord_, ((tx_start_i, tx_end_i), (alt_start_i, alt_end_i)) in enumerate(
+                zip([(0, 10), (10, 25)], alt_spans))), key=lambda exon: exon['alt_start_i'])
+
+    def get_seq(self, ac: str) -> str:
+        return _TX_SEQ
+
+    def get_pro_ac_for_tx_ac(self, tx_ac: str) -> Optional[str]:
+        return 'NP_FAKE.1'
+
+
+@pytest.mark.parametrize('strand, pos, ref, alt, hgvs_c, hgvs_p', [
+    pytest.param(1, 106, 'A', 'G', 'NM_FAKE.1:c.4A>G', 'NP_FAKE.1:p.(Lys2Glu)', id='missense'),
+    pytest.param(1, 201, 'G', 'A', 'NM_FAKE.1:c.9G>A', 'NP_FAKE.1:p.(Gly3=)', id='synonymous-across-exons'),
+    pytest.param(1, 209, 'G', 'A', 'NM_FAKE.1:c.17G>A', 'NP_FAKE.1:p.(Trp6Ter)', id='nonsense'),
+    pytest.param(-1, 305, 'T', 'C', 'NM_FAKE.1:c.4A>G', 'NP_FAKE.1:p.(Lys2Glu)', id='minus-missense'),
+    pytest.param(-1, 215, 'C', 'T', 'NM_FAKE.1:c.9G>A', 'NP_FAKE.1:p.(Gly3=)', id='minus-synonymous'),
+    pytest.param(-1, 207, 'C', 'T', 'NM_FAKE.1:c.17G>A', 'NP_FAKE.1:p.(Trp6Ter)', id='minus-nonsense'),
+])
+def test_snv_consequence(strand: int, pos: int, ref: str, alt: str, hgvs_c: str, hgvs_p: str):
+    model = TranscriptModel.from_data_provider(_FakeDataProvider(strand), 'NM_FAKE.1', 'NC_FAKE.1', 'splign')
+    consequence = model.snv_consequence(pos, ref, alt)
+    assert isinstance(consequence, SnvConsequence)
+    assert tuple(map(str, hgvs_from_snv_consequence(model, consequence))) == (hgvs_c, hgvs_p)
+
+
+@pytest.mark.parametrize('strand', [1, -1])
+def test_snv_consequence_matches_hgvs(strand: int):
+    """
+    Note: every SNV the fast path answers for (including mismatching ref bases), against hgvs g_to_c -> c_to_p.
+    """
+    hdp = _FakeDataProvider(strand)
+    variant_mapper = VariantMapper(hdp, replace_reference=False, prevalidation_level='NONE', add_gene_symbol=False)
+    model = TranscriptModel.from_data_provider(hdp, 'NM_FAKE.1', 'NC_FAKE.1', 'splign')
+    parser = Parser()
+    n_checked = 0
+    for pos in range(95, 320):
+        for ref in 'ACGT':
+            for alt in 'ACGT'.replace(ref, ''):
+                consequence = model.snv_consequence(pos, ref, alt)
+                if consequence is None:
+                    continue
+                hgvs_c = variant_mapper.g_to_c(parser.parse_hgvs_variant(f'NC_FAKE.1:g.{pos}{ref}>{alt}'), 'NM_FAKE.1')
+                hgvs_p = variant_mapper.c_to_p(hgvs_c)
+                fast_hgvs_c, fast_hgvs_p = hgvs_from_snv_consequence(model, consequence)
+                assert (str(fast_hgvs_c), str(fast_hgvs_p), fast_hgvs_p.posedit.edit.type) == \
+                       (str(hgvs_c), str(hgvs_p), hgvs_p.posedit.edit.type)
+                n_checked += 1
+    # codons 2-6, 3 positions, 4 ref and 3 alt bases
+    assert n_checked == 5 * 3 * 4 * 3
+
+
+@pytest.mark.parametrize('strand, pos', [
+    pytest.param(1, 101, id='5p-utr'),
+    pytest.param(1, 103, id='start-codon'),
+    pytest.param(1, 212, id='stop-codon'),
+    pytest.param(1, 215, id='3p-utr'),
+    pytest.param(1, 150, id='intron'),
+    pytest.param(-1, 308, id='minus-start-codon'),
+    pytest.param(-1, 250, id='minus-intron'),
+])
+def test_snv_consequence_fallback(strand: int, pos: int):
+    model = TranscriptModel.from_data_provider(_FakeDataProvider(strand), 'NM_FAKE.1', 'NC_FAKE.1', 'splign')
+    assert model.snv_consequence(pos, 'A', 'C') is None
+
+
+def test_unsupported_transcripts():
+    hdp = _FakeDataProvider(1)
+    exons = hdp.get_tx_exons('NM_FAKE.1', 'NC_FAKE.1', 'splign')
+    exons[1]['cigar'] = '5=1I9='
+    hdp.get_tx_exons = lambda *_: exons
+    assert TranscriptModel.from_data_provider(hdp, 'NM_FAKE.1', 'NC_FAKE.1', 'splign') is None
+
+    hdp = _FakeDataProvider(1)
+    hdp.get_tx_info = lambda *_: {'cds_start_i': None, 'cds_end_i': None}
+    assert TranscriptModel.from_data_provider(hdp, 'NR_FAKE.1', 'NC_FAKE.1', 'splign') is None
+
+
+def test_is_snv():
+    assert is_snv('A', 'G')
+    assert not is_snv('A', 'A')
+    assert not is_snv('A', 'AG')
+    assert not is_snv('A', 'N')
@@ -0,0 +1,147 @@
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import pytest
+from bioutils.digests import seq_md5
+from hgvs.exceptions import HGVSDataNotAvailableError
+from hgvs.parser import Parser
+from hgvs.variantmapper import VariantMapper
+
+from tempus.hgvs import TranscriptIndex
+from tempus.snv import TranscriptModel
+from tempus.uta_snapshot import UtaSnapshot, export_uta_snapshot, _UTA_SPANS_SQL, _UTA_TX_INFO_SQL, \
+    _UTA_TX_EXON_ALN_SQL, _UTA_TX_IDENTITY_INFO_SQL, _UTA_TX_TO_PRO_SQL, _UTA_PROTEIN_MD5_SQL, _UTA_GENE_SQL, \
+    _UTA_SEQ_SQL
+
+# 5'UTR | ATG AAA GGG TTT CCC TGG TAA (M K G F P W *) | 3'UTR
+_TX_SEQ = 'CC' + 'ATGAAAGGGTTTCCCTGGTAA' + 'GG'
+_PROTEIN_MD5 = seq_md5('MKGFPW')
+
+
+def _transcript(tx_ac: str, hgnc: str, alt_ac: str, strand: int, alt_spans: Sequence[tuple]) -> Dict[str, Any]:
+    return {
+        'tx_ac': tx_ac, 'hgnc': hgnc, 'alt_ac': alt_ac, 'alt_strand': strand,
+        'exons': [
+            {'tx_ac': tx_ac, 'alt_ac': alt_ac, 'alt_strand': strand, 'alt_aln_method': 'splign', 'ord': ord_,
+             'tx_start_i': tx_start_i, 'tx_end_i': tx_end_i, 'alt_start_i': alt_start_i, 'alt_end_i': alt_end_i,
+             'cigar': f'{tx_end_i - tx_start_i}='}
+            for ord_, ((tx_start_i, tx_end_i), (alt_start_i, alt_end_i)) in enumerate(
+                zip([(0, 10), (10, 25)], alt_spans))]}
+
+
+_TRANSCRIPTS = [
+    _transcript('NM_A.1', 'A', 'NC_000001.10', 1, [(100, 110), (200, 215)]),
+    _transcript('NM_B.1', 'B', 'NC_000002.11', -1, [(300, 310), (200, 215)]),
+    _transcript('NM_C.1', 'C', 'NC_000001.10', 1, [(1000, 1010), (1100, 1115)]),
+]
+
+
+class _FakeUta:
+    """
+    Answers the export queries of a few transcripts, the way the UTA database would.
+    """
+
+    def __init__(self):
+        self.queries: List[str] = []
+
+    def get_assembly_map(self, assembly_name: str) -> Dict[str, str]:
+        return {'NC_000001.10': '1', 'NC_000002.11': '2'}
+
+    def schema_version(self) -> str:
+        return '1.1'
+
+    def data_version(self) -> str:
+        return 'uta_fake'
+
+    def _fetchall(self, sql: str, args: List[Any]) -> List[Dict[str, Any]]:
+        self.queries.append(sql)
+        values = set(args[0])
+        txs = [tx for tx in _TRANSCRIPTS if tx['tx_ac'] in values]
+        if sql == _UTA_SPANS_SQL:
+            return [
+                {'tx_ac': tx['tx_ac'], 'alt_ac': tx['alt_ac'], 'alt_strand': tx['alt_strand'],
+                 'alt_aln_method': 'splign', 'start_i': min(exon['alt_start_i'] for exon in tx['exons']),
+                 'end_i': max(exon['alt_end_i'] for exon in tx['exons'])}
+                for tx in _TRANSCRIPTS if tx['alt_ac'] in values]
+        elif sql == _UTA_TX_INFO_SQL:
+            return [{'hgnc': tx['hgnc'], 'cds_start_i': 2, 'cds_end_i': 23, 'tx_ac': tx['tx_ac'],
+                     'alt_ac': tx['alt_ac'], 'alt_aln_method': 'splign'} for tx in txs]
+        elif sql == _UTA_TX_EXON_ALN_SQL:
+            return [exon for tx in txs for exon in tx['exons']]
+        elif sql == _UTA_TX_IDENTITY_INFO_SQL:
+            return [{'tx_ac': tx['tx_ac'], 'alt_ac': tx['tx_ac'], 'alt_aln_method': 'transcript', 'cds_start_i': 2,
+                     'cds_end_i': 23, 'lengths': [10, 15], 'hgnc': tx['hgnc']} for tx in txs]
+        elif sql == _UTA_TX_TO_PRO_SQL:
+            return [{'tx_ac': tx['tx_ac'], 'pro_ac': tx['tx_ac'].replace('NM_', 'NP_')} for tx in txs]
+        elif sql == _UTA_PROTEIN_MD5_SQL:
+            return [{'md5': _PROTEIN_MD5, 'ac': pro_ac} for pro_ac in sorted(values)]
+        elif sql == _UTA_GENE_SQL:
+            return [{'hgnc': hgnc, 'maploc': None, 'descr': f'gene {hgnc}', 'summary': None, 'aliases': None,
+                     'added': None} for hgnc in sorted(values)]
+        elif sql == _UTA_SEQ_SQL:
+            return [{'ac': tx['tx_ac'], 'seq': _TX_SEQ} for tx in txs]
+        raise AssertionError(f'unexpected query: {sql}')
+
+
+@pytest.fixture
+def snapshot(tmp_path: Path) -> UtaSnapshot:
+    return UtaSnapshot(export_uta_snapshot(_FakeUta(), tmp_path / 'uta.sqlite', 'GRCh37'))
+
+
+def test_snapshot_queries(snapshot: UtaSnapshot):
+    assert snapshot.data_version() == 'uta_fake'
+    exons = snapshot.get_tx_exons('NM_B.1', 'NC_000002.11', 'splign')
+    assert [(exon['ord'], exon['alt_start_i']) for exon in exons] == [(1, 200), (0, 300)]
+    assert snapshot.get_tx_info('NM_A.1', 'NC_000001.10', 'splign')['hgnc'] == 'A'
+    assert snapshot.get_tx_identity_info('NM_A.1')['lengths'] == [10, 15]
+    assert snapshot.get_pro_ac_for_tx_ac('NM_A.1') == 'NP_A.1'
+    assert snapshot.get_acs_for_protein_seq('MKGFPW') == ['NP_A.1', 'NP_B.1', 'NP_C.1', 'MD5_' + _PROTEIN_MD5]
+    assert snapshot.get_gene_info('C')['descr'] == 'gene C'
+    assert [row['tx_ac'] for row in snapshot.get_tx_for_gene('B')] == ['NM_B.1']
+    assert snapshot.get_tx_mapping_options('NM_A.1') == [
+        {'tx_ac': 'NM_A.1', 'alt_ac': 'NC_000001.10', 'alt_aln_method': 'splign'}]
+    assert [row['tx_ac'] for row in snapshot.get_tx_for_region('NC_000001.10', 'splign', 150, 150)] == ['NM_A.1']
+    assert snapshot.get_seq('NM_A.1') == _TX_SEQ
+    assert snapshot.get_seq('NM_A.1', 2, 5) == 'ATG'
+    with pytest.raises(HGVSDataNotAvailableError):
+        snapshot.get_tx_exons('NM_A.1', 'NC_000002.11', 'splign')
+    with pytest.raises(HGVSDataNotAvailableError):
+        snapshot.get_tx_info('NM_D.1', 'NC_000001.10', 'splign')
+    with pytest.raises(HGVSDataNotAvailableError):
+        snapshot.get_tx_identity_info('NM_D.1')
+
+
+def test_snapshot_variant_mapping(snapshot: UtaSnapshot):
+    variant_mapper = VariantMapper(
+        snapshot, replace_reference=False, prevalidation_level='NONE', add_gene_symbol=False)
+    parser = Parser()
+    for hgvs_g, tx_ac, expected_c, expected_p in [
+            ('NC_000001.10:g.106A>G', 'NM_A.1', 'NM_A.1:c.4A>G', 'NP_A.1:p.(Lys2Glu)'),
+            ('NC_000002.11:g.207C>T', 'NM_B.1', 'NM_B.1:c.17G>A', 'NP_B.1:p.(Trp6Ter)')]:
+        hgvs_c = variant_mapper.g_to_c(parser.parse_hgvs_variant(hgvs_g), tx_ac)
+        assert (str(hgvs_c), str(variant_mapper.c_to_p(hgvs_c))) == (expected_c, expected_p)
+    assert TranscriptModel.from_data_provider(snapshot, 'NM_B.1', 'NC_000002.11', 'splign').pro_ac == 'NP_B.1'
+
+
+def test_snapshot_transcript_index(snapshot: UtaSnapshot):
+    index = TranscriptIndex.from_data_provider(
+        snapshot, assembly_name='GRCh37', alt_aln_method='splign', alt_acs=['NC_000001.10', 'NC_000002.11'])
+    assert index.tx_acs['NC_000001.10'].tolist() == ['NM_A.1', 'NM_C.1']
+    assert index.tx_acs['NC_000002.11'].tolist() == ['NM_B.1']
+
+
+def test_restricted_export(tmp_path: Path):
+    snapshot = UtaSnapshot(export_uta_snapshot(_FakeUta(), tmp_path / 'contig.sqlite', 'GRCh37', contigs=['2']))
+    assert snapshot.data_version() == 'uta_fake'
+    assert [row['tx_ac'] for row in snapshot.get_tx_spans('NC_000001.10', 'splign')] == []
+    assert [row['tx_ac'] for row in snapshot.get_tx_spans('NC_000002.11', 'splign')] == ['NM_B.1']
+
+    snapshot = UtaSnapshot(export_uta_snapshot(_FakeUta(), tmp_path / 'panel.sqlite', 'GRCh37', genes=['C']))
+    assert snapshot.data_version().startswith('uta_fake:genes-')
+    assert [row['tx_ac'] for row in snapshot.get_tx_spans('NC_000001.10', 'splign')] == ['NM_C.1']
+    assert snapshot.get_gene_info('A') is None
+
+
+def test_missing_snapshot(tmp_path: Path):
+    with pytest.raises(FileNotFoundError):
+        UtaSnapshot(tmp_path / 'uta.sqlite')
@@ -0,0 +1,226 @@
+import gzip
+import io
+import math
+from pathlib import Path
+from typing import List
+
+import pytest
+from Bio.bgzf import BgzfWriter, BgzfReader
+from vcf import Reader
+
+from tempus.vcf import shard_vcf, open_vcf, vcf_compression, shard_vcf_stream, read_vcf_header, read_vcf, \
+    read_depth_allele, samples_containing_allele, VcfVariantAnnotation, BgzfStreamWriter, Region, MAX_POS, read_bed, \
+    merge_regions, shard_vcf_regions, VcfShard, StreamVcfShard
+
+_VCF_PATH = Path('test/data/data_sys_test.vcf')
+_CHALLENGE_VCF_PATH = Path('test/data/Challenge_data.vcf')
+
+
+@pytest.fixture(params=[None, 'gzip', 'bgzf'])
+def vcf_path(request, tmp_path: Path) -> Path:
+    if request.param == 'gzip':
+        path = tmp_path / 'test.vcf.gz'
+        with gzip.open(str(path), 'wb') as out_io:
+            out_io.write(_VCF_PATH.read_bytes())
+    elif request.param == 'bgzf':
+        path = tmp_path / 'test.vcf.bgz'
+        # small blocks, so that shards span several of them
+        with BgzfWriter(str(path), 'wb') as out_io:
+            for line in _VCF_PATH.read_bytes().splitlines(keepends=True):
+                out_io.write(line)
+                out_io.flush()
+    else:
+        path = _VCF_PATH
+    assert vcf_compression(path) == request.param
+    return path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_shard_vcf(vcf_path: Path, chunk_size: int):
+    lines = _VCF_PATH.read_text().splitlines(keepends=True)
+    header = [line for line in lines if line.startswith('#')]
+    records = [line for line in lines if not line.startswith('#')]
+
+    shards = list(shard_vcf(vcf_path, chunk_size))
+    assert [shard.n_records for shard in shards[:-1]] == [chunk_size] * (len(shards) - 1)
+    # plain gzip cannot be seeked into - its records are read once, along with the offsets
+    shard_type = StreamVcfShard if vcf_compression(vcf_path) == 'gzip' else VcfShard
+    assert all(type(shard) is shard_type for shard in shards)
+
+    shard_records = []
+    for shard in shards:
+        with open_vcf(shard) as shard_io:
+            shard_lines = shard_io.readlines()
+        assert shard_lines[:len(header)] == header
+        shard_records.extend(shard_lines[len(header):])
+    assert shard_records == records
+
+    with open_vcf(shards[0]) as shard_io:
+        assert next(read_vcf(shard_io)[1]).pos == int(records[0].split('\t')[1])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_shard_vcf_stream(vcf_path: Path, chunk_size: int):
+    expected = [shard.read_records() for shard in shard_vcf(vcf_path, chunk_size)]
+    with vcf_path.open('rb') as vcf_io:
+        header, shards = shard_vcf_stream(vcf_io, chunk_size)
+        assert header == read_vcf_header(vcf_path)
+        assert [shard.read_records() for shard in shards] == expected
+
+
+@pytest.mark.parametrize('chunk_size', [100, 1000])
+def test_shard_vcf_by_contig(chunk_size: int):
+    records = [line for line in _CHALLENGE_VCF_PATH.read_bytes().splitlines(keepends=True) if not line.startswith(b'#')]
+    shards = [shard.read_records() for shard in shard_vcf(_CHALLENGE_VCF_PATH, chunk_size, by_contig=True)]
+    assert [record for shard in shards for record in shard] == records
+    assert all(len({record.split(b'\t', 1)[0] for record in shard}) == 1 for shard in shards)
+    # contig 1 holds the most records (678)
+    assert max(map(len, shards)) == min(chunk_size, 678)
+    with _CHALLENGE_VCF_PATH.open('rb') as vcf_io:
+        _, stream_shards = shard_vcf_stream(vcf_io, chunk_size, by_contig=True)
+        assert [shard.read_records() for shard in stream_shards] == shards
+    resumed = shard_vcf(_CHALLENGE_VCF_PATH, chunk_size, skip_records=150, by_contig=True)
+    assert [record for shard in resumed for record in shard.read_records()] == records[150:]
+
+
+def test_regions(tmp_path: Path):
+    assert Region.parse('1') == Region('1', 1, MAX_POS)
+    assert Region.parse('X:1,000,000') == Region('X', 1000000, MAX_POS)
+    assert Region.parse(' 2:100-200 ') == Region('2', 100, 200)
+    for invalid in ['', '1:', '1:200-100', '1:0-10', '1:a-b']:
+        with pytest.raises(ValueError):
+            Region.parse(invalid)
+
+    bed_path = tmp_path / 'regions.bed'
+    bed_path.write_text('track name=panel\n2\t99\t200\tgene\n1\t0\t10\n\n2\t150\t300\n2\t300\t400\n3\t0\t5\n')
+    assert read_bed(bed_path)[:2] == [Region('2', 100, 200), Region('1', 1, 10)]
+    # ordered by the vcf contigs, overlapping and adjacent regions merged, unknown contigs left out
+    assert merge_regions(read_bed(bed_path), ['1', '2']) == [Region('1', 1, 10), Region('2', 100, 400)]
+
+
+@pytest.fixture
+def tabix_vcf_path(tmp_path: Path) -> Path:
+    pysam = pytest.importorskip('pysam')
+    path = tmp_path / 'challenge.vcf'
+    path.write_bytes(_CHALLENGE_VCF_PATH.read_bytes())
+    return Path(pysam.tabix_index(str(path), preset='vcf'))
+
+
+def _records_in(regions: List[Region]) -> List[bytes]:
+    return [
+        line for line in _CHALLENGE_VCF_PATH.read_bytes().splitlines(keepends=True)
+        if not line.startswith(b'#') and any(
+            line.split(b'\t')[0].decode() == region.contig and region.start <= int(line.split(b'\t')[1]) <= region.end
+            for region in regions)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 50, 10000])
+def test_shard_vcf_regions(tabix_vcf_path: Path, chunk_size: int):
+    regions = [Region.parse('2:1000000-5000000'), Region.parse('1'), Region.parse('2:4000000-20000000'),
+               Region.parse('Y')]
+    expected = _records_in(regions)
+    assert expected[0].startswith(b'1\t')
+
+    shards = list(shard_vcf_regions(tabix_vcf_path, regions, chunk_size))
+    assert [record for shard in shards for record in shard.read_records()] == expected
+    assert sum(shard.n_records for shard in shards) == len(expected)
+    assert all(
+        shard.n_records == chunk_size for shard in shards[:-1] if shard.region.contig == shards[-1].region.contig)
+    with open_vcf(shards[0]) as shard_io:
+        assert next(read_vcf(shard_io)[1]).pos == int(expected[0].split(b'\t')[1])
+
+    resumed = list(shard_vcf_regions(tabix_vcf_path, regions, chunk_size, skip_records=len(expected) - 3))
+    assert [record for shard in resumed for record in shard.read_records()] == expected[-3:]
+
+
+def test_shard_vcf_regions_between_positions(tmp_path: Path):
+    pysam = pytest.importorskip('pysam')
+    header = [line for line in _VCF_PATH.read_text().splitlines(keepends=True) if line.startswith('#')]
+    record = [line for line in _VCF_PATH.read_text().splitlines(keepends=True) if not line.startswith('#')][0]
+    fields = record.split('\t')
+    records = ['\t'.join([fields[0], str(pos)] + fields[2:]) for pos in [10, 20, 20, 20, 30, 40, 40]]
+    path = tmp_path / 'dups.vcf'
+    path.write_text(''.join(header + records))
+    path = Path(pysam.tabix_index(str(path), preset='vcf'))
+
+    shards = list(shard_vcf_regions(path, [Region.parse(fields[0])], chunk_size=2))
+    # records of a position stay together
+    assert [(shard.region.start, shard.region.end, shard.n_records) for shard in shards] == [
+        (10, 20, 4), (30, 40, 3)]
+    # unless resuming in the middle of one
+    resumed = list(shard_vcf_regions(path, [Region.parse(fields[0])], chunk_size=2, skip_records=2))
+    assert [(shard.region.start, shard.skip, shard.n_records) for shard in resumed] == [(20, 1, 2), (30, 0, 3)]
+    assert [record.decode() for shard in resumed for record in shard.read_records()] == records[2:]
+
+
+def test_read_vcf_matches_pyvcf():
+    with _VCF_PATH.open() as vcf_io, _VCF_PATH.open() as pyvcf_io:
+        header, records = read_vcf(vcf_io)
+        pyvcf_reader = Reader(pyvcf_io)
+        assert header.reference == pyvcf_reader.metadata['reference']
+        assert list(header.samples) == pyvcf_reader.samples
+        for record, pyvcf_record in zip(records, pyvcf_reader):
+            assert (record.contig, record.pos, record.ref, record.read_depth) == (
+                pyvcf_record.CHROM, pyvcf_record.POS, pyvcf_record.REF, pyvcf_record.INFO['DP'])
+            assert list(record.alts) == [alt.sequence for alt in pyvcf_record.ALT]
+            for allele_index in range(len(record.alts) + 1):
+                assert read_depth_allele(record, allele_index) == sum(
+                    call.data.DPR[allele_index] for call in pyvcf_record.samples)
+                assert samples_containing_allele(record, allele_index) == [
+                    call.sample for call in pyvcf_record.samples
+                    if any(int(gt_allele) == allele_index for gt_allele in call.gt_alleles)]
+
+
+def test_read_vcf_missing_values():
+    vcf_io = io.StringIO(
+        '##reference=/data/human_g1k_v37.fasta\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ta\tb\tc\n'
+        '1\t100\t.\tA\tC,G\t.\t.\tDP=30\tGT:DPR\t0/2:10,.,5\t./.\t1|1:3,12,0\n')
+    _, records = read_vcf(vcf_io)
+    record, = records
+    assert record.dpr.tolist() == [[10, 0, 5], [0, 0, 0], [3, 12, 0]]
+    assert record.gt.tolist() == [[0, 2], [-1, -1], [1, 1]]
+    assert VcfVariantAnnotation.from_vcf_locus(record, 2) == VcfVariantAnnotation(
+        read_depth_site=30, read_depth_alt=5, perc_reads_alt=5 / 13, containing_samples=['a'])
+
+
+@pytest.mark.parametrize('calls, key', [
+    pytest.param('0/1:3,x\t0/0:5,0', 'DPR', id='dpr'),
+    pytest.param('0/1:3,1\tA/0:5,0', 'GT', id='gt'),
+])
+def test_read_vcf_malformed_values(calls: str, key: str):
+    vcf_io = io.StringIO(
+        '##reference=/data/human_g1k_v37.fasta\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ta\tb\n'
+        f'2\t200\t.\tA\tC\t.\t.\tDP=30\tGT:DPR\t{calls}\n')
+    _, records = read_vcf(vcf_io)
+    with pytest.raises(ValueError, match=f'invalid {key} values of the record at 2:200'):
+        next(records)
+
+
+def test_vcf_variant_annotation_from_vcf_site():
+    vcf_io = io.StringIO(
+        '##reference=/data/human_g1k_v37.fasta\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ta\tb\tc\n'
+        '1\t100\t.\tA\tC,G\t.\t.\tDP=30\tGT:DPR\t0/2:0,4,5\t./.:.\t1:0,12\n')
+    _, records = read_vcf(vcf_io)
+    record, = records
+    ref_ann, c_ann, g_ann = VcfVariantAnnotation.from_vcf_site(record)
+    assert math.isnan(c_ann.perc_reads_alt)
+    assert (c_ann.read_depth_alt, c_ann.containing_samples) == (16, ['c'])
+    assert (g_ann.read_depth_alt, g_ann.containing_samples) == (5, ['a'])
+    assert ref_ann.containing_samples == ['a']
+
+
+def test_bgzf_stream_writer(tmp_path: Path):
+    data = b''.join(b'%d\tline\n' % idx for idx in range(50000))
+    out_path = tmp_path / 'out.bgz'
+    with out_path.open('wb') as out_io:
+        writer = BgzfStreamWriter(out_io)
+        writer.write(data[:1000])
+        writer.write(data[1000:])
+        writer.close()
+    assert vcf_compression(out_path) == 'bgzf'
+    assert gzip.decompress(out_path.read_bytes()) == data
+    with BgzfReader(str(out_path), 'rb') as bgzf_io:
+        assert b''.join(iter(bgzf_io.readline, b'')) == data